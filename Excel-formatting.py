@@ -1,6 +1,17 @@
-import pandas as pd
+import argparse
+import os
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+# 生成规则描述所需的列
+REQUIRED_COLUMNS = ['部件', '故障模式', '信号特征量', '诊断标准']
+# 各列在描述句子中的标签，顺序即句子中的顺序
+DESCRIPTION_LABELS = [('部件', '故障部件'), ('故障模式', '故障原因'), ('信号特征量', '特征量'), ('诊断标准', '诊断标准')]
+OUTPUT_FORMATS = ('txt', 'md', 'jsonl')
+
 
 def format_fault_description(row):
     """
@@ -12,32 +23,202 @@ def format_fault_description(row):
             f"诊断标准：{row['诊断标准']}")
 
 
-def process_equipment_faults(excel_path):
+def format_fault_descriptions(df):
+    """
+    按列拼接字符串，一次生成整张表的故障描述，结果与逐行调用 format_fault_description 相同
+
+    参数:
+    df: DataFrame, 包含 REQUIRED_COLUMNS 的故障表
+
+    返回:
+    Series: 与 df 行对应的故障描述
+    """
+    description = None
+    for column, label in DESCRIPTION_LABELS:
+        # 空单元格与逐行 f-string 的结果一致，写作 'nan'（新版 pandas 的 astype(str) 会保留缺失值）
+        part = f"{label}：" + df[column].astype(str).fillna('nan')
+        description = part if description is None else description + "  " + part
+    return description
+
+
+def _check_columns(columns, source):
+    missing = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing:
+        raise ValueError(f"{source} 必须包含以下列: {', '.join(REQUIRED_COLUMNS)}（缺少 {', '.join(missing)}）")
+
+
+def _excel_value(cell):
+    """
+    按 pandas.read_excel（openpyxl 引擎、dtype=object）的规则转换单元格：
+    空单元格、错误值与默认缺失值字符串为 NaN，整数值的数字为 int，其余数字为 float
+    """
+    value = cell.value
+    if value is None or cell.data_type == 'e':
+        return np.nan
+    if cell.data_type == 'n':
+        as_int = int(value)
+        return as_int if as_int == value else float(value)
+    if isinstance(value, str) and value in STR_NA_VALUES:
+        return np.nan
+    return value
+
+
+def _read_excel_chunks(path, chunksize):
+    # pandas.read_excel 不支持分块读取，用 openpyxl 的只读模式逐行读取工作表；
+    # 单元格按整表读取时的规则逐个转换并以 object 列保存，避免各块分别推断类型使同一数字写成 "3" 或 "3.0"
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows()
+        header = [str(cell.value).strip() if cell.value is not None else '' for cell in next(rows, ())]
+        _check_columns(header, path)
+        positions = [header.index(col) for col in REQUIRED_COLUMNS]
+        chunk = []
+        # 与 pandas.read_excel 相同：中间的空行保留为缺失值行（由 iter_fault_records 按部件为空丢弃），只去掉表尾的空行
+        blank_rows = 0
+        for row in rows:
+            if all(cell.value is None for cell in row):
+                blank_rows += 1
+                continue
+            chunk.extend([np.nan] * len(positions) for _ in range(blank_rows))
+            chunk.append([_excel_value(row[i]) if i < len(row) else np.nan for i in positions])
+            blank_rows = 0
+            while len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk[:chunksize], columns=REQUIRED_COLUMNS, dtype=object)
+                chunk = chunk[chunksize:]
+        if chunk:
+            yield pd.DataFrame(chunk, columns=REQUIRED_COLUMNS, dtype=object)
+    finally:
+        workbook.close()
+
+
+def read_fault_chunks(path, chunksize=50000):
+    """
+    分块读取故障表，只保留所需的列
+
+    参数:
+    path: str, Excel（.xlsx/.xlsm）或 CSV 文件路径
+    chunksize: int, 每块的行数；为 None 时整表读取
+
+    返回:
+    iterator: 依次产生各块 DataFrame
+
+    所需的列不做类型推断（Excel 按 object，CSV 按字符串读取）：整表与分块、不同的块大小得到相同的单元格值，
+    数字的写法不随块边界上的类型推断而变化
+    """
+    if os.path.splitext(path)[1].lower() == '.csv':
+        if chunksize is None:
+            df = pd.read_csv(path, dtype=str)
+            _check_columns(df.columns, path)
+            yield df[REQUIRED_COLUMNS]
+            return
+        _check_columns(pd.read_csv(path, nrows=0).columns, path)
+        yield from pd.read_csv(path, usecols=REQUIRED_COLUMNS, chunksize=chunksize, dtype=str)
+    elif chunksize is None:
+        df = pd.read_excel(path, dtype=object)
+        _check_columns(df.columns, path)
+        yield df[REQUIRED_COLUMNS]
+    else:
+        yield from _read_excel_chunks(path, chunksize)
+
+
+def iter_fault_records(path, chunksize=50000, group_by_part=True):
+    """
+    读取故障表并生成带 description 列的记录块
+
+    参数:
+    path: str, Excel 或 CSV 文件路径
+    chunksize: int, 每块的行数；为 None 时整表读取
+    group_by_part: bool, 是否按部件分组输出（部件按首次出现的顺序，组内保持原顺序）。
+        分组需要看到整张表，因此会先读完所有块（只保留所需的四列）再一次性排序；
+        为 False 时逐块处理并立即产出，内存占用与块大小成正比
+
+    返回:
+    iterator: 依次产生包含 REQUIRED_COLUMNS 与 description 列的 DataFrame
+
+    部件为空的行（包括表中的空行）不是有效规则，与原先按部件逐组筛选的结果一致被丢弃
+    """
+    chunks = (chunk[chunk['部件'].notna()] for chunk in read_fault_chunks(path, chunksize))
+    if group_by_part:
+        frames = list(chunks)
+        if not frames:
+            return
+        df = pd.concat(frames, ignore_index=True)
+        # factorize 按首次出现的顺序编号，稳定排序后组内顺序不变
+        codes, _ = pd.factorize(df['部件'])
+        df = df.iloc[np.argsort(codes, kind='stable')]
+        chunks = [df] if chunksize is None else (df.iloc[start:start + chunksize]
+                                                 for start in range(0, len(df), chunksize))
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk = chunk.reset_index(drop=True)
+        chunk['description'] = format_fault_descriptions(chunk)
+        yield chunk
+
+
+def process_equipment_faults(excel_path, chunksize=None):
     """
     处理设备故障Excel文件并生成格式化文档
 
     参数:
-    excel_path: str, Excel文件路径
+    excel_path: str, Excel 或 CSV 文件路径
+    chunksize: int, 分块读取的行数，None 表示整表读取
 
     返回:
     list: 格式化后的故障描述列表
     """
-    # 读取Excel文件
-    df = pd.read_excel(excel_path)
+    descriptions = []
+    for chunk in iter_fault_records(excel_path, chunksize):
+        descriptions.extend(chunk['description'].tolist())
+    return descriptions
+
 
-    # 确保所需列都存在
-    required_columns = ['部件', '故障模式', '信号特征量', '诊断标准']
-    if not all(col in df.columns for col in required_columns):
-        raise ValueError(f"Excel文件必须包含以下列: {', '.join(required_columns)}")
+def _format_block(output_format, numbers, chunk):
+    """把一块记录格式化为一段文本，各格式与 save_formatted_results 的原有格式一致"""
+    if output_format == 'jsonl':
+        return chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n'
+    if output_format == 'md':
+        blocks = '## ' + numbers + '. 故障描述\n' + chunk['description'] + '\n\n---\n\n'
+    else:
+        blocks = numbers + '. 故障描述：\n' + chunk['description'] + '\n\n' + '-' * 50 + '\n\n'
+    return ''.join(blocks.tolist())
+
+
+def write_formatted_results(records, output_formats=('txt', 'md'), timestamp=None):
+    """
+    单次遍历记录块，同时写出多种格式的文件
 
-    # 按部件分组处理
-    formatted_descriptions = []
-    for part in df['部件'].unique():
-        part_data = df[df['部件'] == part]
-        for _, row in part_data.iterrows():
-            formatted_descriptions.append(format_fault_description(row))
+    参数:
+    records: iterable, iter_fault_records 产生的 DataFrame 块
+    output_formats: tuple, 输出格式，取值见 OUTPUT_FORMATS
+    timestamp: str, 文件名中的时间戳，默认取当前时间
 
-    return formatted_descriptions
+    返回:
+    tuple: (各格式对应的文件名字典, 写出的记录数)
+    """
+    unknown = [fmt for fmt in output_formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"不支持的输出格式: {', '.join(unknown)}")
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    filenames = {fmt: f'equipment_faults_{timestamp}.{fmt}' for fmt in output_formats}
+    files = {fmt: open(filename, 'w', encoding='utf-8') for fmt, filename in filenames.items()}
+    count = 0
+    try:
+        if 'md' in files:
+            files['md'].write('# 设备故障描述汇总\n\n')
+        if 'txt' in files:
+            files['txt'].write('设备故障描述汇总\n')
+            files['txt'].write('=' * 50 + '\n\n')
+        for chunk in records:
+            numbers = pd.Series(np.arange(count + 1, count + len(chunk) + 1)).astype(str)
+            for fmt, f in files.items():
+                f.write(_format_block(fmt, numbers, chunk))
+            count += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    return filenames, count
 
 
 def save_formatted_results(descriptions, output_format='txt'):
@@ -46,54 +227,47 @@ def save_formatted_results(descriptions, output_format='txt'):
 
     参数:
     descriptions: list, 格式化后的故障描述列表
-    output_format: str, 输出格式 ('txt' 或 'md')
-    """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f'equipment_faults_{timestamp}.{output_format}'
-
-    with open(filename, 'w', encoding='utf-8') as f:
-        if output_format == 'md':
-            # Markdown 格式
-            f.write('# 设备故障描述汇总\n\n')
-            for i, desc in enumerate(descriptions, 1):
-                f.write(f'## {i}. 故障描述\n')
-                f.write(f'{desc}\n\n')
-                f.write('---\n\n')
-        else:
-            # TXT 格式
-            f.write('设备故障描述汇总\n')
-            f.write('=' * 50 + '\n\n')
-            for i, desc in enumerate(descriptions, 1):
-                f.write(f'{i}. 故障描述：\n')
-                f.write(f'{desc}\n\n')
-                f.write('-' * 50 + '\n\n')
-
-    return filename
+    output_format: str, 输出格式 ('txt'、'md' 或 'jsonl')
+    """
+    records = [pd.DataFrame({'description': list(descriptions)})]
+    filenames, _ = write_formatted_results(records, (output_format,))
+    return filenames[output_format]
 
 
 def main():
     """
     主函数
     """
+    parser = argparse.ArgumentParser(description='把设备故障表格式化为规则描述文档')
     # Excel文件路径
-    excel_path = 'F:\\pycharmprojects\\nlpcda\\pump-trouble.xlsx'  # 替换为实际的Excel文件路径
+    parser.add_argument('excel_path', nargs='?', default='F:\\pycharmprojects\\nlpcda\\pump-trouble.xlsx',
+                        help='Excel 或 CSV 文件路径')
+    parser.add_argument('--chunksize', type=int, default=50000, help='分块读取的行数，0 表示整表读取')
+    parser.add_argument('--formats', nargs='+', default=['txt', 'md'], choices=OUTPUT_FORMATS, help='输出格式')
+    parser.add_argument('--no-group', action='store_true', help='不按部件分组，按原表顺序流式处理')
+    args = parser.parse_args()
 
     try:
-        # 处理Excel文件
-        descriptions = process_equipment_faults(excel_path)
+        # 读取、格式化并同时写出所有格式
+        records = iter_fault_records(args.excel_path, args.chunksize or None, group_by_part=not args.no_group)
+        preview = []
+
+        def with_preview(chunks):
+            for chunk in chunks:
+                if len(preview) < 3:
+                    preview.extend(chunk['description'].head(3 - len(preview)).tolist())
+                yield chunk
 
-        # 保存结果（同时生成txt和md格式）
-        txt_file = save_formatted_results(descriptions, 'txt')
-        md_file = save_formatted_results(descriptions, 'md')
+        filenames, count = write_formatted_results(with_preview(records), tuple(args.formats))
 
-        print(f'处理完成！共处理 {len(descriptions)} 条故障记录')
+        print(f'处理完成！共处理 {count} 条故障记录')
         print(f'结果已保存到以下文件：')
-        print(f'TXT 格式：{txt_file}')
-        print(f'Markdown 格式：{md_file}')
+        for fmt, filename in filenames.items():
+            print(f'{fmt.upper()} 格式：{filename}')
 
         # 打印预览
         print('\n结果预览（前3条）：')
-        for i, desc in enumerate(descriptions[:3], 1):
+        for i, desc in enumerate(preview, 1):
             print(f'\n{i}. {desc}')
 
     except Exception as e:
@@ -101,4 +275,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
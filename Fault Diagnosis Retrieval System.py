@@ -53,24 +53,43 @@ class QueryMatchingSystem:
             similar_rules: 找到的相似规则列表
             scores: 相似度分数列表
         """
+        return self.process_queries([query_text], top_k)[0]
+
+    def process_queries(self, query_texts, top_k=5):
+        """
+        批量处理查询文本：整批编码后对堆叠的查询矩阵只执行一次FAISS搜索
+        Args:
+            query_texts: 用户输入的查询文本列表
+            top_k: 每条查询返回的最相似规则数量
+        Returns:
+            results: 与query_texts一一对应的 (combined_prompt, similar_rules, scores) 列表
+        """
+        query_texts = list(query_texts)
+        if not query_texts:
+            return []
+
         try:
-            # 1. 将查询文本转换为向量
-            query_vector = self.model.encode([query_text])[0]
-            query_vector = query_vector.reshape(1, -1).astype(np.float32)
+            # 1. 将全部查询文本一次性转换为向量矩阵
+            query_vectors = np.asarray(self.model.encode(query_texts), dtype=np.float32)
+            query_vectors = query_vectors.reshape(len(query_texts), -1)
 
-            # 2. 使用FAISS进行相似度搜索
-            distances, indices = self.index.search(query_vector, top_k)
+            # 2. 使用FAISS对整批查询进行一次相似度搜索
+            distances, indices = self.index.search(query_vectors, top_k)
 
-            # 3. 获取对应的规则文本
-            similar_rules = [self.texts[int(idx)] for idx in indices[0]]
+            results = []
+            for query_text, row_distances, row_indices in zip(query_texts, distances, indices):
+                # 3. 获取对应的规则文本（FAISS在结果不足top_k时以-1补位）
+                hits = [(int(idx), dist) for idx, dist in zip(row_indices, row_distances) if idx >= 0]
+                similar_rules = [self.texts[idx] for idx, _ in hits]
 
-            # 4. 计算相似度分数（将距离转换为相似度分数）
-            scores = [1 / (1 + dist) for dist in distances[0]]
+                # 4. 计算相似度分数（将距离转换为相似度分数）
+                scores = [1 / (1 + dist) for _, dist in hits]
 
-            # 5. 生成组合prompt
-            combined_prompt = self._generate_prompt(query_text, similar_rules, scores)
+                # 5. 生成组合prompt
+                combined_prompt = self._generate_prompt(query_text, similar_rules, scores)
+                results.append((combined_prompt, similar_rules, scores))
 
-            return combined_prompt, similar_rules, scores
+            return results
 
         except Exception as e:
             self.logger.error(f"处理查询时出错: {str(e)}")
@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import scrolledtext
 import datetime
 import os
+import queue
+import threading
 import all
 
 class ChatGUI:
@@ -14,7 +16,10 @@ class ChatGUI:
         """
         self.root = root
         self.integrated_system = integrated_system
+        self.stream_queue = queue.Queue()
+        self.is_processing = False
         self.setup_ui()
+        self.poll_ready()
 
         # 创建日志文件
         self.log_file = self.create_log_file()
@@ -52,32 +57,71 @@ class ChatGUI:
         self.clear_button = tk.Button(self.root, text="清空对话", command=self.clear_output)
         self.clear_button.pack(pady=10)
 
+        # 状态栏
+        self.status_label = tk.Label(self.root, text="正在加载检索模型...", anchor=tk.W)
+        self.status_label.pack(fill=tk.X, side=tk.BOTTOM)
+
+    def poll_ready(self):
+        """轮询后台加载状态，加载完成前界面照常可用"""
+        if not self.integrated_system.ready.is_set():
+            self.root.after(200, self.poll_ready)
+        elif self.integrated_system.init_error is not None:
+            self.status_label.config(text=f"检索模型加载失败: {self.integrated_system.init_error}")
+        else:
+            self.status_label.config(text="就绪")
+
     def process_input(self, event=None):
         """处理用户输入"""
         user_input = self.input_entry.get().strip()
-        if not user_input:
+        if not user_input or self.is_processing:
             return
 
         # 显示用户输入
         self.output_text.insert(tk.END, f"用户: {user_input}\n")
         self.output_text.insert(tk.END, "-" * 50 + "\n")
+        self.output_text.insert(tk.END, "助手: ")
 
-        # 调用集成系统处理查询
-        response = self.integrated_system.process_user_query(user_input)
+        # 清空输入框
+        self.input_entry.delete(0, tk.END)
 
-        # 显示系统回复
-        self.output_text.insert(tk.END, f"助手: {response}\n")
-        self.output_text.insert(tk.END, "=" * 50 + "\n\n")
+        # 在后台线程中流式获取回答，界面线程轮询队列逐段显示
+        self.is_processing = True
+        threading.Thread(target=self.stream_response, args=(user_input,), daemon=True).start()
+        self.root.after(50, self.drain_stream, user_input, [])
+
+    def stream_response(self, user_input):
+        """后台线程：把回答片段放入队列，结束时放入 None"""
+        try:
+            for chunk in self.integrated_system.stream_user_query(user_input):
+                self.stream_queue.put(chunk)
+        finally:
+            self.stream_queue.put(None)
+
+    def drain_stream(self, user_input, chunks):
+        """界面线程：显示队列中已到达的回答片段（Tkinter 控件只能在界面线程中操作）"""
+        while True:
+            try:
+                chunk = self.stream_queue.get_nowait()
+            except queue.Empty:
+                self.root.after(50, self.drain_stream, user_input, chunks)
+                return
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            self.output_text.insert(tk.END, chunk)
+            self.output_text.see(tk.END)
+
+        # 显示系统回复结束
+        self.output_text.insert(tk.END, "\n" + "=" * 50 + "\n\n")
+        self.is_processing = False
 
         # 保存对话到日志文件
-        self.save_to_log(user_input, response)
-
-        # 清空输入框
-        self.input_entry.delete(0, tk.END)
+        self.save_to_log(user_input, ''.join(chunks))
 
     def clear_output(self):
         """清空输出框"""
         self.output_text.delete(1.0, tk.END)
+        self.integrated_system.chatbot.clear_history()  # 同时清空发送给模型的多轮上下文
 
     def create_log_file(self):
         """创建日志文件"""
@@ -98,8 +142,9 @@ class ChatGUI:
 
 
 def main():
-    # 初始化集成系统
-    integrated_system = all.IntegratedSystem()
+    # 初始化集成系统（模型与索引在后台线程加载，窗口立即显示）
+    integrated_system = all.IntegratedSystem(background_init=True, retrieval_daemon=all.RETRIEVAL_DAEMON_ADDRESS,
+                                             tokenizer=all.LLM_TOKENIZER_PATH)
 
     # 创建图形化界面
     root = tk.Tk()
@@ -1,13 +1,18 @@
 import curses
 import json
 from datetime import datetime
-from all import IntegratedSystem
+from all import IntegratedSystem, LLM_TOKENIZER_PATH, RETRIEVAL_DAEMON_ADDRESS
 import threading
 
+STATUS_READY = "Chatbot | Enter: Send | F5: Save Chat | F8: Clear Chat | Ctrl+C: Quit"
+STATUS_LOADING = "Loading retrieval model... (you can type; queries run once it is ready)"
+
 class ChatTUI:
     def __init__(self, stdscr):
         self.stdscr = stdscr
-        self.system = IntegratedSystem()
+        # Model and index load on a worker thread so the UI is usable immediately
+        self.system = IntegratedSystem(background_init=True, retrieval_daemon=RETRIEVAL_DAEMON_ADDRESS,
+                                       tokenizer=LLM_TOKENIZER_PATH)
         self.chat_history = []
         self.input_buffer = []
         self.cursor_x = 0
@@ -45,7 +50,11 @@ class ChatTUI:
         self.status_win = curses.newwin(1, self.width, self.height - 1, 0)
 
     def run(self):
-        self.update_status("Chatbot | Enter: Send | F5: Save Chat | F8: Clear Chat | Ctrl+C: Quit")
+        if self.system.ready.is_set():
+            self.update_status(STATUS_READY)
+        else:
+            self.update_status(STATUS_LOADING)
+            threading.Thread(target=self.wait_for_system, daemon=True).start()
         self.refresh_all()
 
         while True:
@@ -93,32 +102,61 @@ class ChatTUI:
         # Get AI response in a separate thread
         threading.Thread(target=self.get_ai_response, args=(message,), daemon=True).start()
 
+    def wait_for_system(self):
+        self.system.ready.wait()
+        if self.is_processing:
+            return
+        if self.system.init_error is not None:
+            self.update_status(f"Failed to load retrieval model: {self.system.init_error}")
+        else:
+            self.update_status(STATUS_READY)
+        self.refresh_input()
+
     def get_ai_response(self, query):
         try:
-            response = self.system.process_user_query(query)
-            self.add_message("AI", response)
+            self.begin_message("AI")
+            for chunk in self.system.stream_user_query(query):
+                self.append_to_message(chunk)
+            self.end_message()
         except Exception as e:
+            self.end_message()
             self.add_message("Error", f"Error: {str(e)}")
         finally:
             self.is_processing = False
-            self.update_status("Chatbot | Enter: Send | F5: Save Chat | F8: Clear Chat | Ctrl+C: Quit")
+            self.update_status(STATUS_READY)
             self.refresh_all()
 
     def add_message(self, sender, message):
+        self.begin_message(sender)
+        self.append_to_message(message)
+        self.end_message()
+
+    def begin_message(self, sender):
+        """Start a new message; its text is rendered incrementally by append_to_message"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         self.chat_history.append({
             "timestamp": timestamp,
             "sender": sender,
-            "message": message
+            "message": ""
         })
 
-        # Add message to chat window
+        # Add message header to chat window
         self.chat_win.addstr(f"[{timestamp}] ", curses.A_DIM)
         if sender == "User":
             self.chat_win.addstr(f"{sender}: ", curses.color_pair(1))
         else:
             self.chat_win.addstr(f"{sender}: ", curses.color_pair(2))
-        self.chat_win.addstr(f"{message}\n\n")
+        self.chat_win.refresh()
+
+    def append_to_message(self, text):
+        """Append streamed text to the message started by begin_message"""
+        self.chat_history[-1]["message"] += text
+        self.chat_win.addstr(text)
+        self.chat_win.refresh()
+        self.refresh_input()
+
+    def end_message(self):
+        self.chat_win.addstr("\n\n")
         self.chat_win.refresh()
 
     def save_chat(self):
@@ -133,6 +171,7 @@ class ChatTUI:
 
     def clear_chat(self):
         self.chat_history.clear()
+        self.system.chatbot.clear_history()  # 同时清空发送给模型的多轮上下文
         self.chat_win.clear()
         self.update_status("Chat cleared.")
         self.refresh_all()
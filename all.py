@@ -1,27 +1,189 @@
 import numpy as np
 import faiss
+import asyncio
 import json
-from sentence_transformers import SentenceTransformer
 import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
 import requests
+from api_pool import BackendPool
+from conversation import ConversationHistory
+from lexical_index import LexicalIndex, lexical_index_exists, lexical_index_path_for
+from dedup import SourceMap, source_map_path_for
+from onnx_encoder import load_encoder
+from query_cache import EmbeddingCache, ResponseCache
+from rule_records import RuleTable, rule_table_path_for
+from rule_store import RuleStore, rule_store_exists
+
+
+MODEL_PATH = '/home/wyb/hp/pycharm_projects/nlpcda/model/all-MiniLM-L6-v2'
+# 推理服务（deepseekapi.py）加载的模型，对话历史用它的分词器计算 token 数
+LLM_TOKENIZER_PATH = '/home/wyb/hp/pycharm_projects/nlpcda/deepseek/deepseek-ai/deepseek-llm-7b-chat'
+# onnx_encoder.py export 导出的 ONNX 模型目录
+ONNX_MODEL_PATH = MODEL_PATH + '-onnx'
+# 本机检索守护进程（retrieval-daemon.py）的默认地址
+RETRIEVAL_DAEMON_ADDRESS = ('127.0.0.1', 6007)
+# 检索守护进程的认证密钥：优先读取环境变量，否则读取仅当前用户可读的密钥文件（守护进程首次在本机地址启动时生成）。
+# 连接使用 pickle 传递数据，知道密钥即可让对方反序列化任意对象，因此密钥不能写在源码中
+RETRIEVAL_DAEMON_AUTHKEY_ENV = 'NLPCDA_RETRIEVAL_AUTHKEY'
+RETRIEVAL_DAEMON_AUTHKEY_PATH = os.path.join(os.path.expanduser('~'), '.nlpcda', 'retrieval-daemon.key')
+# 检索 HTTP 服务（retrieval-service.py）的默认地址
+RETRIEVAL_SERVICE_URL = 'http://127.0.0.1:6008'
+# 按行与索引位置对应的规则文本文件
+DEFAULT_TEXTS_PATH = 'similar_words_results_20250116_142217.txt'
+
+
+def load_index_params(index_path):
+    """
+    读取 faiss-cpu.py 构建索引时保存的参数文件，旧索引没有参数文件时视为 Flat 索引
+    """
+    try:
+        with open(index_path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'index_type': 'flat'}
+
+
+def default_texts_path(index_path):
+    """
+    索引对应的规则文本：rule_ingest.py 在 <index_path>.rules 写入按 FAISS ID 查找的规则存储，存在时使用它，
+    否则使用按行对应的 DEFAULT_TEXTS_PATH
+    """
+    store_path = index_path + '.rules'
+    return store_path if rule_store_exists(store_path) else DEFAULT_TEXTS_PATH
+
+
+def load_daemon_authkey(path=RETRIEVAL_DAEMON_AUTHKEY_PATH, create=False):
+    """
+    读取检索守护进程的认证密钥
+    Args:
+        path: 密钥文件路径，环境变量 RETRIEVAL_DAEMON_AUTHKEY_ENV 已设置时不读取
+        create: 密钥文件不存在时是否生成一个随机密钥（权限 0600）
+    Returns:
+        密钥（bytes）；未配置且 create 为 False 时返回 None
+    """
+    key = os.environ.get(RETRIEVAL_DAEMON_AUTHKEY_ENV)
+    if key:
+        return key.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if os.name == 'posix':
+                st = os.fstat(f.fileno())
+                if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                    raise PermissionError(f"检索守护进程的密钥文件 {path} 必须属于当前用户且权限为 0600")
+            key = f.read().strip()
+    except FileNotFoundError:
+        if not create:
+            return None
+        import secrets
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # 先写完临时文件再硬链接到目标路径：多个进程同时生成时只有一个成功，且不会读到写了一半的密钥
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secrets.token_hex(32).encode('ascii'))
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+        return load_daemon_authkey(path)
+    if not key:
+        raise ValueError(f"检索守护进程的密钥文件 {path} 为空")
+    return key
+
+
+def encoder_model_path(encoder_backend='torch'):
+    """编码器后端对应的默认模型路径"""
+    return MODEL_PATH if encoder_backend == 'torch' else ONNX_MODEL_PATH
+
+
+def embedding_cache_namespace(encoder_backend='torch', model_path=None):
+    """查询向量缓存的命名空间：不同后端（尤其是 int8 量化）产生的向量不同，不能共用缓存"""
+    model_path = model_path or encoder_model_path(encoder_backend)
+    return model_path if encoder_backend == 'torch' else f"{model_path}#{encoder_backend}"
+
+
+def format_prompt(query_text, similar_rules, scores, omitted_rules=0):
+    """
+    生成组合prompt
+    Args:
+        query_text: 原始查询文本
+        similar_rules: 相似规则列表
+        scores: 相似度分数列表
+        omitted_rules: 已在前几轮对话中给出、本轮不再重复的规则数量
+    Returns:
+        combined_prompt: 组合后的prompt
+    """
+    # 固定的说明与规则在前、本次查询在后：同一部件的查询命中的规则高度重复，
+    # 推理服务的前缀缓存可以复用这部分的 KV；随查询变化的相似度分数放在最后
+    prompt_template = """请根据以下相关规则和用户查询进行分析并给出建议。
+
+相关规则参考：
+{rules}
+用户查询：
+{query}
+
+规则相似度：{scores}
+"""
+    # 格式化相似规则
+    rules_text = ""
+    for i, rule in enumerate(similar_rules, 1):
+        rules_text += f"{i}. {rule}\n\n"
+    if omitted_rules:
+        rules_text += f"另有 {omitted_rules} 条相关规则已在前文给出，此处不再重复。\n\n"
+    scores_text = "，".join(f"{i}. {score:.4f}" for i, score in enumerate(scores, 1))
+
+    return prompt_template.format(
+        query=query_text,
+        rules=rules_text,
+        scores=scores_text
+    )
 
 
 class QueryMatchingSystem:
-    def __init__(self, index_path='faiss_index.index', texts_path='similar_words_results_20250116_142217.txt'):
+    def __init__(self, index_path='faiss_index.index', texts_path=None,
+                 embedding_cache=None, min_score=None, model_path=None, encoder=None, encoder_backend='torch',
+                 source_map_path=None, collapse_overfetch=4, rule_table_path=None, lexical_index_path=None, rrf_k=60):
         """
         初始化查询匹配系统
         Args:
             index_path: FAISS索引文件路径
-            texts_path: 规则文本文件路径
+            texts_path: 规则文本文件路径，或 rule_store.py 生成的二进制规则存储前缀（按FAISS ID查找），
+                默认见 default_texts_path；rule_ingest.py 构建的 ID 映射索引只能与规则存储配合使用
+            embedding_cache: 可选的 EmbeddingCache，命中时跳过模型前向计算
+            min_score: 默认的相似度下限，向量相似度低于该分数的规则不会进入prompt（BM25 命中的规则除外，见 process_queries）
+            model_path: 编码模型路径，默认为 encoder_backend 对应的路径
+            encoder: 可选的编码器（如 encoder_pool.EncoderPool），指定后不在本进程加载模型
+            encoder_backend: 'torch'、'onnx' 或 'onnx-int8'，见 onnx_encoder.py
+            source_map_path: dedup.py 生成的变体 -> 来源规则映射，默认查找 <texts_path>.sources.json；
+                存在映射时命中同一来源规则的多个变体合并为一条，并以来源规则文本写入prompt
+            collapse_overfetch: 存在映射时多取 top_k 的倍数个结果，合并后仍能凑够 top_k 条不同的规则
+            rule_table_path: rule_records.py 生成的结构化字段表，默认查找 <texts_path>.table.npz；
+                存在字段表时检索可以按部件或特征量预先过滤（IVF 索引上过滤越严格探查的聚类越多，见 _search_params）
+            lexical_index_path: lexical_index.py 生成的 BM25 倒排索引前缀，默认查找 <texts_path>.lex；
+                存在倒排索引时以倒数排名融合（RRF）合并向量检索与词法检索的结果
+            rrf_k: RRF 的平滑常数，融合得分为 sum(1 / (rrf_k + 排名))
         """
         # 设置日志
         logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-        # 尝试加载模型
+        # 尝试加载模型（torch / onnxruntime 导入较慢，推迟到真正需要模型时）
         try:
-            self.model = SentenceTransformer('/home/wyb/hp/pycharm_projects/nlpcda/model/all-MiniLM-L6-v2')
-            self.logger.info("成功加载向量化模型")
+            if encoder is not None:
+                self.model = encoder
+            else:
+                self.model = load_encoder(encoder_backend, model_path or encoder_model_path(encoder_backend))
+            self.logger.info(f"成功加载向量化模型（{encoder_backend}）")
         except Exception as e:
             self.logger.error(f"加载向量化模型失败: {str(e)}")
             raise
@@ -29,157 +191,777 @@ class QueryMatchingSystem:
         # 加载FAISS索引
         try:
             self.index = faiss.read_index(index_path)
-            self.logger.info(f"成功加载FAISS索引，包含 {self.index.ntotal} 个向量")
+            self.index_params = load_index_params(index_path)
+            self.logger.info(f"成功加载FAISS索引（{self.index_params['index_type']}），包含 {self.index.ntotal} 个向量")
         except Exception as e:
             self.logger.error(f"加载FAISS索引失败: {str(e)}")
             raise
 
         # 加载规则文本
+        texts_path = texts_path or default_texts_path(index_path)
         try:
-            with open(texts_path, 'r', encoding='utf-8') as f:
-                self.texts = [line.strip() for line in f.readlines() if line.strip()]
+            if rule_store_exists(texts_path):
+                # 内存映射的规则存储，必须与当前索引属于同一次构建
+                self.texts = RuleStore(texts_path, expected_build_id=self.index_params.get('build_id'))
+            elif self.index_params.get('id_map'):
+                # ID 映射索引删除过规则后 FAISS ID 不再连续，按行号对应会静默返回错误的规则
+                raise ValueError(f"{index_path} 是 rule_ingest.py 构建的 ID 映射索引，不能与按行对应的规则文本 "
+                                 f"{texts_path} 配合使用，请使用规则存储 {index_path}.rules")
+            else:
+                with open(texts_path, 'r', encoding='utf-8') as f:
+                    self.texts = [line.strip() for line in f.readlines() if line.strip()]
             self.logger.info(f"成功加载规则文本，共 {len(self.texts)} 条")
         except Exception as e:
             self.logger.error(f"加载规则文本失败: {str(e)}")
             raise
 
-    def process_query(self, query_text, top_k=5):
+        # 加载变体 -> 来源规则映射（可选）
+        source_map_path = source_map_path or source_map_path_for(texts_path)
+        self.source_map = None
+        if os.path.exists(source_map_path):
+            self.source_map = SourceMap(source_map_path)
+            self.logger.info(f"成功加载来源规则映射，共 {len(self.source_map)} 条来源规则")
+        self.collapse_overfetch = collapse_overfetch
+
+        # 加载结构化字段表（可选），必须与当前索引属于同一次构建
+        rule_table_path = rule_table_path or rule_table_path_for(texts_path)
+        self.rule_table = None
+        if os.path.exists(rule_table_path):
+            self.rule_table = RuleTable(rule_table_path, expected_build_id=self.index_params.get('build_id'))
+            self.logger.info(f"成功加载规则字段表，共 {len(self.rule_table)} 条规则")
+        self._selectors = {}
+
+        # 加载 BM25 倒排索引（可选），"1xRPM""峭度"等精确术语由词法检索补充召回
+        lexical_index_path = lexical_index_path or lexical_index_path_for(texts_path)
+        self.lexical_index = None
+        if lexical_index_exists(lexical_index_path):
+            self.lexical_index = LexicalIndex(lexical_index_path, expected_build_id=self.index_params.get('build_id'))
+            self.logger.info(f"成功加载BM25倒排索引，共 {len(self.lexical_index)} 条规则")
+        self.rrf_k = rrf_k
+
+        self.embedding_cache = embedding_cache
+        self.min_score = min_score
+        self.index_path = index_path
+        self.texts_path = texts_path
+        self.encoder_namespace = embedding_cache_namespace(encoder_backend, model_path)
+
+    def describe(self):
+        """
+        返回已加载的索引、规则与编码器的标识，检索守护进程的客户端据此确认守护进程加载的是自己期望的数据
+        """
+        return {
+            'index_path': os.path.realpath(self.index_path),
+            'texts_path': os.path.realpath(self.texts_path),
+            'build_id': self.index_params.get('build_id'),
+            'encoder': self.encoder_namespace,
+            'ntotal': self.index.ntotal,
+        }
+
+    def process_query(self, query_text, top_k=5, nprobe=None, ef_search=None, min_score=None, component=None,
+                      feature=None):
         """
         处理查询文本
         Args:
             query_text: 用户输入的查询文本
             top_k: 返回的最相似规则数量
+            nprobe: IVF索引本次查询的聚类数量，None 表示使用构建时保存的默认值
+            ef_search: HNSW索引本次查询的 efSearch，None 表示使用构建时保存的默认值
+            min_score: 本次查询的相似度下限，None 表示使用初始化时的默认值
+            component: 只在该部件（子串匹配）的规则中检索，需要规则字段表
+            feature: 只在包含该特征量（子串匹配）的规则中检索，需要规则字段表
         Returns:
             combined_prompt: 组合后的prompt
             similar_rules: 找到的相似规则列表
             scores: 相似度分数列表
         """
+        return self.process_queries([query_text], top_k, nprobe, ef_search, min_score, component, feature)[0]
+
+    def process_queries(self, query_texts, top_k=5, nprobe=None, ef_search=None, min_score=None, component=None,
+                        feature=None):
+        """
+        批量处理查询文本：整批编码后对堆叠的查询矩阵只执行一次FAISS搜索
+        Args:
+            query_texts: 用户输入的查询文本列表
+            top_k: 每条查询返回的最相似规则数量
+            nprobe: IVF索引本次查询的聚类数量
+            ef_search: HNSW索引本次查询的 efSearch
+            min_score: 本次查询的向量相似度下限，在与词法检索融合之前过滤向量检索结果
+            component: 只在该部件的规则中检索
+            feature: 只在包含该特征量的规则中检索
+        Returns:
+            results: 与query_texts一一对应的 (combined_prompt, similar_rules, scores) 列表
+        """
+        query_texts = list(query_texts)
+        if not query_texts:
+            return []
+
         try:
-            # 1. 将查询文本转换为向量
-            query_vector = self.model.encode([query_text])[0]
-            query_vector = query_vector.reshape(1, -1).astype(np.float32)
+            # 0. 按结构化字段筛选候选规则，没有任何规则满足条件时无需编码与搜索
+            selector = self._selector(component, feature)
+            if selector is not None and selector[1] == 0:
+                return [(self._generate_prompt(query_text, [], []), [], []) for query_text in query_texts]
+
+            # 1. 将全部查询文本一次性转换为向量矩阵
+            query_vectors = self._encode_queries(query_texts)
 
-            # 2. 使用FAISS进行相似度搜索
-            distances, indices = self.index.search(query_vector, top_k)
+            # 2. 使用FAISS对整批查询进行一次相似度搜索（只在筛选出的ID中搜索）
+            allowed_ids = selector[2] if selector is not None else None
+            search_params = self._search_params(nprobe, ef_search, *(selector[:2] if selector is not None else ()))
+            search_k = top_k * self.collapse_overfetch if self.source_map is not None else top_k
+            distances, indices = self.index.search(query_vectors, search_k, params=search_params)
 
-            # 3. 获取对应的规则文本
-            similar_rules = [self.texts[int(idx)] for idx in indices[0]]
+            # 3. 将距离整体转换为相似度分数
+            all_scores = self._distances_to_scores(distances)
+            if min_score is None:
+                min_score = self.min_score
 
-            # 4. 计算相似度分数（将距离转换为相似度分数）
-            scores = [1 / (1 + dist) for dist in distances[0]]
+            results = []
+            for query_text, query_vector, row_scores, row_indices in zip(query_texts, query_vectors, all_scores,
+                                                                         indices):
+                # 4. FAISS在结果不足时以-1补位；相似度下限只作用于向量检索结果，在融合之前过滤，
+                #    只被词法检索命中的精确术语匹配不受向量相似度下限影响
+                keep = row_indices >= 0
+                if min_score is not None:
+                    keep &= row_scores >= min_score
+                row_ids, row_scores = row_indices[keep], row_scores[keep]
+                if self.lexical_index is not None:
+                    row_ids, row_scores = self._fuse(query_text, query_vector, row_ids, row_scores, search_k,
+                                                     allowed_ids)
 
-            # 5. 生成组合prompt
-            combined_prompt = self._generate_prompt(query_text, similar_rules, scores)
+                # 5. 获取对应的规则文本
+                similar_rules = [self.texts[int(idx)] for idx in row_ids]
+                scores = row_scores.tolist()
+                if self.source_map is not None:
+                    # 同一来源规则的多个变体只保留得分最高的一次
+                    similar_rules, scores = self.source_map.collapse(similar_rules, scores, top_k)
+                else:
+                    similar_rules, scores = similar_rules[:top_k], scores[:top_k]
 
-            return combined_prompt, similar_rules, scores
+                # 6. 生成组合prompt
+                combined_prompt = self._generate_prompt(query_text, similar_rules, scores)
+                results.append((combined_prompt, similar_rules, scores))
+
+            return results
 
         except Exception as e:
             self.logger.error(f"处理查询时出错: {str(e)}")
             raise
 
+    def _distances_to_scores(self, distances):
+        """
+        将FAISS返回的距离矩阵转换为相似度分数
+        内积索引（归一化向量）直接返回余弦相似度；归一化向量上的平方L2距离换算为余弦相似度 1 - d/2；
+        未归一化的旧索引沿用 1 / (1 + d)
+        """
+        if self.index_params.get('metric') == 'ip':
+            return distances
+        if self.index_params.get('normalized'):
+            return 1 - distances / 2
+        return 1 / (1 + distances)
+
+    def _fuse(self, query_text, query_vector, vector_ids, vector_scores, k, allowed_ids=None):
+        """
+        以倒数排名融合（RRF）合并向量检索与 BM25 检索的前 k 条结果，按融合得分降序返回 (FAISS ID, 相似度分数)；
+        分数仍是向量相似度，只被词法检索命中的规则另行计算相似度；vector_ids 应已按 min_score 过滤，
+        融合后不再按分数过滤，词法检索命中的规则即使向量相似度较低也会保留
+        """
+        lexical_ids, _ = self.lexical_index.search(query_text, k, allowed_ids)
+        fused = {}
+        for ranked in (vector_ids.tolist(), lexical_ids.tolist()):
+            for rank, rule_id in enumerate(ranked):
+                fused[rule_id] = fused.get(rule_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        scores = dict(zip(vector_ids.tolist(), vector_scores.tolist()))
+        missing = [rule_id for rule_id in fused if rule_id not in scores]
+        if missing:
+            scores.update(self._vector_scores(query_vector, missing))
+        order = sorted((rule_id for rule_id in fused if rule_id in scores), key=fused.get, reverse=True)
+        return np.array(order, dtype=np.int64), np.array([scores[rule_id] for rule_id in order], dtype=np.float32)
+
+    def _vector_scores(self, query_vector, rule_ids):
+        """计算指定规则与查询向量的相似度分数，返回 {FAISS ID: 分数}"""
+        rule_ids = np.asarray(rule_ids, dtype=np.int64)
+        try:
+            vectors = self.index.reconstruct_batch(rule_ids)
+        except RuntimeError:
+            # IVF 等不能按ID取回向量的索引：只在这些ID上搜索全部聚类
+            params = self._search_params(faiss.extract_index_ivf(self.index).nlist, None,
+                                         faiss.IDSelectorBatch(rule_ids))
+            distances, indices = self.index.search(query_vector[None, :], len(rule_ids), params=params)
+            keep = indices[0] >= 0
+            return dict(zip(indices[0][keep].tolist(), self._distances_to_scores(distances[0][keep]).tolist()))
+        if self.index_params.get('metric') == 'ip':
+            distances = vectors @ query_vector
+        else:
+            distances = ((vectors - query_vector) ** 2).sum(axis=1)
+        return dict(zip(rule_ids.tolist(), self._distances_to_scores(distances).tolist()))
+
+    def _selector(self, component=None, feature=None):
+        """
+        按部件 / 特征量构造 FAISS ID 选择器，返回 (IDSelectorBatch, 选中的规则数, 选中的ID)，未指定条件时返回 None；
+        同一组条件的选择器会被缓存
+        """
+        if component is None and feature is None:
+            return None
+        if self.rule_table is None:
+            raise ValueError("未加载规则字段表，无法按部件或特征量过滤")
+        key = (component, feature)
+        selector = self._selectors.get(key)
+        if selector is None:
+            ids = self.rule_table.select_ids(component, feature)
+            selector = (faiss.IDSelectorBatch(ids), len(ids), ids)
+            if len(self._selectors) >= 256:
+                self._selectors.clear()
+            self._selectors[key] = selector
+        return selector
+
+    def _search_params(self, nprobe=None, ef_search=None, selector=None, selected_count=None):
+        """
+        构造单次查询的搜索参数：以请求级参数权衡召回率与延迟，不修改共享的索引对象；
+        selector 为 FAISS ID 选择器，只在选中的向量中搜索，selected_count 为选中的向量数。
+        IVF 索引上的选择器只在被探查的 nprobe 个聚类内过滤，选中的规则不在这些聚类中时什么也找不到，
+        因此按选中比例放大 nprobe（最多探查全部聚类），使被探查的候选规则数与不过滤时相当；
+        过滤条件越严格，探查的聚类越多，条件足够严格时等同于在选中的规则中精确搜索
+        """
+        index_type = self.index_params.get('index_type', 'flat')
+        if index_type in ('ivf_flat', 'ivf_pq'):
+            nprobe = nprobe if nprobe is not None else self.index_params['nprobe']
+            if selector is not None and selected_count:
+                nlist = faiss.extract_index_ivf(self.index).nlist
+                nprobe = min(nlist, math.ceil(nprobe * self.index.ntotal / selected_count))
+            return faiss.SearchParametersIVF(nprobe=nprobe, sel=selector)
+        if index_type == 'hnsw':
+            return faiss.SearchParametersHNSW(
+                efSearch=ef_search if ef_search is not None else self.index_params['efSearch'], sel=selector)
+        if selector is not None:
+            return faiss.SearchParameters(sel=selector)
+        return None
+
+    def _encode_queries(self, query_texts):
+        """
+        将查询文本编码为 float32 向量矩阵，优先使用向量缓存，未命中的查询合并为一次模型调用
+        """
+        if self.embedding_cache is None:
+            vectors = np.asarray(self.model.encode(query_texts), dtype=np.float32)
+            return self._prepare_vectors(vectors.reshape(len(query_texts), -1))
+
+        cached = [self.embedding_cache.get(query_text) for query_text in query_texts]
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            encoded = np.asarray(self.model.encode([query_texts[i] for i in missing]), dtype=np.float32)
+            for i, vector in zip(missing, encoded.reshape(len(missing), -1)):
+                self.embedding_cache.put(query_texts[i], vector)
+                cached[i] = vector
+        return self._prepare_vectors(np.vstack(cached))
+
+    def _prepare_vectors(self, vectors):
+        """转换为FAISS需要的连续float32矩阵，内积索引下同时做L2归一化"""
+        vectors = np.array(vectors, dtype=np.float32, order='C')
+        if self.index_params.get('normalized'):
+            faiss.normalize_L2(vectors)
+        return vectors
+
     def _generate_prompt(self, query_text, similar_rules, scores):
+        """生成组合prompt，见 format_prompt"""
+        return format_prompt(query_text, similar_rules, scores)
+
+
+class QueryBatcher:
+    """
+    微批处理入口：在很短的时间窗口内收集并发调用方的查询，合并为一次 process_queries 调用
+    """
+
+    def __init__(self, query_matcher, max_batch_size=64, max_wait_ms=5):
         """
-        生成组合prompt
+        初始化微批处理器
         Args:
-            query_text: 原始查询文本
-            similar_rules: 相似规则列表
-            scores: 相似度分数列表
-        Returns:
-            combined_prompt: 组合后的prompt
+            query_matcher: QueryMatchingSystem 实例
+            max_batch_size: 单批最多合并的查询数量
+            max_wait_ms: 收到第一条查询后等待更多查询的最长时间（毫秒）
         """
-        prompt_template = """
-用户查询：
-{query}
+        self.query_matcher = query_matcher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
 
-相关规则参考：
-{rules}
+    def submit_async(self, query_text, top_k=5, **search_kwargs):
+        """
+        提交查询，立即返回Future，结果为 (combined_prompt, similar_rules, scores)
+        search_kwargs 为 process_queries 的检索参数（nprobe、ef_search、min_score、component、feature）
+        """
+        future = Future()
+        self._queue.put((query_text, top_k, search_kwargs, future))
+        return future
 
-请根据以上信息进行分析并给出建议。
-"""
-        # 格式化相似规则
-        rules_text = ""
-        for i, (rule, score) in enumerate(zip(similar_rules, scores), 1):
-            rules_text += f"{i}. {rule}\n   (相似度: {score:.4f})\n\n"
+    def submit(self, query_text, top_k=5, timeout=None, **search_kwargs):
+        """
+        提交查询并阻塞等待结果，返回值与 QueryMatchingSystem.process_query 相同
+        """
+        return self.submit_async(query_text, top_k, **search_kwargs).result(timeout)
+
+    def close(self):
+        """处理完已提交的查询后停止后台线程"""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # 收集时间窗口内到达的其他查询
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
 
-        return prompt_template.format(
-            query=query_text,
-            rules=rules_text
-        )
+            self._serve(batch)
+
+    def _serve(self, batch):
+        # 跳过调用方已经取消的请求，检索参数相同的请求合并为一组
+        groups = {}
+        for item in batch:
+            if item[3].set_running_or_notify_cancel():
+                groups.setdefault(tuple(sorted(item[2].items())), []).append(item)
+
+        for search_kwargs, group in groups.items():
+            self._serve_group(group, dict(search_kwargs))
+
+    def _serve_group(self, batch, search_kwargs):
+        max_k = max(top_k for _, top_k, _, _ in batch)
+        try:
+            results = self.query_matcher.process_queries([query_text for query_text, _, _, _ in batch], max_k,
+                                                         **search_kwargs)
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (query_text, top_k, _, future), (prompt, similar_rules, scores) in zip(batch, results):
+            if top_k < max_k:
+                similar_rules, scores = similar_rules[:top_k], scores[:top_k]
+                prompt = self.query_matcher._generate_prompt(query_text, similar_rules, scores)
+            future.set_result((prompt, similar_rules, scores))
+
+
+class DaemonMismatchError(RuntimeError):
+    """检索守护进程加载的索引、规则或编码器与客户端期望的不一致"""
+
+
+class DaemonQueryMatcher:
+    """
+    本机检索守护进程的客户端，接口与 QueryMatchingSystem 的 process_query / process_queries 相同，
+    多个前端共享守护进程中已经加载好的模型与索引
+    """
+
+    def __init__(self, address=RETRIEVAL_DAEMON_ADDRESS, authkey=None, index_path=None,
+                 texts_path=None, encoder_namespace=None, min_score=None):
+        """
+        连接检索守护进程并核对它加载的数据，守护进程未运行时抛出 ConnectionRefusedError
+        Args:
+            address: 守护进程地址
+            authkey: 认证密钥，默认见 load_daemon_authkey；未配置密钥时抛出 FileNotFoundError
+            index_path: 期望的FAISS索引路径；守护进程加载的索引路径或 build_id（与磁盘上的索引比较）不同时
+                抛出 DaemonMismatchError，None 表示不核对
+            texts_path: 期望的规则文本或规则存储路径，None 表示不核对
+            encoder_namespace: 期望的编码器（见 embedding_cache_namespace），None 表示不核对
+            min_score: 默认的相似度下限，单次查询未指定时使用
+        """
+        self.address = address
+        self.min_score = min_score
+        if authkey is None:
+            authkey = load_daemon_authkey()
+            if authkey is None:
+                raise FileNotFoundError(f"未配置检索守护进程的认证密钥（环境变量 {RETRIEVAL_DAEMON_AUTHKEY_ENV} "
+                                        f"或 {RETRIEVAL_DAEMON_AUTHKEY_PATH}），守护进程可能从未在本机启动")
+        # 双向认证：只与持有同一密钥的守护进程交换 pickle 数据
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+        try:
+            self.daemon_info = self._call('describe')
+            self._check(index_path, texts_path, encoder_namespace)
+        except Exception:
+            self._conn.close()
+            raise
+
+    def _check(self, index_path, texts_path, encoder_namespace):
+        info = self.daemon_info
+        mismatches = []
+        if index_path is not None:
+            if os.path.realpath(index_path) != info['index_path']:
+                mismatches.append(f"索引 {info['index_path']}（期望 {os.path.realpath(index_path)}）")
+            else:
+                build_id = load_index_params(index_path).get('build_id')
+                if build_id is not None and build_id != info['build_id']:
+                    mismatches.append(f"索引构建 {info['build_id']}（磁盘上为 {build_id}，守护进程加载的索引已过期）")
+        if texts_path is not None and os.path.realpath(texts_path) != info['texts_path']:
+            mismatches.append(f"规则 {info['texts_path']}（期望 {os.path.realpath(texts_path)}）")
+        if encoder_namespace is not None and encoder_namespace != info['encoder']:
+            mismatches.append(f"编码器 {info['encoder']}（期望 {encoder_namespace}）")
+        if mismatches:
+            raise DaemonMismatchError(f"检索守护进程 {self.address} 加载的数据不一致: {'；'.join(mismatches)}")
+
+    def _call(self, method, *args, **kwargs):
+        with self._lock:
+            self._conn.send((method, args, kwargs))
+            status, result = self._conn.recv()
+        if status != 'ok':
+            raise RuntimeError(f"检索守护进程返回错误: {result}")
+        return result
+
+    def process_query(self, query_text, top_k=5, min_score=None, **search_kwargs):
+        if min_score is None:
+            min_score = self.min_score
+        return self._call('process_query', query_text, top_k, min_score=min_score, **search_kwargs)
+
+    def process_queries(self, query_texts, top_k=5, min_score=None, **search_kwargs):
+        if min_score is None:
+            min_score = self.min_score
+        return self._call('process_queries', list(query_texts), top_k, min_score=min_score, **search_kwargs)
+
+    def close(self):
+        self._conn.close()
+
+
+class HttpQueryMatcher:
+    """
+    检索 HTTP 服务（retrieval-service.py）的客户端，接口与 QueryMatchingSystem 的 process_query / process_queries 相同；
+    可以传入多个服务地址，由 BackendPool 负载均衡与故障切换
+    """
+
+    def __init__(self, api_url=RETRIEVAL_SERVICE_URL, timeout=10, min_score=None, backend_pool=None):
+        """
+        初始化检索服务客户端
+        Args:
+            api_url: 检索服务地址，字符串或列表
+            timeout: 等待检索结果的超时（秒）
+            min_score: 默认的相似度下限，单次查询未指定时使用
+            backend_pool: 自定义的 BackendPool
+        """
+        self.api_url = api_url
+        self.min_score = min_score
+        self.backend_pool = backend_pool or BackendPool(api_url, read_timeout=timeout)
+
+    def _post(self, path, data):
+        with self.backend_pool.post(path, json=data) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def _search_data(self, top_k, nprobe, ef_search, min_score, component, feature):
+        if min_score is None:
+            min_score = self.min_score
+        return {'top_k': top_k, 'nprobe': nprobe, 'ef_search': ef_search, 'min_score': min_score,
+                'component': component, 'feature': feature}
+
+    def process_query(self, query_text, top_k=5, nprobe=None, ef_search=None, min_score=None, component=None,
+                      feature=None):
+        result = self._post('/search', {'query': query_text,
+                                        **self._search_data(top_k, nprobe, ef_search, min_score, component, feature)})
+        return result['prompt'], result['rules'], result['scores']
+
+    def process_queries(self, query_texts, top_k=5, nprobe=None, ef_search=None, min_score=None, component=None,
+                        feature=None):
+        result = self._post('/search_batch', {'queries': list(query_texts),
+                                              **self._search_data(top_k, nprobe, ef_search, min_score, component,
+                                                                  feature)})
+        return [(item['prompt'], item['rules'], item['scores']) for item in result['results']]
+
+    def close(self):
+        self.backend_pool.close()
+
+
+class CompletionError(Exception):
+    """LLM 接口调用失败，异常信息即返回给用户的错误提示"""
 
 
 class ChatBot:
-    def __init__(self, api_url='http://127.0.0.1:6006', timeout=100):
+    def __init__(self, api_url='http://127.0.0.1:6006', timeout=100, max_tokens=200, temperature=0.7,
+                 backend_pool=None, tokenizer=None, history_token_budget=3072, max_history_turns=40):
+        """
+        api_url may be a single URL or a list of backends; requests are spread across them by
+        BackendPool (pooled keep-alive connections, retry with backoff, per-backend circuit breaker).
+        Pass backend_pool to configure pool size, timeouts and retries explicitly.
+        Each request sends the conversation as multi-turn messages trimmed to history_token_budget tokens,
+        counted with tokenizer (the served model's tokenizer or its path; character count if None).
+        """
         self.api_url = api_url
         self.timeout = timeout
-        self.conversation_history = []
+        self.backend_pool = backend_pool or BackendPool(api_url, read_timeout=timeout)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.history = ConversationHistory(history_token_budget, max_history_turns, tokenizer)
+
+    def new_history(self):
+        """A new, empty ConversationHistory with the same budget and tokenizer (one per session)"""
+        return ConversationHistory(self.history.token_budget, self.history.max_turns, self.history.tokenizer,
+                                   self.history.summary_tokens)
 
-    def add_to_history(self, role, content):
+    @property
+    def conversation_history(self):
+        """Messages currently kept in memory"""
+        return self.history.messages()
+
+    def add_to_history(self, role, content, rules=(), summary=None):
         """Add a message to conversation history"""
-        self.conversation_history.append({
-            "role": role,
-            "content": content
-        })
+        self.history.add(role, content, rules, summary)
+
+    def record_turn(self, user_input, model_response, rules=(), summary=None, history=None):
+        """Add a completed user/assistant exchange to history (self.history unless another is given)"""
+        history = history or self.history
+        history.add("user", user_input, rules, summary)
+        history.add("assistant", model_response)
+
+    def request_data(self, user_input, history=None):
+        """Request body: the trimmed conversation plus the new user message, and generation parameters"""
+        return {
+            "messages": (history or self.history).build_messages(user_input),
+            **self.generation_params()
+        }
+
+    def generation_params(self):
+        """Generation parameters sent with every request"""
+        return {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
+        }
 
     def get_completion(self, user_input):
         """Send request to the model with conversation history"""
-        self.add_to_history("user", user_input)
+        try:
+            return self.request_completion(user_input)
+        except CompletionError as e:
+            return str(e)
+        except Exception as e:
+            return f"发生未预期的错误: {str(e)}"
 
+    def request_completion(self, user_input, rules=(), summary=None, history=None):
+        """
+        Like get_completion, but raises CompletionError instead of returning the error text.
+        rules and summary are stored with the user turn (see ConversationHistory.add).
+        history selects the conversation to use and extend (self.history by default).
+        """
         headers = {'Content-Type': 'application/json'}
-        # 简化请求数据结构
-        data = {
-            "prompt": user_input,  # 直接发送当前输入
-            "max_tokens": 200,
-            "temperature": 0.7
-        }
+        data = self.request_data(user_input, history)
 
         try:
-            response = requests.post(
-                url=self.api_url,
-                headers=headers,
-                data=json.dumps(data),
-                timeout=self.timeout
-            )
-            response.raise_for_status()
+            with self.backend_pool.post(headers=headers, data=json.dumps(data)) as response:
+                response.raise_for_status()
+                # 检查响应是否为JSON格式
+                try:
+                    result = response.json()
+                except json.JSONDecodeError:
+                    raise CompletionError(f"API返回了非JSON格式的响应: {response.text[:100]}")
+        except requests.exceptions.RequestException as e:
+            raise CompletionError(f"API请求失败: {str(e)}") from e
 
-            # 检查响应是否为JSON格式
-            try:
-                result = response.json()
-            except json.JSONDecodeError:
-                return f"API返回了非JSON格式的响应: {response.text[:100]}"
-
-            # 检查响应中是否包含预期的字段
-            if isinstance(result, dict):
-                model_response = result.get('response')
-                if model_response:
-                    self.add_to_history("assistant", model_response)
-                    return model_response
-                else:
-                    return f"API响应缺少'response'字段。完整响应: {result}"
-            else:
-                return f"API返回了意外的响应格式: {result}"
+        model_response = self._accept_response(result)
+        self.record_turn(user_input, model_response, rules, summary, history)
+        return model_response
+
+    async def arequest_completion(self, user_input, rules=(), summary=None, history=None):
+        """
+        Async version of request_completion using the pool's httpx client.
+        Cancelling the awaiting task closes the connection. The server's non-streaming endpoint polls for
+        disconnects (deepseekapi.wait_unless_disconnected) and cancels the generation within about half a second;
+        against a server without that check only the client side is freed.
+        """
+        import httpx
+        data = self.request_data(user_input, history)
+
+        try:
+            async with self.backend_pool.apost(json=data) as response:
+                response.raise_for_status()
+                try:
+                    result = response.json()
+                except json.JSONDecodeError:
+                    raise CompletionError(f"API返回了非JSON格式的响应: {response.text[:100]}")
+        except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+            raise CompletionError(f"API请求失败: {str(e)}") from e
+
+        model_response = self._accept_response(result)
+        self.record_turn(user_input, model_response, rules, summary, history)
+        return model_response
+
+    def _accept_response(self, result):
+        """Validate a parsed completion response and return the model's answer"""
+        # 检查响应中是否包含预期的字段
+        if not isinstance(result, dict):
+            raise CompletionError(f"API返回了意外的响应格式: {result}")
+        model_response = result.get('response')
+        if not model_response:
+            raise CompletionError(f"API响应缺少'response'字段。完整响应: {result}")
+        return model_response
+
+    def stream_completion(self, user_input, rules=(), summary=None, history=None):
+        """
+        Stream the model response from the server's /stream endpoint, yielding text chunks as they arrive.
+        Raises CompletionError on failure; the exchange is added to history once complete.
+        """
+        data = self.request_data(user_input, history)
 
+        chunks = []
+        try:
+            with self.backend_pool.post(
+                '/stream',
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps(data),
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        raise CompletionError(f"API返回了非JSON格式的响应: {line[:100]}")
+                    if 'error' in event:
+                        raise CompletionError(event['error'])
+                    if event.get('done'):
+                        break
+                    token = event.get('token', '')
+                    chunks.append(token)
+                    yield token
         except requests.exceptions.RequestException as e:
-            return f"API请求失败: {str(e)}"
-        except Exception as e:
-            return f"发生未预期的错误: {str(e)}"
+            raise CompletionError(f"API请求失败: {str(e)}") from e
+
+        model_response = ''.join(chunks)
+        if not model_response:
+            raise CompletionError("API流式响应为空")
+        self.record_turn(user_input, model_response, rules, summary, history)
 
     def clear_history(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.history.clear()
+
+    def close(self):
+        """Close pooled connections"""
+        self.backend_pool.close()
+
+    async def aclose(self):
+        """Close the async client used by arequest_completion"""
+        await self.backend_pool.aclose()
 
 
 class IntegratedSystem:
-    def __init__(self, index_path='faiss_index.index', texts_path='similar_words_results_20250116_142217.txt',
-                 api_url='http://127.0.0.1:6006'):
+    def __init__(self, index_path='faiss_index.index', texts_path=None,
+                 api_url='http://127.0.0.1:6006', embedding_cache_size=10000, embedding_cache_ttl=None,
+                 embedding_cache_path=None, response_cache_size=1000, response_cache_ttl=3600,
+                 cache_sampled_responses=False, min_score=None, background_init=False, retrieval_daemon=None,
+                 retrieval_workers=8, retrieval_service=None, encoder_backend='torch', max_sessions=1000,
+                 tokenizer=None, history_token_budget=3072):
         """
         初始化集成系统
         Args:
             index_path: FAISS索引文件路径
-            texts_path: 规则文本文件路径
-            api_url: DeepSeek API地址
+            texts_path: 规则文本文件或规则存储路径，默认见 default_texts_path
+            api_url: DeepSeek API地址，可以是多个后端地址的列表
+            embedding_cache_size: 查询向量缓存容量，0 表示关闭缓存
+            embedding_cache_ttl: 查询向量缓存有效期（秒），None 表示永不过期
+            embedding_cache_path: 查询向量磁盘缓存路径（如 'embedding_cache.sqlite'），默认 None 只缓存在内存中；
+                磁盘缓存同样受 embedding_cache_ttl 约束，行数上限见 EmbeddingCache
+            response_cache_size: 回答缓存容量，0 表示关闭缓存
+            response_cache_ttl: 回答缓存有效期（秒），None 表示永不过期
+            cache_sampled_responses: 为 True 时 temperature > 0 的回答也缓存
+            min_score: 向量相似度下限，低于该分数的规则不会放入发送给模型的prompt（BM25 命中的规则除外）
+            background_init: 为 True 时在后台线程中加载模型与索引，构造函数立即返回，
+                就绪后 self.ready 被置位；在此之前提交的查询会等待加载完成
+            retrieval_daemon: 检索守护进程地址（如 RETRIEVAL_DAEMON_ADDRESS），可连接且守护进程加载的索引、规则与编码器
+                和 index_path、texts_path、encoder_backend 一致时直接复用守护进程，不在本进程加载模型与索引，
+                min_score 在每次查询时传给守护进程，查询向量缓存使用守护进程自己的；连接失败或不一致时回退为本地加载
+            retrieval_workers: aprocess_user_query 执行检索的线程数
+            retrieval_service: 检索 HTTP 服务地址（字符串或列表，如 RETRIEVAL_SERVICE_URL），
+                指定后通过 HttpQueryMatcher 远程检索，不在本进程加载模型与索引
+            encoder_backend: 本地加载时的编码器后端：'torch'、'onnx' 或 'onnx-int8'
+            max_sessions: aprocess_user_query 按会话ID保存对话历史的会话数上限，超出时丢弃最久未使用的空闲会话
+            tokenizer: 推理服务所用模型的分词器或其路径（如 LLM_TOKENIZER_PATH），对话历史据此按 token 数裁剪；
+                None 时按字符数估算
+            history_token_budget: 每次请求发送的全部消息的 token 上限，应小于推理服务模型的上下文长度减去 max_tokens
+        """
+        self.logger = logging.getLogger(__name__)
+        self.query_matcher = None
+        self.ready = threading.Event()
+        self.init_error = None
+        texts_path = texts_path or default_texts_path(index_path)
+        self._retrieval_config = (index_path, texts_path, embedding_cache_size, embedding_cache_ttl,
+                                  embedding_cache_path, min_score, retrieval_daemon, retrieval_service,
+                                  encoder_backend)
+        if background_init:
+            threading.Thread(target=self._init_retrieval, daemon=True).start()
+        else:
+            self._init_retrieval()
+            if self.init_error is not None:
+                raise self.init_error
+
+        self.chatbot = ChatBot(api_url, tokenizer=tokenizer, history_token_budget=history_token_budget)
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix='retrieval')
+        self._query_batcher = None
+        self._batcher_lock = threading.Lock()
+        self._sessions = {}  # 会话ID -> 该会话正在处理的查询任务
+        self._histories = OrderedDict()  # 会话ID -> 该会话的对话历史，按最近使用排序
+        self.max_sessions = max_sessions
+        self.response_cache = None
+        if response_cache_size:
+            # 索引或规则文件被重建后，旧的回答不再可信
+            self.response_cache = ResponseCache(response_cache_size, response_cache_ttl, cache_sampled_responses,
+                                                watch_paths=[index_path, texts_path])
+
+    def _init_retrieval(self):
+        """加载检索组件（依次尝试检索服务、检索守护进程、本地加载），完成后置位 self.ready"""
+        (index_path, texts_path, embedding_cache_size, embedding_cache_ttl,
+         embedding_cache_path, min_score, retrieval_daemon, retrieval_service,
+         encoder_backend) = self._retrieval_config
+        try:
+            if retrieval_service is not None:
+                self.query_matcher = HttpQueryMatcher(retrieval_service, min_score=min_score)
+                self.logger.info(f"使用检索服务 {retrieval_service}")
+                return
+            if retrieval_daemon is not None:
+                try:
+                    self.query_matcher = DaemonQueryMatcher(
+                        retrieval_daemon, index_path=index_path, texts_path=texts_path,
+                        encoder_namespace=embedding_cache_namespace(encoder_backend), min_score=min_score)
+                    self.logger.info(f"已连接检索守护进程 {retrieval_daemon}（查询向量缓存由守护进程管理）")
+                    return
+                except (OSError, RuntimeError, AuthenticationError) as e:
+                    self.logger.info(f"检索守护进程不可用（{e}），改为本地加载")
+
+            embedding_cache = None
+            if embedding_cache_size:
+                embedding_cache = EmbeddingCache(embedding_cache_size, embedding_cache_ttl, embedding_cache_path,
+                                                 namespace=embedding_cache_namespace(encoder_backend))
+            self.query_matcher = QueryMatchingSystem(index_path, texts_path, embedding_cache, min_score,
+                                                     encoder_backend=encoder_backend)
+        except Exception as e:
+            self.init_error = e
+        finally:
+            self.ready.set()
+
+    def wait_until_ready(self, timeout=None):
         """
-        self.query_matcher = QueryMatchingSystem(index_path, texts_path)
-        self.chatbot = ChatBot(api_url)
+        等待检索组件加载完成
+        Returns:
+            是否已就绪；加载失败时抛出加载过程中的异常
+        """
+        if not self.ready.wait(timeout):
+            return False
+        if self.init_error is not None:
+            raise self.init_error
+        return True
 
     def process_user_query(self, query_text, top_k=5):
         """
@@ -191,21 +973,194 @@ class IntegratedSystem:
             response: 回答
         """
         try:
-            # 1. 使用QueryMatchingSystem检索相关规则
+            # 1. 使用QueryMatchingSystem检索相关规则（后台加载尚未完成时等待）
+            self.wait_until_ready()
             prompt, similar_rules, scores = self.query_matcher.process_query(query_text, top_k)
 
-            # 2. 将检索结果作为上下文发送给DeepSeek
-            response = self.chatbot.get_completion(prompt)
+            # 2. 将检索结果连同对话历史发送给DeepSeek（相同消息与生成参数直接返回缓存的回答）
+            history = self.chatbot.history
+            prompt, similar_rules, cache_key = self._prepare_turn(query_text, prompt, similar_rules, scores, history)
+            response = self._cached_response(cache_key, query_text, prompt, similar_rules, history)
+            if response is not None:
+                return response
+
+            try:
+                response = self.chatbot.request_completion(prompt, similar_rules, query_text, history)
+            except CompletionError as e:
+                return str(e)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response)
 
             return response
 
         except Exception as e:
             return f"处理查询时出错: {str(e)}"
 
+    def _prepare_turn(self, query_text, prompt, similar_rules, scores, history):
+        """
+        去掉已经出现在本轮会发送的对话历史中的规则，并计算回答缓存的键（包含历史消息）
+        Args:
+            history: 本轮所属会话的 ConversationHistory
+        Returns:
+            (prompt, 本轮实际带上的规则, 缓存键或 None)
+        """
+        seen = history.context_rules(history.count_tokens(prompt))
+        keep = [i for i, rule in enumerate(similar_rules) if rule not in seen]
+        if len(keep) < len(similar_rules):
+            prompt = format_prompt(query_text, [similar_rules[i] for i in keep], [scores[i] for i in keep],
+                                   len(similar_rules) - len(keep))
+            similar_rules = [similar_rules[i] for i in keep]
+
+        params = self.chatbot.generation_params()
+        cache_key = None
+        if self.response_cache is not None and self.response_cache.cacheable(params):
+            cache_key = ResponseCache.make_key(history.build_messages(prompt), params)
+        return prompt, similar_rules, cache_key
+
+    def _cached_response(self, cache_key, query_text, prompt, similar_rules, history):
+        """命中回答缓存时把这一轮记入会话的对话历史并返回回答"""
+        if cache_key is None:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is not None:
+            self.chatbot.record_turn(prompt, response, similar_rules, query_text, history)
+        return response
+
+    def session_history(self, session_id=None):
+        """
+        返回会话的对话历史；session_id 为 None 时是同步接口共用的 self.chatbot.history，
+        其余会话各自一份，互不影响彼此的 prompt 与回答缓存键
+        """
+        if session_id is None:
+            return self.chatbot.history
+        history = self._histories.get(session_id)
+        if history is None:
+            history = self._histories[session_id] = self.chatbot.new_history()
+            # 超出上限时丢弃最久未使用、且没有查询在处理中的会话
+            for stale in list(self._histories):
+                if len(self._histories) <= self.max_sessions:
+                    break
+                if stale not in self._sessions and stale != session_id:
+                    del self._histories[stale]
+        else:
+            self._histories.move_to_end(session_id)
+        return history
+
+    def clear_session(self, session_id=None):
+        """清空会话的对话历史；session_id 为 None 时清空 self.chatbot.history"""
+        if session_id is None:
+            self.chatbot.clear_history()
+        else:
+            self._histories.pop(session_id, None)
+
+    def _retrieve_async(self, query_text, top_k):
+        """
+        在线程中执行检索，返回 concurrent.futures.Future；
+        本地加载的检索组件经 QueryBatcher 合并并发查询，守护进程连接则直接在线程池中调用
+        """
+        if isinstance(self.query_matcher, QueryMatchingSystem):
+            with self._batcher_lock:
+                if self._query_batcher is None:
+                    self._query_batcher = QueryBatcher(self.query_matcher)
+            return self._query_batcher.submit_async(query_text, top_k)
+        return self._retrieval_executor.submit(self.query_matcher.process_query, query_text, top_k)
+
+    async def _aprocess(self, query_text, top_k, history):
+        loop = asyncio.get_running_loop()
+        if not self.ready.is_set():
+            await loop.run_in_executor(self._retrieval_executor, self.ready.wait)
+        if self.init_error is not None:
+            raise self.init_error
+        prompt, similar_rules, scores = await asyncio.wrap_future(self._retrieve_async(query_text, top_k))
+
+        prompt, similar_rules, cache_key = self._prepare_turn(query_text, prompt, similar_rules, scores, history)
+        response = self._cached_response(cache_key, query_text, prompt, similar_rules, history)
+        if response is not None:
+            return response
+
+        try:
+            response = await self.chatbot.arequest_completion(prompt, similar_rules, query_text, history)
+        except CompletionError as e:
+            return str(e)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    async def aprocess_user_query(self, query_text, top_k=5, session_id=None):
+        """
+        process_user_query 的异步版本：检索在线程中执行，模型调用使用异步 HTTP 客户端，
+        同一事件循环中可以同时处理大量查询
+        Args:
+            query_text: 用户输入的查询文本
+            top_k: 返回的最相似规则数量
+            session_id: 会话ID；每个会话有独立的对话历史（见 session_history），未指定时使用 self.chatbot.history。
+                同一会话提交新查询时，该会话尚未完成的上一个查询被取消，
+                等待它的调用方收到 asyncio.CancelledError；连接随之关闭，服务端在下一次断开检查时
+                （约 0.5 秒内，见 deepseekapi.wait_unless_disconnected）取消该请求的生成
+        Returns:
+            response: 回答
+        """
+        task = asyncio.ensure_future(self._aprocess(query_text, top_k, self.session_history(session_id)))
+        if session_id is not None:
+            previous = self._sessions.get(session_id)
+            if previous is not None:
+                previous.cancel()
+            self._sessions[session_id] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # 调用方自身被取消时，一并取消内部任务
+            task.cancel()
+            raise
+        except Exception as e:
+            return f"处理查询时出错: {str(e)}"
+        finally:
+            if session_id is not None and self._sessions.get(session_id) is task:
+                del self._sessions[session_id]
+
+    async def aclose(self):
+        """取消所有会话中的查询并关闭异步客户端"""
+        for task in list(self._sessions.values()):
+            task.cancel()
+        await self.chatbot.aclose()
+
+    def stream_user_query(self, query_text, top_k=5):
+        """
+        流式处理用户查询，逐段产出回答文本；出错时产出错误信息
+        Args:
+            query_text: 用户输入的查询文本
+            top_k: 返回的最相似规则数量
+        Yields:
+            回答文本片段
+        """
+        try:
+            self.wait_until_ready()
+            prompt, similar_rules, scores = self.query_matcher.process_query(query_text, top_k)
+
+            history = self.chatbot.history
+            prompt, similar_rules, cache_key = self._prepare_turn(query_text, prompt, similar_rules, scores, history)
+            response = self._cached_response(cache_key, query_text, prompt, similar_rules, history)
+            if response is not None:
+                yield response
+                return
+
+            chunks = []
+            for chunk in self.chatbot.stream_completion(prompt, similar_rules, query_text, history):
+                chunks.append(chunk)
+                yield chunk
+            if cache_key is not None:
+                self.response_cache.put(cache_key, ''.join(chunks))
+
+        except CompletionError as e:
+            yield str(e)
+        except Exception as e:
+            yield f"处理查询时出错: {str(e)}"
+
 
 def main():
-    # 初始化集成系统
-    system = IntegratedSystem()
+    # 初始化集成系统（模型与索引在后台加载，第一次查询时如仍未就绪会等待）
+    system = IntegratedSystem(background_init=True, retrieval_daemon=RETRIEVAL_DAEMON_ADDRESS,
+                              tokenizer=LLM_TOKENIZER_PATH)
 
     print("集成系统已启动（输入'quit'退出）")
 
@@ -222,13 +1177,12 @@ def main():
                 print("请输入有效的查询内容")
                 continue
 
-            # 处理查询并获取DeepSeek的回答
-            response = system.process_user_query(query)
-
-            # 打印结果
+            # 处理查询并逐段打印DeepSeek的回答
             print("\n回答:")
             print("-" * 50)
-            print(response)
+            for chunk in system.stream_user_query(query):
+                print(chunk, end='', flush=True)
+            print()
             print("-" * 50)
 
         except KeyboardInterrupt:
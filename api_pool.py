@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 视为后端暂时不可用、可以换一个后端重试的 HTTP 状态码
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class NoBackendAvailableError(requests.exceptions.RequestException):
+    """所有后端都处于熔断状态，或重试次数已用尽"""
+
+
+class CircuitBreaker:
+    """
+    单个后端的熔断器：连续失败 failure_threshold 次后断开，reset_timeout 秒内不再向其发送请求；
+    之后放行一个试探请求（半开），成功则恢复，失败则重新断开
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def record_abandoned(self):
+        """请求在得到结果前被放弃（如任务被取消）：不改变失败计数与熔断状态，只归还试探名额"""
+        self.probing = False
+
+
+class _Backend:
+    def __init__(self, url, breaker):
+        self.url = url.rstrip('/')
+        self.breaker = breaker
+        self.outstanding = 0
+        self.last_used = 0.0
+
+
+class BackendPool:
+    """
+    多个推理服务后端的连接池：共用一个带 keep-alive 连接池的 requests.Session，
+    每次请求选择未熔断且进行中请求最少的后端；连接错误与 5xx/429 时指数退避后换后端重试。
+    apost 是基于 httpx.AsyncClient 的异步版本，与同步请求共用熔断器和进行中请求计数
+    """
+
+    def __init__(self, api_urls, pool_size=10, connect_timeout=3.05, read_timeout=100, max_retries=3,
+                 backoff_factor=0.5, max_backoff=10.0, failure_threshold=5, reset_timeout=30.0):
+        """
+        初始化后端连接池
+        Args:
+            api_urls: 后端地址，字符串或列表
+            pool_size: 每个后端保持的最大连接数
+            connect_timeout: 建立连接的超时（秒）
+            read_timeout: 等待响应的超时（秒）
+            max_retries: 失败后的最大重试次数
+            backoff_factor: 第 n 次重试前等待 backoff_factor * 2**n 秒（带随机抖动）
+            max_backoff: 单次等待的上限（秒）
+            failure_threshold: 熔断前允许的连续失败次数
+            reset_timeout: 熔断后多久放行试探请求（秒）
+        """
+        if isinstance(api_urls, str):
+            api_urls = [api_urls]
+        if not api_urls:
+            raise ValueError("至少需要一个后端地址")
+        self.backends = [_Backend(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in api_urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool_size = pool_size
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _acquire(self, exclude):
+        """选择一个后端并计入进行中请求；优先选择本次调用尚未失败过的后端"""
+        with self._lock:
+            for candidates in ([b for b in self.backends if b not in exclude], self.backends):
+                # 先按负载排序再询问熔断器，避免半开状态的试探名额被未选中的后端占用
+                for backend in sorted(candidates, key=lambda b: (b.outstanding, b.last_used)):
+                    if backend.breaker.allow():
+                        backend.outstanding += 1
+                        backend.last_used = time.monotonic()
+                        return backend
+        return None
+
+    def _release(self, backend, success):
+        """归还后端；success 为 None 表示请求被放弃，既不计为成功也不计为失败"""
+        with self._lock:
+            backend.outstanding -= 1
+            if success is None:
+                backend.breaker.record_abandoned()
+            elif success:
+                backend.breaker.record_success()
+            else:
+                backend.breaker.record_failure()
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            try:
+                delay = max(delay, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    @contextmanager
+    def post(self, path='', stream=False, **kwargs):
+        """
+        发送 POST 请求，返回的响应在 with 块结束时关闭并释放后端；
+        流式响应只在拿到响应头之前重试，开始读取后出错由调用方处理
+        Args:
+            path: 追加在后端地址后的路径，如 '/stream'
+            stream: 是否流式读取响应体
+            **kwargs: 传给 requests.Session.post 的其他参数
+        """
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            backend = self._acquire(tried)
+            if backend is None:
+                break
+            tried.add(backend)
+            retry_after = None
+            try:
+                response = self.session.post(backend.url + path, timeout=self.timeout, stream=stream, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._release(backend, success=False)
+                last_error = e
+            except BaseException:
+                # 请求本身不合法、被中断等情况不能说明后端的健康状况
+                self._release(backend, success=None)
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    try:
+                        yield response
+                    finally:
+                        response.close()
+                        # 4xx 是请求本身的问题，不计为后端故障
+                        self._release(backend, success=True)
+                    return
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+                # 429 表示后端过载而非故障，不触发熔断
+                self._release(backend, success=response.status_code == 429)
+                last_error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Server Error for url: {backend.url + path}", response=response)
+
+            self.logger.warning(f"后端 {backend.url} 请求失败（第 {attempt + 1} 次）: {last_error}")
+            if attempt < self.max_retries:
+                time.sleep(self._backoff_delay(attempt, retry_after))
+
+        self._raise_exhausted(last_error)
+
+    def _raise_exhausted(self, last_error):
+        if last_error is None:
+            raise NoBackendAvailableError("所有后端均处于熔断状态")
+        raise NoBackendAvailableError(f"重试 {self.max_retries} 次后仍然失败: {last_error}") from last_error
+
+    def _get_async_client(self):
+        # httpx 只有异步接口需要，按需导入；客户端的连接池绑定在首次使用它的事件循环上
+        if self._async_client is None:
+            import httpx
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.pool_size * len(self.backends),
+                                    max_keepalive_connections=self.pool_size * len(self.backends)))
+        return self._async_client
+
+    @asynccontextmanager
+    async def apost(self, path='', stream=False, **kwargs):
+        """
+        post 的异步版本，返回 httpx.Response；任务被取消时正在进行的请求随之关闭
+        Args:
+            path: 追加在后端地址后的路径
+            stream: 是否流式读取响应体（通过 response.aiter_lines() 等读取）
+            **kwargs: 传给 httpx.AsyncClient.build_request 的其他参数
+        """
+        import httpx
+        client = self._get_async_client()
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            backend = self._acquire(tried)
+            if backend is None:
+                break
+            tried.add(backend)
+            retry_after = None
+            try:
+                request = client.build_request('POST', backend.url + path, **kwargs)
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                self._release(backend, success=False)
+                last_error = e
+            except BaseException:
+                # 取消等情况既不能说明后端健康也不是后端故障：半开状态下的试探被取消时保持熔断，下次重新试探
+                self._release(backend, success=None)
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    try:
+                        yield response
+                    finally:
+                        await response.aclose()
+                        self._release(backend, success=True)
+                    return
+                retry_after = response.headers.get('Retry-After')
+                await response.aclose()
+                self._release(backend, success=response.status_code == 429)
+                last_error = httpx.HTTPStatusError(
+                    f"{response.status_code} Server Error for url: {backend.url + path}",
+                    request=response.request, response=response)
+
+            self.logger.warning(f"后端 {backend.url} 请求失败（第 {attempt + 1} 次）: {last_error}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+
+        self._raise_exhausted(last_error)
+
+    def stats(self):
+        with self._lock:
+            return [{'url': b.url, 'outstanding': b.outstanding, 'state': b.breaker.state,
+                     'failures': b.breaker.failures} for b in self.backends]
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
@@ -0,0 +1,123 @@
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_similarword = None  # 每个进程各自持有的 Similarword（同义词词典只加载一次）
+_seed = None
+
+
+def _init_worker(create_num, change_rate, seed):
+    """进程池初始化：加载同义词词典与 jieba 用户词典"""
+    global _similarword, _seed
+    from nlpcda import Similarword
+    _similarword = Similarword(create_num=create_num, change_rate=change_rate)
+    _seed = seed
+
+
+def _augment_chunk(sentences):
+    results = []
+    for sentence in sentences:
+        # Similarword 使用全局 random；按句子重新设定种子，结果与进程数和调度顺序无关
+        random.seed(f"{_seed}:{sentence}")
+        results.append((sentence, _similarword.replace(sentence)))
+    return results
+
+
+def _chunks(sentences, chunksize):
+    iterator = iter(sentences)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _next_completed(pending, ordered):
+    """等待并取出一个块的结果：按序时取最早提交的块，否则取任一已完成的块"""
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    results = []
+    for future in done:
+        pending.remove(future)
+        results.extend(future.result())
+    return results
+
+
+def augment_stream(sentences, create_num=10, change_rate=0.2, workers=None, chunksize=32, ordered=True,
+                   max_pending=None, seed=1):
+    """
+    并行、流式地对句子做同义词替换：句子按块分发给进程池，每个进程只加载一次词典，
+    处理完成的结果立即产出；在途的块数有上限，输入与输出都不会整体驻留内存
+
+    参数:
+    sentences: iterable, 需要进行同义词替换的句子（可以是逐行读取文件的生成器）
+    create_num: int, 每个句子生成的替换结果数量（含原句）
+    change_rate: float, 词语被替换的概率
+    workers: int, 进程数，默认为可用 CPU 数；为 1 时在当前进程中处理
+    chunksize: int, 每次分发给进程的句子数
+    ordered: bool, 是否按输入顺序产出；为 False 时按完成顺序产出
+    max_pending: int, 在途块数上限，默认为 workers * 4
+    seed: int, 随机种子，相同的句子与种子总是得到相同的结果
+
+    返回:
+    iterator: 依次产生 (原始句子, 替换后的句子列表)
+    """
+    if workers is None:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    if workers <= 1:
+        _init_worker(create_num, change_rate, seed)
+        for chunk in _chunks(sentences, chunksize):
+            yield from _augment_chunk(chunk)
+        return
+
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(create_num, change_rate, seed)) as executor:
+        pending = deque()
+        for chunk in _chunks(sentences, chunksize):
+            pending.append(executor.submit(_augment_chunk, chunk))
+            while len(pending) >= max_pending:
+                yield from _next_completed(pending, ordered)
+        while pending:
+            yield from _next_completed(pending, ordered)
+
+
+def write_results(results, formatters, prefix='similar_words_results', timestamp=None, log_every=10000):
+    """
+    单次遍历替换结果，同时写出多种格式的文件
+
+    参数:
+    results: iterable, augment_stream 产生的 (原始句子, 替换后的句子列表)
+    formatters: dict, {扩展名: (文件头, 格式化函数)}，格式化函数接收 (序号, 原始句子, 替换列表) 返回一段文本
+    prefix: str, 文件名前缀
+    timestamp: str, 文件名中的时间戳，默认取当前时间
+    log_every: int, 每处理多少个句子记录一次进度
+
+    返回:
+    tuple: (各格式对应的文件名字典, 处理的句子数)
+    """
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    filenames = {fmt: f'{prefix}_{timestamp}.{fmt}' for fmt in formatters}
+    files = {fmt: open(filename, 'w', encoding='utf-8') for fmt, filename in filenames.items()}
+    count = 0
+    started = time.perf_counter()
+    try:
+        for fmt, (header, _) in formatters.items():
+            files[fmt].write(header)
+        for count, (original, replacements) in enumerate(results, 1):
+            for fmt, (_, format_item) in formatters.items():
+                files[fmt].write(format_item(count, original, replacements))
+            if log_every and count % log_every == 0:
+                logger.info(f"已处理 {count} 个句子，{count / (time.perf_counter() - started):.1f} 句/秒")
+    finally:
+        for f in files.values():
+            f.close()
+    return filenames, count
@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+
+class QueueFullError(Exception):
+    """等待队列已满，调用方应稍后重试"""
+
+
+class ScheduledRequest:
+    """
+    调度器中的一次生成请求，结果（解码后的文本）通过 future 返回
+    """
+
+    def __init__(self, input_ids, max_new_tokens, sampling):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.sampling = sampling
+        self.future = Future()
+        self.cancelled = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def sampling_key(self):
+        return tuple(sorted(self.sampling.items()))
+
+    def cancel(self):
+        """取消请求：尚未开始时直接丢弃，已在批次中时该行在下一步解码后停止"""
+        self.cancelled.set()
+        self.future.cancel()
+
+
+class _PerRequestStopping(StoppingCriteria):
+    """逐行停止条件：达到各自的 max_new_tokens 或已被取消的行标记为结束，全部结束时批次停止"""
+
+    def __init__(self, requests, prompt_length):
+        self.requests = requests
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        return torch.tensor([request.cancelled.is_set() or generated >= request.max_new_tokens
+                             for request in self.requests], dtype=torch.bool, device=input_ids.device)
+
+
+class BatchScheduler:
+    """
+    动态批处理调度器：在短时间窗口内收集采样参数相同的并发请求，左侧填充后合并为一次 model.generate，
+    每个请求保留自己的 max_new_tokens；队列深度超过上限时拒绝新请求。
+    批次中只有一个请求时（低负载，此时 prefill 占延迟的大头）复用 prefix_cache 中已缓存的提示词前缀
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait_ms=10, max_queue_size=64, prefix_cache=None):
+        """
+        初始化调度器
+        Args:
+            model: 因果语言模型
+            tokenizer: 对应的分词器
+            max_batch_size: 单次 generate 合并的最大请求数
+            max_wait_ms: 收到第一个请求后等待更多请求的最长时间（毫秒）
+            max_queue_size: 等待队列上限，超过时 submit 抛出 QueueFullError
+            prefix_cache: 可选的 PrefixCache
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.prefix_cache = prefix_cache
+        self.pad_token_id = tokenizer.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = model.generation_config.pad_token_id or model.generation_config.eos_token_id
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def submit(self, input_ids, generation_config):
+        """
+        提交请求
+        Args:
+            input_ids: 一维的提示词 token 张量
+            generation_config: build_generation_inputs 返回的生成参数
+        Returns:
+            ScheduledRequest，结果通过其 future 获取
+        """
+        config = dict(generation_config)
+        max_new_tokens = config.pop('max_new_tokens')
+        request = ScheduledRequest(input_ids, max_new_tokens, config)
+        with self._cond:
+            if len(self._pending) >= self.max_queue_size:
+                raise QueueFullError(f"等待队列已满（{self.max_queue_size}）")
+            self._pending.append(request)
+            self._cond.notify()
+        return request
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            first = self._pending.popleft()
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # 只合并采样参数相同的请求，其余请求留在队列中保持原有顺序
+                for request in [r for r in self._pending if r.sampling_key == first.sampling_key]:
+                    if len(batch) >= self.max_batch_size:
+                        break
+                    self._pending.remove(request)
+                    batch.append(request)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._generate(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _generate(self, batch):
+        # 左侧填充，使所有请求的最后一个提示词 token 对齐
+        prompt_length = max(len(request.input_ids) for request in batch)
+        input_ids = torch.full((len(batch), prompt_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), prompt_length), dtype=torch.long)
+        for i, request in enumerate(batch):
+            input_ids[i, prompt_length - len(request.input_ids):] = request.input_ids
+            attention_mask[i, prompt_length - len(request.input_ids):] = 1
+
+        # 左侧填充会让各行的前缀错位，前缀缓存只用于单个请求的批次
+        cache_kwargs = {}
+        if self.prefix_cache is not None and len(batch) == 1:
+            past_key_values = self.prefix_cache.prefill(self.model, batch[0].input_ids)
+            if past_key_values is not None:
+                cache_kwargs['past_key_values'] = past_key_values
+
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids.to(self.model.device),
+                attention_mask=attention_mask.to(self.model.device),
+                max_new_tokens=max(request.max_new_tokens for request in batch),
+                pad_token_id=self.pad_token_id,
+                stopping_criteria=StoppingCriteriaList([_PerRequestStopping(batch, prompt_length)]),
+                **cache_kwargs,
+                **batch[0].sampling
+            )
+
+        for i, request in enumerate(batch):
+            if request.cancelled.is_set():
+                request.future.set_exception(CancelledError())
+                continue
+            tokens = outputs[i, prompt_length:prompt_length + request.max_new_tokens]
+            request.future.set_result(self.tokenizer.decode(tokens, skip_special_tokens=True))
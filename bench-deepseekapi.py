@@ -0,0 +1,146 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from batch_scheduler import BatchScheduler
+
+ds = importlib.import_module('deepseekapi')
+
+# 对比的请求解析方式：baseline 重放改动前的 request.json() + json.dumps/json.loads 往返，pydantic 为当前的 CompletionRequest
+PARSERS = ('baseline', 'pydantic')
+PARSER_PATHS = {'baseline': '/_bench/baseline', 'pydantic': '/'}
+PARSE_ONLY_PATHS = {'baseline': '/_bench/parse/baseline', 'pydantic': '/_bench/parse/pydantic'}
+
+
+def add_baseline_routes(app):
+    """
+    注册基准测试用的端点：
+    /_bench/baseline        以旧方式解析请求后交给与 / 相同的处理函数，两者只差在请求解析
+    /_bench/parse/baseline  只做旧方式的解析，不生成
+    /_bench/parse/pydantic  只做 CompletionRequest 的解析与校验，不生成
+    """
+    async def parse_baseline(request):
+        json_post_raw = await request.json()  # 获取POST请求的JSON数据
+        json_post = json.dumps(json_post_raw)  # 将JSON数据转换为字符串
+        return json.loads(json_post)  # 将字符串转换为Python对象
+
+    @app.post(PARSER_PATHS['baseline'])
+    async def baseline_item(request: Request):
+        json_post_list = await parse_baseline(request)
+        return await ds.create_item(ds.CompletionRequest.model_construct(**json_post_list), request)
+
+    @app.post(PARSE_ONLY_PATHS['baseline'])
+    async def baseline_parse(request: Request):
+        json_post_list = await parse_baseline(request)
+        return {'status': 200, 'messages': len(json_post_list.get('messages') or ())}
+
+    @app.post(PARSE_ONLY_PATHS['pydantic'])
+    async def pydantic_parse(item: ds.CompletionRequest):
+        return {'status': 200, 'messages': len(item.messages or ())}
+
+
+def build_payload(i, history_turns, max_length):
+    """
+    构建与 ChatBot 发送的请求相同形式的请求体：history_turns 轮带检索规则的历史消息加本轮问题
+    """
+    rules = "".join(f"{n}. 故障部件：泵轴  故障原因：轴弯曲  特征量：RMS、1xRPM幅值  诊断标准：RMS > 4.5 mm/s\n\n"
+                    for n in range(1, 6))
+    messages = []
+    for turn in range(history_turns):
+        messages.append({'role': 'user', 'content': f"请根据以下相关规则和用户查询进行分析并给出建议。\n{rules}用户查询：{turn}"})
+        messages.append({'role': 'assistant', 'content': '建议检查泵轴的对中与弯曲情况。' * 5})
+    messages.append({'role': 'user', 'content': f'水泵振动过大 {i}'})
+    return {'messages': messages, 'max_length': max_length}
+
+
+def run_requests(client, path, num_requests, concurrency, history_turns, max_length):
+    """
+    并发发送请求并记录每个请求的延迟
+    参数:
+    client: TestClient
+    path: str, 请求的端点
+    num_requests: int, 请求总数
+    concurrency: int, 并发数
+    history_turns: int, 请求体中历史对话的轮数
+    max_length: int, 每个请求生成的最大 token 数
+
+    返回:
+    np.ndarray: 各请求的延迟（毫秒）
+    """
+    def one(i):
+        payload = build_payload(i, history_turns, max_length)
+        start = time.perf_counter()
+        response = client.post(path, json=payload)
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.json().get('status') != 200:
+            raise RuntimeError(f"请求失败: {response.text}")
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return np.array(list(pool.map(one, range(num_requests))))
+
+
+def print_row(label, latencies, extra=''):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{label:<24}{p50:>10.2f}{p99:>10.2f}{extra:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比请求解析方式与GPU缓存清理策略下推理服务的 p50/p99 延迟')
+    parser.add_argument('--model', required=True, help='模型路径，CPU 上可使用小模型')
+    parser.add_argument('--device', default='cpu', choices=['auto', 'cpu'], help='运行设备')
+    parser.add_argument('--parsers', nargs='+', default=list(PARSERS), choices=PARSERS,
+                        help='参与对比的请求解析方式，baseline 即改动前的 json.dumps/json.loads 往返')
+    parser.add_argument('--policies', nargs='+', default=['always', 'watermark', 'never'],
+                        choices=ds.MemoryPolicy.MODES, help='参与对比的策略，always 即改动前的行为')
+    parser.add_argument('--requests', type=int, default=200, help='每种组合的请求数')
+    parser.add_argument('--parse-requests', type=int, default=2000, help='只解析、不生成的请求数')
+    parser.add_argument('--warmup', type=int, default=20, help='每种组合的预热请求数')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发数')
+    parser.add_argument('--history-turns', type=int, default=10,
+                        help='请求体中历史对话的轮数，测试用小模型的上下文较短时需相应减小')
+    parser.add_argument('--max-length', type=int, default=16, help='每个请求生成的最大 token 数')
+    args = parser.parse_args()
+
+    ds.tokenizer, ds.model = ds.load_model(args.model, args.device)
+    ds.scheduler = BatchScheduler(ds.model, ds.tokenizer)
+    ds.admission = threading.BoundedSemaphore(args.concurrency * 2)
+    ds.stream_slots = threading.BoundedSemaphore(args.concurrency)
+    ds.generation_executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    add_baseline_routes(ds.app)
+
+    with TestClient(ds.app) as client:
+        # 1. 只解析请求：两种方式的差异不被生成时间掩盖
+        print(f"{'解析方式（只解析）':<24}{'p50(ms)':>10}{'p99(ms)':>10}")
+        for name in args.parsers:
+            path = PARSE_ONLY_PATHS[name]
+            run_requests(client, path, args.warmup, args.concurrency, args.history_turns, args.max_length)
+            print_row(name, run_requests(client, path, args.parse_requests, args.concurrency, args.history_turns,
+                                         args.max_length))
+
+        # 2. 完整请求：解析方式 × 清理策略，baseline + always 即改动前的行为
+        print(f"\n{'解析方式 / 策略':<24}{'p50(ms)':>10}{'p99(ms)':>10}{'清理次数':>10}")
+        for name in args.parsers:
+            for mode in args.policies:
+                ds.memory_policy = ds.MemoryPolicy(mode)
+                path = PARSER_PATHS[name]
+                run_requests(client, path, args.warmup, args.concurrency, args.history_turns, args.max_length)
+                latencies = run_requests(client, path, args.requests, args.concurrency, args.history_turns,
+                                         args.max_length)
+                print_row(f"{name} / {mode}", latencies, str(ds.memory_policy.collections))
+
+    ds.scheduler.close()
+    # CPU 上 torch_gc 不做任何事，各策略差异只反映请求解析等开销；显存池重建的代价需在GPU上运行才能观察到
+    if args.device == 'cpu':
+        print("提示: 当前在 CPU 上运行，torch_gc 为空操作，GPU 缓存清理的差异需在 GPU 上测量")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 聊天模板为每条消息额外添加的角色标记等 token 的估计值
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def load_tokenizer(tokenizer):
+    """tokenizer 可以是分词器对象或模型路径；为 None 时按字符数估算 token 数"""
+    if isinstance(tokenizer, str):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(tokenizer, trust_remote_code=True)
+    return tokenizer
+
+
+class ConversationHistory:
+    """
+    有界的多轮对话历史：
+    - 最多保存 max_turns 条消息，更早的用户问题只保留一句摘要
+    - build_messages 用真实分词器计数，从最近的轮次往前保留，总长度不超过 token_budget；
+      放不下的轮次以摘要的形式放进一条 system 消息
+    - 记录每条用户消息中带的检索规则，供调用方去掉已在上下文中出现过的规则
+    """
+
+    def __init__(self, token_budget=3072, max_turns=40, tokenizer=None, summary_tokens=256):
+        """
+        初始化对话历史
+        Args:
+            token_budget: 发送给模型的全部消息（含本轮）的 token 上限
+            max_turns: 内存中保存的消息条数上限
+            tokenizer: 分词器对象或模型路径，应与推理服务使用的模型一致；None 时按字符数估算。
+                传入路径时在第一次计数时才加载（transformers 导入较慢，不拖慢前端启动），加载失败时记录警告并按字符数估算
+            summary_tokens: 被省略轮次的摘要所占 token 上限
+        """
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self._tokenizer = tokenizer
+        self._tokenizer_loaded = not isinstance(tokenizer, str)
+        self._tokenizer_lock = threading.Lock()
+        self._turns = deque()
+        self._evicted = deque(maxlen=max_turns)  # 超出 max_turns 被移出的用户问题摘要
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if not self._tokenizer_loaded:
+            with self._tokenizer_lock:
+                if not self._tokenizer_loaded:
+                    try:
+                        self._tokenizer = load_tokenizer(self._tokenizer)
+                    except Exception as e:
+                        logger.warning(f"加载分词器 {self._tokenizer} 失败（{e}），对话历史改为按字符数估算 token 数")
+                        self._tokenizer = None
+                    self._tokenizer_loaded = True
+        return self._tokenizer
+
+    def count_tokens(self, text):
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return len(text)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def add(self, role, content, rules=(), summary=None):
+        """
+        添加一条消息
+        Args:
+            role: 'user' 或 'assistant'
+            content: 实际发送给模型（或模型返回）的内容
+            rules: 该消息中包含的检索规则
+            summary: 该轮被省略时保留的一句摘要（通常是用户的原始问题），默认取内容开头
+        """
+        turn = {'role': role, 'content': content, 'rules': list(rules),
+                'summary': summary if summary is not None else content.strip()[:100],
+                'tokens': self.count_tokens(content) + MESSAGE_OVERHEAD_TOKENS}
+        with self._lock:
+            self._turns.append(turn)
+            while len(self._turns) > self.max_turns:
+                evicted = self._turns.popleft()
+                if evicted['role'] == 'user':
+                    self._evicted.append(evicted['summary'])
+
+    def _window(self, reserve_tokens):
+        """返回 (摘要消息或 None, 能放进预算的最近若干轮)"""
+        with self._lock:
+            turns = list(self._turns)
+            evicted = list(self._evicted)
+        available = self.token_budget - reserve_tokens
+        if not evicted and sum(turn['tokens'] for turn in turns) <= available:
+            return None, turns
+
+        available -= self.summary_tokens
+        used, start = 0, len(turns)
+        while start > 0 and used + turns[start - 1]['tokens'] <= available:
+            start -= 1
+            used += turns[start]['tokens']
+        # 保留的部分从用户消息开始
+        while start < len(turns) and turns[start]['role'] != 'user':
+            start += 1
+
+        dropped = evicted + [turn['summary'] for turn in turns[:start] if turn['role'] == 'user']
+        return self._summary_message(dropped), turns[start:]
+
+    def _summary_message(self, summaries):
+        header = "以下是此前对话中用户提出过的问题（详细内容已省略）："
+        used = self.count_tokens(header)
+        lines = []
+        for summary in reversed(summaries):
+            line = f"- {summary}"
+            used += self.count_tokens(line) + 1
+            if used > self.summary_tokens:
+                break
+            lines.append(line)
+        if not lines:
+            return None
+        return {"role": "system", "content": "\n".join([header] + lines[::-1])}
+
+    def context_rules(self, reserve_tokens):
+        """本轮占用 reserve_tokens 时，保留在上下文中的历史消息里出现过的规则"""
+        _, turns = self._window(reserve_tokens)
+        return {rule for turn in turns for rule in turn['rules']}
+
+    def build_messages(self, content):
+        """
+        构建发送给模型的 messages：[摘要] + 预算内的历史 + 本轮用户消息
+        """
+        summary, turns = self._window(self.count_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+        messages = [summary] if summary is not None else []
+        messages.extend({"role": turn['role'], "content": turn['content']} for turn in turns)
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def messages(self):
+        """内存中保存的全部消息"""
+        with self._lock:
+            return [{"role": turn['role'], "content": turn['content']} for turn in self._turns]
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._evicted.clear()
@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 变体 -> 来源规则映射文件的后缀，放在去重后的规则文件旁边，QueryMatchingSystem 加载规则时自动查找
+SOURCE_MAP_SUFFIX = '.sources.json'
+DEDUP_SCOPES = ('source', 'global')
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def source_map_path_for(rules_path):
+    return rules_path + SOURCE_MAP_SUFFIX
+
+
+def normalize_rule(text):
+    """去掉首尾空白并把连续空白合并为一个空格，作为精确去重与映射查找的依据"""
+    return _WHITESPACE.sub(' ', text.strip())
+
+
+def normalized_hash(text):
+    """规范化文本的 sha1，规范化后的文本与 rule_ingest.rule_hash 的结果相同"""
+    return hashlib.sha1(normalize_rule(text).encode('utf-8')).hexdigest()
+
+
+def load_source_map(rules_path):
+    """加载规则文件旁边的来源映射，不存在时返回 None"""
+    path = source_map_path_for(rules_path)
+    return SourceMap(path) if os.path.exists(path) else None
+
+
+def copy_source_map(rules_path, target_base):
+    """
+    规则文件旁边有来源映射时，把它复制到 target_base（如 <index>.rules 规则存储前缀）旁边，
+    使按规则存储加载的 QueryMatchingSystem 也能找到映射
+
+    返回:
+    bool: 是否复制了映射
+    """
+    source = source_map_path_for(rules_path)
+    if not os.path.exists(source):
+        return False
+    target = source_map_path_for(target_base)
+    shutil.copyfile(source, target + '.tmp')
+    os.replace(target + '.tmp', target)
+    return True
+
+
+def simhash(text, ngram=3):
+    """
+    64 位 SimHash：以字符 n-gram 为特征，只替换了一两个词的变体与原句的汉明距离很小
+    """
+    text = normalize_rule(text)
+    features = {text[i:i + ngram] for i in range(max(len(text) - ngram + 1, 1))}
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                          for feature in features), dtype=np.uint64, count=len(features))
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(features)
+    return int(np.packbits(votes, bitorder='little').view('<u8')[0])
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """
+    SimHash 的 LSH 分段索引：64 位指纹切成 max_distance + 1 段，汉明距离不超过 max_distance 的两个指纹
+    至少有一段完全相同（抽屉原理），因此只需在同段桶内比较候选
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-64 // self.bands)
+        self._buckets = {}
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def find(self, fingerprint):
+        """返回与 fingerprint 足够接近的已有条目，没有时返回 None"""
+        for key in self._keys(fingerprint):
+            for other, item in self._buckets.get(key, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return item
+        return None
+
+    def add(self, fingerprint, item):
+        for key in self._keys(fingerprint):
+            self._buckets.setdefault(key, []).append((fingerprint, item))
+
+
+def _iter_lines(rules_path):
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.strip()
+
+
+def iter_rule_groups(rules_path, source_rules=None, grouped=True):
+    """
+    读取同义词增强的结果文件，按来源规则分组
+
+    similarword-auto-readingtxt.py 对每条原始规则先写原句、再写替换结果（第一个替换结果就是原句本身），
+    因此"与下一行完全相同的行"、空行之后的第一行、以及 source_rules 中的规则都视为新一组的开始
+
+    参数:
+    rules_path: str, 同义词增强结果文件
+    source_rules: iterable, 可选的原始规则（如 Excel-formatting.py 生成的故障描述），用于准确识别分组
+    grouped: bool, 为 False 时每一行都视为独立的来源规则
+
+    返回:
+    iterator: 依次产生 (来源规则, 组内全部句子)
+    """
+    known_sources = {normalized_hash(rule) for rule in source_rules} if source_rules is not None else None
+    group = []
+    lines = _iter_lines(rules_path)
+    text = next(lines, None)
+    while text is not None:
+        following = next(lines, None)
+        if not text:
+            if group:
+                yield group[0], group
+                group = []
+        elif not grouped:
+            yield text, [text]
+        else:
+            if known_sources is not None:
+                starts_group = normalized_hash(text) in known_sources
+            else:
+                starts_group = following is not None and normalize_rule(text) == normalize_rule(following)
+            if starts_group and group and normalize_rule(group[-1]) != normalize_rule(text):
+                yield group[0], group
+                group = []
+            group.append(text)
+        text = following
+    if group:
+        yield group[0], group
+
+
+def dedup_rules(rules_path, output_path, max_distance=3, scope='source', source_rules=None, grouped=True, ngram=3):
+    """
+    规则去重：先按规范化文本的哈希去掉完全相同的句子，再用 SimHash + LSH 去掉近似重复的变体；
+    保留的句子写入 output_path（每行一条，可直接交给 embedding-new.py / rule_ingest.py），
+    每个变体（含被去掉的）到来源规则的映射写入 <output_path>.sources.json
+
+    参数:
+    rules_path: str, 同义词增强结果文件
+    output_path: str, 去重后的规则文件
+    max_distance: int, 视为近似重复的最大汉明距离，0 表示只做精确去重
+    scope: str, 'source' 只在同一来源规则的变体之间做近似去重；'global' 在全部句子之间做
+        （本语料中不同规则往往只差几个字，全局近似去重可能误合并不同的规则）
+    source_rules: iterable, 可选的原始规则，见 iter_rule_groups
+    grouped: bool, 见 iter_rule_groups
+    ngram: int, SimHash 使用的字符 n-gram 长度
+
+    返回:
+    dict: 输入、精确重复、近似重复、保留的句子数以及来源规则数
+    """
+    if scope not in DEDUP_SCOPES:
+        raise ValueError(f"不支持的去重范围: {scope}，可选: {', '.join(DEDUP_SCOPES)}")
+    sources = {}   # 来源规则哈希 -> 来源规则文本
+    variants = {}  # 变体哈希 -> 来源规则哈希
+    near_index = NearDuplicateIndex(max_distance) if max_distance > 0 else None
+    stats = {'input': 0, 'exact_duplicates': 0, 'near_duplicates': 0, 'kept': 0}
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for source, group in iter_rule_groups(rules_path, source_rules, grouped):
+            source_hash = normalized_hash(source)
+            sources.setdefault(source_hash, source)
+            if near_index is not None and scope == 'source':
+                # 按来源去重时每组使用新的索引，内存只与组的大小有关
+                near_index = NearDuplicateIndex(max_distance)
+            for text in group:
+                stats['input'] += 1
+                h = normalized_hash(text)
+                if h in variants:
+                    stats['exact_duplicates'] += 1
+                    continue
+                # 完全相同的句子归属于最先出现的来源，近似重复的变体归属于本组的来源
+                variants[h] = source_hash
+                if near_index is not None:
+                    fingerprint = simhash(text, ngram)
+                    if near_index.find(fingerprint) is not None:
+                        stats['near_duplicates'] += 1
+                        continue
+                    near_index.add(fingerprint, h)
+                out.write(text + '\n')
+                stats['kept'] += 1
+
+    map_path = source_map_path_for(output_path)
+    with open(map_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'sources': sources, 'variants': variants}, f, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+    os.replace(map_path + '.tmp', map_path)
+
+    stats['sources'] = len(sources)
+    logger.info(f"去重完成：输入 {stats['input']} 条，精确重复 {stats['exact_duplicates']} 条，"
+                f"近似重复 {stats['near_duplicates']} 条，保留 {stats['kept']} 条（来源规则 {stats['sources']} 条）")
+    return stats
+
+
+class SourceMap:
+    """
+    变体 -> 来源规则的映射，检索时把命中同一来源规则的多个变体合并为一条
+    """
+
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.sources = data['sources']
+        self.variants = data['variants']
+
+    def __len__(self):
+        return len(self.sources)
+
+    def source_of(self, text):
+        """返回 (来源规则哈希, 来源规则文本)；不在映射中的规则视为自身的来源"""
+        h = normalized_hash(text)
+        source_hash = self.variants.get(h)
+        if source_hash is None:
+            return h, text
+        return source_hash, self.sources[source_hash]
+
+    def collapse(self, rules, scores, limit=None):
+        """
+        按来源规则合并检索结果：每个来源只保留得分最高（即最先出现）的一次，并以来源规则文本代替变体
+
+        参数:
+        rules: list, 按得分降序排列的规则文本
+        scores: list, 对应的相似度分数
+        limit: int, 最多保留的来源规则数
+
+        返回:
+        tuple: (规则列表, 分数列表)
+        """
+        seen = set()
+        collapsed_rules, collapsed_scores = [], []
+        for rule, score in zip(rules, scores):
+            source_hash, source_text = self.source_of(rule)
+            if source_hash in seen:
+                continue
+            seen.add(source_hash)
+            collapsed_rules.append(source_text)
+            collapsed_scores.append(score)
+            if limit is not None and len(collapsed_rules) >= limit:
+                break
+        return collapsed_rules, collapsed_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同义词增强结果去重')
+    parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='同义词增强结果文件')
+    parser.add_argument('--output', default='rules_dedup.txt', help='去重后的规则文件')
+    parser.add_argument('--max-distance', type=int, default=3, help='近似重复的最大 SimHash 汉明距离，0 表示只做精确去重')
+    parser.add_argument('--scope', default='source', choices=DEDUP_SCOPES, help='近似去重的范围')
+    parser.add_argument('--ngram', type=int, default=3, help='SimHash 的字符 n-gram 长度')
+    parser.add_argument('--sources', help='原始规则文件（如 Excel-formatting.py 生成的文本），用于准确识别变体所属的规则')
+    parser.add_argument('--ungrouped', action='store_true', help='输入不是同义词增强结果，每行都是独立的规则')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    source_rules = None
+    if args.sources:
+        with open(args.sources, 'r', encoding='utf-8') as f:
+            source_rules = [line.strip() for line in f if '故障部件：' in line]
+    dedup_rules(args.rules, args.output, args.max_distance, args.scope, source_rules, not args.ungrouped, args.ngram)
+    print(f"去重后的规则已保存到 {args.output}，来源映射保存到 {source_map_path_for(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,21 @@
 from fastapi import FastAPI, Request
-from transformers import AutoTokenizer, AutoModelForCausalLM, GenerationConfig
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import AliasChoices, BaseModel, Field
+from typing import Dict, List, Optional
+from transformers import (AutoTokenizer, AutoModelForCausalLM, GenerationConfig, StoppingCriteria,
+                          StoppingCriteriaList, TextIteratorStreamer)
 import uvicorn
+import argparse
+import asyncio
 import json
 import datetime
+import threading
+import traceback
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import torch
+from batch_scheduler import BatchScheduler, QueueFullError
+from prefix_cache import PrefixCache
 
 # 设置设备参数
 DEVICE = "cuda"  # 使用CUDA
@@ -19,37 +31,282 @@ def torch_gc():
             torch.cuda.ipc_collect()  # 收集CUDA内存碎片
 
 
+class MemoryPolicy:
+    """
+    GPU缓存清理策略。清空缓存会丢弃 PyTorch 缓存分配器的内存池，下一个请求需要重新分配显存，因此不宜每个请求都执行
+    mode:
+        never     从不主动清理
+        every_n   每处理 every_n 个请求清理一次
+        watermark 已保留显存占总显存的比例超过 watermark 时清理
+        always    每个请求后都清理（旧行为，仅用于基准对比）
+    """
+
+    MODES = ('never', 'every_n', 'watermark', 'always')
+
+    def __init__(self, mode='watermark', every_n=100, watermark=0.9):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的清理策略: {mode}，可选: {', '.join(self.MODES)}")
+        self.mode = mode
+        self.every_n = every_n
+        self.watermark = watermark
+        self.requests = 0
+        self.collections = 0  # 实际执行清理的次数
+        self._lock = threading.Lock()
+
+    def after_request(self):
+        """每个请求结束后调用，按策略决定是否清理"""
+        with self._lock:
+            self.requests += 1
+            count = self.requests
+        if self._should_collect(count):
+            self.collections += 1
+            torch_gc()
+
+    def _should_collect(self, count):
+        if self.mode == 'always':
+            return True
+        if self.mode == 'every_n':
+            return count % self.every_n == 0
+        if self.mode == 'watermark' and torch.cuda.is_available():
+            reserved = torch.cuda.memory_reserved(CUDA_DEVICE)
+            total = torch.cuda.get_device_properties(CUDA_DEVICE).total_memory
+            return reserved >= self.watermark * total
+        return False
+
+
+class StopOnEvent(StoppingCriteria):
+    """event 被置位（客户端已断开）后停止生成"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+class CompletionRequest(BaseModel):
+    """请求体，由 FastAPI 解析并校验一次，不合法的请求直接返回 422"""
+    prompt: Optional[str] = None
+    messages: Optional[List[Dict[str, str]]] = None
+    # 生成的最大 token 数；all.ChatBot 以 max_tokens 发送，两个名称都接受（同时出现时以 max_length 为准）
+    max_length: int = Field(512, validation_alias=AliasChoices('max_length', 'max_tokens'))
+    temperature: float = 0.7
+    top_p: float = 0.9
+
+    def display_prompt(self):
+        """用于日志的提示词"""
+        if self.prompt is not None:
+            return self.prompt
+        return self.messages[-1].get('content', '') if self.messages else ''
+
+
 # 创建FastAPI应用
 app = FastAPI()
 
+# 以下对象在主函数中初始化
+model = tokenizer = None
+scheduler = None  # 非流式请求的批处理调度器
+generation_executor = None  # 流式请求专用的生成线程池
+admission = None  # 限制同时处理（含排队）的请求数量
+stream_slots = None  # 流式生成名额，与 generation_executor 的线程数相同，占满时直接返回 429 而不在线程池中排队
+load_error = None  # 后台加载模型失败时的异常
+prefix_cache = None  # 提示词前缀的 KV 缓存，为 None 时不启用
+RETRY_AFTER_SECONDS = 5  # 返回 429/503 时建议客户端等待的秒数
+DISCONNECT_POLL_SECONDS = 0.5  # 非流式请求等待生成期间检查客户端是否断开的间隔
+memory_policy = MemoryPolicy()  # GPU缓存清理策略
+
+
+def busy_response(status_code, message):
+    """构建带 Retry-After 的 429/503 响应"""
+    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return JSONResponse(status_code=status_code,
+                        content={"response": message, "status": status_code, "time": time},
+                        headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def load_failed_response():
+    """模型加载失败时的 503 响应；重试没有意义，因此不带 Retry-After"""
+    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return JSONResponse(status_code=503,
+                        content={"response": f"模型加载失败: {load_error}", "status": 503, "time": time})
+
+
+def try_admit():
+    """
+    尝试占用一个并发名额
+    返回 None 表示已占用（处理完成后必须调用 admission.release()），否则返回应直接发给客户端的拒绝响应
+    """
+    if load_error is not None:
+        return load_failed_response()
+    if model is None or scheduler is None:
+        return busy_response(503, "模型尚未加载完成")
+    if not admission.acquire(blocking=False):
+        return busy_response(429, "并发请求数已达上限，请稍后重试")
+    return None
+
+
+# 存活检查：不涉及模型，生成过程中也能立即返回；模型加载失败时返回 503，进程需要重启
+@app.get("/health")
+async def health():
+    if load_error is not None:
+        return load_failed_response()
+    return {"status": "ok"}
+
+
+# 就绪检查：模型已加载且仍有处理能力时返回 200，否则返回 503
+@app.get("/ready")
+async def ready():
+    if load_error is not None:
+        return load_failed_response()
+    if model is None or scheduler is None:
+        return busy_response(503, "模型尚未加载完成")
+    if scheduler.queue_depth >= scheduler.max_queue_size:
+        return busy_response(503, "等待队列已满")
+    status = {"status": "ready", "queue_depth": scheduler.queue_depth}
+    if prefix_cache is not None:
+        status["prefix_cache"] = prefix_cache.stats()
+    return status
+
+
+def build_generation_inputs(item):
+    """根据请求内容构建模型输入张量与生成参数"""
+    prompt = item.prompt  # 获取请求中的提示
+    if prompt is None and not item.messages:
+        raise ValueError("请求必须包含 prompt 或 messages")
+
+    # 构建 messages
+    messages = item.messages or [{"role": "user", "content": prompt}]
+    # 构建输入
+    if hasattr(tokenizer, 'apply_chat_template'):
+        input_tensor = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt")
+        # 新版 transformers 默认返回包含 input_ids 的字典
+        if not isinstance(input_tensor, torch.Tensor):
+            input_tensor = input_tensor["input_ids"]
+    else:
+        input_tensor = tokenizer.encode(prompt, return_tensors="pt")
+    generation_config = {
+        "max_new_tokens": item.max_length,
+        "temperature": item.temperature,
+        "top_p": item.top_p,
+        "do_sample": True
+    }
+    return input_tensor, generation_config
+
+
+# 流式生成端点：每生成一段文本就返回一行 JSON（application/x-ndjson）
+# 中间行为 {"token": "..."}，最后一行为 {"done": true, ...}，出错时为 {"error": "...", "status": 500}
+@app.post("/stream")
+async def stream_item(item: CompletionRequest):
+    rejection = try_admit()
+    if rejection is not None:
+        return rejection
+    # 生成线程全部占用时立即拒绝，不在线程池中无限排队
+    if not stream_slots.acquire(blocking=False):
+        admission.release()
+        return busy_response(429, "流式生成并发数已达上限，请稍后重试")
+
+    def release():
+        stream_slots.release()
+        admission.release()
+
+    try:
+        input_tensor, generation_config = build_generation_inputs(item)
+    except Exception:
+        release()
+        raise
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop = threading.Event()
+    errors = []
+
+    def generate():
+        try:
+            cache_kwargs = {}
+            if prefix_cache is not None:
+                past_key_values = prefix_cache.prefill(model, input_tensor[0])
+                if past_key_values is not None:
+                    cache_kwargs['past_key_values'] = past_key_values
+            model.generate(input_tensor.to(model.device), streamer=streamer,
+                           stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]),
+                           **cache_kwargs, **generation_config)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # 让消费端结束等待
+        finally:
+            # 名额在生成真正结束后才归还，客户端断开后仍在运行的生成也计入并发数
+            release()
+
+    # 在专用线程池中生成；持有 stream_slots 名额的请求才会提交，线程池中不会有排队的任务
+    try:
+        generation_executor.submit(generate)
+    except Exception:
+        release()
+        raise
+
+    def event_stream():
+        try:
+            chunks = []
+            for text in streamer:
+                if text:
+                    chunks.append(text)
+                    yield json.dumps({"token": text}, ensure_ascii=False) + "\n"
+            time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if errors:
+                yield json.dumps({"error": f"请求处理失败: {str(errors[0])}", "status": 500, "time": time},
+                                 ensure_ascii=False) + "\n"
+                return
+            result = ''.join(chunks)
+            print("[" + time + "] " + '", stream prompt:"' + item.display_prompt()[:100] +
+                  '", response:"' + repr(result)[:100] + '"')
+            yield json.dumps({"done": True, "status": 200, "time": time}) + "\n"
+            memory_policy.after_request()
+        finally:
+            # 正常结束或客户端断开（生成器被关闭）时通知生成线程停止
+            stop.set()
+
+    events = event_stream()
+    # 客户端在第一段文本之前断开时生成器从未开始迭代，关闭它不会执行 finally，回收时同样通知停止
+    weakref.finalize(events, stop.set)
+    # 同步生成器由 Starlette 放到线程池中迭代，不阻塞事件循环
+    return StreamingResponse(events, media_type="application/x-ndjson")
+
+
+class ClientDisconnected(Exception):
+    """非流式请求等待生成期间客户端已断开"""
+
+
+async def wait_unless_disconnected(request, scheduled):
+    """
+    等待调度器返回结果，期间定期检查客户端是否断开；
+    FastAPI/uvicorn 不会因客户端断开而取消非流式处理函数，断开时需在这里取消请求，让该行让出批次名额与显存
+    """
+    future = asyncio.wrap_future(scheduled.future)
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return future.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected("客户端已断开")
+    except (ClientDisconnected, asyncio.CancelledError):
+        # 客户端断开或服务关闭时停止该请求的生成；先取消包装的 future，调度器随后设置的结果不再被记录为未取回的异常
+        future.cancel()
+        scheduled.cancel()
+        raise
+
 
 # 处理POST请求的端点
 @app.post("/")
-async def create_item(request: Request):
+async def create_item(item: CompletionRequest, request: Request):
     global model, tokenizer  # 声明全局变量以便在函数内部使用模型和分词器
+    rejection = try_admit()
+    if rejection is not None:
+        return rejection
     try:
-        json_post_raw = await request.json()  # 获取POST请求的JSON数据
-        json_post = json.dumps(json_post_raw)  # 将JSON数据转换为字符串
-        json_post_list = json.loads(json_post)  # 将字符串转换为Python对象
-        prompt = json_post_list.get('prompt')  # 获取请求中的提示
-        max_length = json_post_list.get('max_length', 512)  # 获取请求中的最大长度，默认512
-
-        # 构建 messages
-        messages = json_post_list.get('messages', [{"role": "user", "content": prompt}])
-        # 构建输入
-        if hasattr(tokenizer, 'apply_chat_template'):
-            input_tensor = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt")
-        else:
-            input_tensor = tokenizer.encode(prompt, return_tensors="pt")
-        # 通过模型获得输出
-        generation_config = {
-            "max_new_tokens": max_length,
-            "temperature": json_post_list.get('temperature', 0.7),
-            "top_p": json_post_list.get('top_p', 0.9),
-            "do_sample": True
-        }
-        outputs = model.generate(input_tensor.to(model.device), **generation_config)
-        result = tokenizer.decode(outputs[0][input_tensor.shape[1]:], skip_special_tokens=True)
+        prompt = item.display_prompt()  # 获取请求中的提示
+        input_tensor, generation_config = build_generation_inputs(item)
+        # 交给批处理调度器，与其他并发请求合并为一次 generate，等待期间不阻塞事件循环
+        scheduled = scheduler.submit(input_tensor[0], generation_config)
+        result = await wait_unless_disconnected(request, scheduled)
 
         now = datetime.datetime.now()  # 获取当前时间
         time = now.strftime("%Y-%m-%d %H:%M:%S")  # 格式化时间为字符串
@@ -62,8 +319,15 @@ async def create_item(request: Request):
         # 构建日志信息
         log = "[" + time + "] " + '", prompt:"' + prompt[:100] + '", response:"' + repr(result)[:100] + '"'
         print(log)  # 打印日志
-        torch_gc()  # 执行GPU内存清理
+        memory_policy.after_request()  # 按策略执行GPU内存清理
         return answer  # 返回响应
+    except QueueFullError as e:
+        return busy_response(503, f"服务繁忙: {str(e)}")
+    except ClientDisconnected:
+        time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print("[" + time + "] " + '", prompt:"' + item.display_prompt()[:100] + '", 客户端已断开，已取消生成')
+        # 客户端收不到该响应，状态码沿用 nginx 的 499 便于在访问日志中区分
+        return JSONResponse(status_code=499, content={"response": "客户端已断开", "status": 499, "time": time})
     except Exception as e:
         now = datetime.datetime.now()
         time = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -73,18 +337,71 @@ async def create_item(request: Request):
             "time": time
         }
         return answer
+    finally:
+        admission.release()
 
 
-# 主函数入口
-if __name__ == '__main__':
-    mode_name_or_path = ('/home/wyb/hp/pycharm_projects/nlpcda/deepseek/deepseek-ai/deepseek-llm-7b-chat')
-    # 加载预训练的分词器和模型
+def load_model(mode_name_or_path, device='auto'):
+    """
+    加载分词器和模型
+    device 为 'cpu' 时以 float32 在 CPU 上运行（可配合小模型在无GPU环境中测试），否则按原方式以 bfloat16 自动分配设备
+    """
     tokenizer = AutoTokenizer.from_pretrained(mode_name_or_path, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(mode_name_or_path, trust_remote_code=True, torch_dtype=torch.bfloat16,
-                                                 device_map="auto")
+    if device == 'cpu':
+        model = AutoModelForCausalLM.from_pretrained(mode_name_or_path, trust_remote_code=True,
+                                                     torch_dtype=torch.float32)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(mode_name_or_path, trust_remote_code=True,
+                                                     torch_dtype=torch.bfloat16, device_map="auto")
     model.generation_config = GenerationConfig.from_pretrained(mode_name_or_path)
     model.generation_config.pad_token_id = model.generation_config.eos_token_id
     model.eval()  # 设置模型为评估模式
+    return tokenizer, model
+
+
+# 主函数入口
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DeepSeek 推理服务')
+    parser.add_argument('--model', default='/home/wyb/hp/pycharm_projects/nlpcda/deepseek/deepseek-ai/deepseek-llm-7b-chat',
+                        help='模型路径或名称')
+    parser.add_argument('--device', default='auto', choices=['auto', 'cpu'], help='运行设备')
+    parser.add_argument('--port', type=int, default=6006, help='服务端口')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='单次 generate 合并的最大请求数')
+    parser.add_argument('--max-wait-ms', type=int, default=10, help='等待更多请求加入批次的最长时间（毫秒）')
+    parser.add_argument('--max-queue-size', type=int, default=64, help='等待队列上限，超过时返回 503')
+    parser.add_argument('--max-concurrent', type=int, default=32, help='同时处理（含排队）的请求上限，超过时返回 429')
+    parser.add_argument('--max-stream-workers', type=int, default=4,
+                        help='流式生成线程数，即同时进行的流式生成上限，超过时返回 429（同时受 --max-concurrent 限制）')
+    parser.add_argument('--retry-after', type=int, default=5, help='429/503 响应中的 Retry-After 秒数')
+    parser.add_argument('--prefix-cache-mb', type=int, default=2048, help='提示词前缀 KV 缓存的容量（MB），0 表示不启用')
+    parser.add_argument('--prefix-block-size', type=int, default=16, help='前缀缓存的块大小（token 数）')
+    parser.add_argument('--gc-policy', default='watermark', choices=MemoryPolicy.MODES, help='GPU缓存清理策略')
+    parser.add_argument('--gc-every-n', type=int, default=100, help='every_n 策略的请求间隔')
+    parser.add_argument('--gc-watermark', type=float, default=0.9, help='watermark 策略的显存占用比例阈值')
+    args = parser.parse_args()
+
+    RETRY_AFTER_SECONDS = args.retry_after
+    memory_policy = MemoryPolicy(args.gc_policy, args.gc_every_n, args.gc_watermark)
+    admission = threading.BoundedSemaphore(args.max_concurrent)
+    stream_slots = threading.BoundedSemaphore(args.max_stream_workers)
+    generation_executor = ThreadPoolExecutor(max_workers=args.max_stream_workers, thread_name_prefix='generate')
+    if args.prefix_cache_mb > 0:
+        prefix_cache = PrefixCache(args.prefix_cache_mb << 20, args.prefix_block_size)
+
+    # 在后台线程加载预训练的分词器和模型，加载期间 /health 可用、/ready 返回 503；
+    # 加载失败时记录错误，/health、/ready 与请求端点都返回加载失败的原因
+    def load():
+        global tokenizer, model, scheduler, load_error
+        try:
+            tokenizer, model = load_model(args.model, args.device)
+            scheduler = BatchScheduler(model, tokenizer, args.max_batch_size, args.max_wait_ms,
+                                       args.max_queue_size, prefix_cache)
+        except Exception as e:
+            traceback.print_exc()
+            print("[" + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "] 模型加载失败: " + str(e))
+            load_error = e
+
+    threading.Thread(target=load, daemon=True).start()
     # 启动FastAPI应用
     # 用6006端口可以将autodl的端口映射到本地，从而在本地使用api
-    uvicorn.run(app, host='0.0.0.0', port=6006, workers=1)  # 在指定端口和主机上启动应用
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=args.port, workers=1)  # 在指定端口和主机上启动应用
\ No newline at end of file
@@ -1,41 +1,212 @@
+import argparse
+import importlib
+import itertools
+import json
 import logging
+import os
+import time
+
 import numpy as np
 from sentence_transformers import LoggingHandler, SentenceTransformer
 
-# 打印调试信息到stdout
-np.set_printoptions(threshold=100)
+from dedup import copy_source_map, load_source_map
+from encoder_pool import EncoderPool
+from lexical_index import lexical_index_path_for, write_lexical_index
+from rule_records import rule_table_path_for, write_rule_table
+from rule_store import iter_positional_rules, write_rule_store
+
+faiss_cpu = importlib.import_module('faiss-cpu')
 
 logging.basicConfig(
     format="%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S", level=logging.INFO, handlers=[LoggingHandler()]
 )
+logger = logging.getLogger(__name__)
 
-# 加载预训练的Sentence Transformer模型
-model = SentenceTransformer("all-MiniLM-L6-v2")
 
-# 从文件中读取句子
-def read_sentences_from_file(file_path):
+# 从文件中逐行读取句子
+def iter_sentences(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
-        sentences = file.readlines()
-    return [sentence.strip() for sentence in sentences if sentence.strip()]  # 去掉空行
+        for line in file:
+            sentence = line.strip()
+            if sentence:  # 去掉空行
+                yield sentence
+
+
+def count_sentences(file_path):
+    """统计非空行数量，用于预先确定输出数组的大小"""
+    return sum(1 for _ in iter_sentences(file_path))
+
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _source_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {'source': os.path.abspath(file_path), 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _load_checkpoint(checkpoint_path, fingerprint):
+    """读取检查点，源文件发生变化时视为无效"""
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if any(checkpoint.get(key) != value for key, value in fingerprint.items()):
+        logger.info("源文件已变化，忽略旧的检查点")
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def build_embeddings(model, input_path, output_path, batch_size=1024, encode_batch_size=64, index=None,
+                     index_params=None, train_size=100000, report_interval=10.0):
+    """
+    流式构建句子嵌入：按批编码并写入内存映射的 .npy 文件，每批之后更新检查点，
+    中断后再次运行会从上次完成的位置继续
+
+    参数:
+    model: SentenceTransformer 模型，或 encoder_pool.EncoderPool（此时下一批的编码与本批写盘重叠进行）
+    input_path: str, 规则文本文件路径（每行一条规则）
+    output_path: str, 输出的 .npy 文件路径
+    batch_size: int, 每批读取并写盘的句子数量
+    encode_batch_size: int, 传给 model.encode 的批大小
+    index: 可选的 FAISS 索引，嵌入向量按批增量加入索引
+    index_params: dict, faiss-cpu.py 的索引参数（决定是否归一化）
+    train_size: int, 需要训练的索引使用的样本数量上限
+    report_interval: float, 进度日志的最小间隔（秒）
+
+    返回:
+    np.memmap: 全部嵌入向量
+    """
+    checkpoint_path = output_path + '.ckpt.json'
+    fingerprint = _source_fingerprint(input_path)
+    checkpoint = _load_checkpoint(checkpoint_path, fingerprint)
+    sentences = iter_sentences(input_path)
+
+    if checkpoint is not None and os.path.exists(output_path):
+        embeddings = np.lib.format.open_memmap(output_path, mode='r+')
+        total, rows_done = checkpoint['total'], checkpoint['rows_done']
+        sentences = itertools.islice(sentences, rows_done, None)
+        logger.info(f"从检查点恢复：已完成 {rows_done}/{total} 条")
+    else:
+        total, rows_done = count_sentences(input_path), 0
+        dimension = model.get_sentence_embedding_dimension()
+        embeddings = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=(total, dimension))
+        checkpoint = dict(fingerprint, total=total, rows_done=0)
+        _save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(f"共 {total} 条句子，输出到 {output_path}")
+
+    # 增量写入索引时，先补齐检查点之前已经完成的向量
+    feed_index = index is not None and index.is_trained
+    if feed_index:
+        for start in range(0, rows_done, batch_size):
+            chunk = faiss_cpu.prepare_embeddings(embeddings[start:min(start + batch_size, rows_done)], index_params)
+            faiss_cpu.add_vectors_to_index(index, chunk, verbose=False)
+
+    started = last_report = time.time()
+    start_rows = rows_done
+    for batch, vectors in _encode_batches(model, iter_batches(sentences, batch_size), encode_batch_size):
+        embeddings[rows_done:rows_done + len(batch)] = vectors
+        embeddings.flush()
+        if feed_index:
+            faiss_cpu.add_vectors_to_index(index, faiss_cpu.prepare_embeddings(vectors, index_params), verbose=False)
+        rows_done += len(batch)
+        checkpoint['rows_done'] = rows_done
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+        now = time.time()
+        if now - last_report >= report_interval or rows_done == total:
+            rate = (rows_done - start_rows) / max(now - started, 1e-9)
+            logger.info(f"进度 {rows_done}/{total} ({rows_done / max(total, 1):.1%})，{rate:.1f} 条/秒")
+            last_report = now
+
+    # 需要训练的索引（IVF 等）在全部向量就绪后再训练并分块加入
+    if index is not None and not feed_index:
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(total, min(total, train_size), replace=False))
+        faiss_cpu.train_faiss_index(index, faiss_cpu.prepare_embeddings(embeddings[sample_rows], index_params))
+        for start in range(0, total, batch_size):
+            chunk = faiss_cpu.prepare_embeddings(embeddings[start:start + batch_size], index_params)
+            faiss_cpu.add_vectors_to_index(index, chunk, verbose=False)
+
+    os.remove(checkpoint_path)
+    return embeddings
+
+
+def _encode_batches(model, batches, encode_batch_size):
+    """逐批编码，产出 (句子批, 向量)；编码池提前提交下一批，避免写盘期间工作进程空闲"""
+    if not hasattr(model, 'encode_async'):
+        for batch in batches:
+            yield batch, model.encode(batch, batch_size=encode_batch_size, convert_to_numpy=True)
+        return
+
+    in_flight = None
+    for batch in batches:
+        future = model.encode_async(batch, encode_batch_size)
+        if in_flight is not None:
+            yield in_flight[0], in_flight[1].result()
+        in_flight = (batch, future)
+    if in_flight is not None:
+        yield in_flight[0], in_flight[1].result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式构建规则文本的句子嵌入')
+    parser.add_argument('--input', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parser.add_argument('--output', default='sentence_embeddings.npy', help='嵌入向量输出文件 (.npy)')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence Transformer 模型名称或路径')
+    parser.add_argument('--batch-size', type=int, default=1024, help='每批处理并写盘的句子数量')
+    parser.add_argument('--encode-batch-size', type=int, default=64, help='模型前向计算的批大小')
+    parser.add_argument('--workers', type=int, default=0, help='编码进程数，0 表示在本进程中编码')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='每个编码进程的 PyTorch 线程数')
+    parser.add_argument('--index-output', help='同时构建 FAISS 索引并保存到该路径')
+    parser.add_argument('--index-type', default='flat', choices=faiss_cpu.INDEX_TYPES, help='索引类型')
+    parser.add_argument('--metric', default='l2', choices=faiss_cpu.METRICS, help='距离度量')
+    args = parser.parse_args()
 
-# 加载文件中的句子
-file_path = "similar_words_results_20250116_142217.txt"
-sentences = read_sentences_from_file(file_path)
+    # 加载预训练的Sentence Transformer模型（或启动多进程编码池）
+    if args.workers > 0:
+        model = EncoderPool(args.model, args.workers, args.threads_per_worker, args.encode_batch_size)
+    else:
+        model = SentenceTransformer(args.model)
 
-# 对句子进行嵌入
-sentence_embeddings = model.encode(sentences)
+    index = index_params = None
+    if args.index_output:
+        dimension = model.get_sentence_embedding_dimension()
+        index_params = faiss_cpu.make_index_params(args.index_type, count_sentences(args.input), dimension,
+                                                   args.metric)
+        index = faiss_cpu.create_faiss_index(np.empty((0, dimension), dtype=np.float32), index_params)
 
-# 输出每个句子的嵌入
-for sentence, embedding in zip(sentences, sentence_embeddings):
-    print("句子:", sentence)
-    print("嵌入:", embedding)
-    print("")
+    embeddings = build_embeddings(model, args.input, args.output, args.batch_size, args.encode_batch_size,
+                                  index, index_params)
+    print("嵌入形状:", embeddings.shape)
+    if isinstance(model, EncoderPool):
+        model.log_stats()
+        model.close()
 
-# 保存嵌入到.np 文件
-np.save("sentence_embeddings.npy", sentence_embeddings)
+    if index is not None:
+        faiss_cpu.save_faiss_index(index, args.index_output)
+        faiss_cpu.save_index_params(index_params, args.index_output)
+        write_rule_store(args.index_output + '.rules', iter_positional_rules(args.input), index_params['build_id'])
+        copy_source_map(args.input, args.index_output + '.rules')
+        write_rule_table(rule_table_path_for(args.index_output + '.rules'), iter_positional_rules(args.input),
+                         load_source_map(args.input), index_params['build_id'])
+        write_lexical_index(lexical_index_path_for(args.index_output + '.rules'), iter_positional_rules(args.input),
+                            index_params['build_id'])
 
-# 从.np 文件中加载嵌入
-loaded_embeddings = np.load("sentence_embeddings.npy")
 
-print("加载后的嵌入形状:", loaded_embeddings.shape)
-print("第一个嵌入:", loaded_embeddings[0])  # 查看第一个嵌入
+if __name__ == '__main__':
+    main()
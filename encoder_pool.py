@@ -0,0 +1,319 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(worker_id, model_path, backend, threads, cpus, task_queue, result_queue):
+    """
+    编码进程：限制线程数并绑定 CPU 后再加载编码器（导入 torch 或 onnxruntime），之后循环处理任务队列中的文本块
+    """
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    try:
+        from onnx_encoder import load_encoder
+        if backend == 'torch':
+            import torch
+            torch.set_num_threads(threads)
+        model = load_encoder(backend, model_path, threads)
+        result_queue.put(('ready', worker_id, model.get_sentence_embedding_dimension()))
+    except Exception as e:
+        result_queue.put(('failed', worker_id, f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        task_id, texts, batch_size = task
+        # 通知主进程该任务由本进程处理，本进程意外退出时主进程据此让该任务失败
+        result_queue.put(('started', worker_id, task_id))
+        started = time.perf_counter()
+        try:
+            vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+            result_queue.put(('done', worker_id, task_id, np.asarray(vectors, dtype=np.float32),
+                              time.perf_counter() - started))
+        except Exception as e:
+            result_queue.put(('error', worker_id, task_id, f"{type(e).__name__}: {e}", time.perf_counter() - started))
+
+
+class EncoderPool:
+    """
+    多进程句子编码池：N 个进程各自加载一份模型、固定 intra-op 线程数并绑定到互不重叠的 CPU 上，
+    从共享队列领取文本块，避免多个会话在同一台机器上争抢 PyTorch 线程。
+    encode / get_sentence_embedding_dimension 与 SentenceTransformer 兼容，
+    可以直接传给 embedding-new.py 的 build_embeddings 或 QueryMatchingSystem(encoder=...)
+    """
+
+    def __init__(self, model_path, num_workers=None, threads_per_worker=1, chunk_size=64, pin_cpus=True,
+                 start_timeout=300, backend='torch', health_interval=1.0):
+        """
+        启动编码进程并等待模型加载完成
+        Args:
+            model_path: 模型路径（含义见 onnx_encoder.load_encoder）
+            num_workers: 进程数，默认按可用 CPU 数 // threads_per_worker
+            threads_per_worker: 每个进程的 PyTorch intra-op 线程数
+            chunk_size: 分发给单个进程的文本块大小（也是模型前向的批大小）
+            pin_cpus: 是否把每个进程绑定到各自的 CPU 上（仅 Linux）
+            start_timeout: 等待全部进程加载模型的最长时间（秒）
+            backend: 编码器后端，见 onnx_encoder.ENCODER_BACKENDS
+            health_interval: 检查编码进程是否存活的间隔（秒）；进程意外退出（OOM、段错误）时，
+                它正在处理的任务以 RuntimeError 失败并重启该进程，重启失败且没有存活的进程时编码池不可用
+        """
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+        if num_workers is None:
+            num_workers = max(1, len(cpus) // threads_per_worker)
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        # spawn 启动的子进程不继承父进程中已初始化的 torch 线程池
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._pending = {}  # task_id -> (Future, 文本数)
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {worker_id: {'rows': 0, 'busy': 0.0} for worker_id in range(num_workers)}
+        self._running = {}  # worker_id -> 该进程正在处理的 task_id
+        self._starting = set()  # 已重启、尚未加载完模型的进程
+        self._broken = None  # 编码池不可用的原因
+        self._closing = False
+        self.health_interval = health_interval
+        self.restarts = 0
+
+        self._context = context
+        self._worker_args = (model_path, backend, threads_per_worker)
+        self._worker_cpus = []
+        self._workers = []
+        for worker_id in range(num_workers):
+            worker_cpus = None
+            if pin_cpus and len(cpus) >= num_workers * threads_per_worker:
+                worker_cpus = cpus[worker_id * threads_per_worker:(worker_id + 1) * threads_per_worker]
+            self._worker_cpus.append(worker_cpus)
+            self._workers.append(self._start_worker(worker_id))
+
+        self.dimension = None
+        self._wait_ready(start_timeout)
+        self.started = time.perf_counter()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, worker_id):
+        model_path, backend, threads = self._worker_args
+        process = self._context.Process(target=_worker_main, daemon=True,
+                                        args=(worker_id, model_path, backend, threads, self._worker_cpus[worker_id],
+                                              self._tasks, self._results))
+        process.start()
+        return process
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        for _ in range(self.num_workers):
+            try:
+                message = self._results.get(timeout=max(deadline - time.monotonic(), 0.1))
+            except queue.Empty:
+                self.close()
+                raise RuntimeError(f"编码进程在 {timeout} 秒内未完成模型加载")
+            if message[0] == 'failed':
+                self.close()
+                raise RuntimeError(f"编码进程 {message[1]} 启动失败: {message[2]}")
+            self.dimension = message[2]
+        logger.info(f"编码池已启动：{self.num_workers} 个进程，向量维度 {self.dimension}")
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            try:
+                message = self._results.get(timeout=self.health_interval)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if message:
+                self._handle(message)
+            if time.monotonic() - last_check >= self.health_interval:
+                if not self._check_workers():
+                    return
+                last_check = time.monotonic()
+
+    def _handle(self, message):
+        status, worker_id = message[:2]
+        if status == 'started':
+            with self._lock:
+                self._running[worker_id] = message[2]
+            return
+        if status == 'ready':
+            self._starting.discard(worker_id)
+            logger.info(f"编码进程 {worker_id} 已重启")
+            return
+        if status == 'failed':
+            self._retire(worker_id, f"重启后加载模型失败: {message[2]}")
+            return
+
+        _, _, task_id, payload, elapsed = message
+        with self._lock:
+            if self._running.get(worker_id) == task_id:
+                del self._running[worker_id]
+            entry = self._pending.pop(task_id, None)
+            self._stats[worker_id]['busy'] += elapsed
+            if status == 'done' and entry is not None:
+                self._stats[worker_id]['rows'] += entry[1]
+        if entry is None:
+            return  # 编码池已不可用，任务已经失败
+        if status == 'done':
+            entry[0].set_result(payload)
+        else:
+            entry[0].set_exception(RuntimeError(f"编码进程 {worker_id} 出错: {payload}"))
+
+    def _check_workers(self):
+        """
+        让意外退出的进程正在处理的任务失败，并重启该进程
+        Returns:
+            False 表示编码池正在关闭，收集线程应退出
+        """
+        if self._closing:
+            return True
+        if all(process is None or process.is_alive() for process in self._workers):
+            return True
+        # 退出的进程在退出前发出的消息（如 'started'）可能还在队列中，先处理完再判断它正在处理哪个任务
+        while True:
+            try:
+                message = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                return False
+            self._handle(message)
+
+        for worker_id, process in enumerate(self._workers):
+            if self._closing:
+                return
+            if process is None or process.is_alive():
+                continue
+            with self._lock:
+                task_id = self._running.pop(worker_id, None)
+                entry = self._pending.pop(task_id, None) if task_id is not None else None
+            if entry is not None:
+                entry[0].set_exception(RuntimeError(f"编码进程 {worker_id} 意外退出（exitcode {process.exitcode}）"))
+            if worker_id in self._starting:
+                self._retire(worker_id, f"重启后意外退出（exitcode {process.exitcode}）")
+                continue
+            logger.warning(f"编码进程 {worker_id} 意外退出（exitcode {process.exitcode}），正在重启")
+            self._workers[worker_id] = self._start_worker(worker_id)
+            self._starting.add(worker_id)
+            self.restarts += 1
+        return True
+
+    def _retire(self, worker_id, reason):
+        """不再重启该进程；没有存活的进程时编码池不可用，全部未完成的任务失败"""
+        logger.error(f"编码进程 {worker_id} {reason}，不再重启")
+        self._starting.discard(worker_id)
+        process = self._workers[worker_id]
+        if process is not None:
+            process.join(timeout=1)
+        self._workers[worker_id] = None
+        if any(process is not None for process in self._workers):
+            return
+        error = RuntimeError(f"编码池不可用：全部编码进程已退出（最后一个进程{reason}）")
+        with self._lock:
+            self._broken = error
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future, _ in pending:
+            future.set_exception(error)
+
+    def _submit_chunk(self, texts, batch_size):
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            if self._broken is not None:
+                raise self._broken
+            self._pending[task_id] = (future, len(texts))
+        self._tasks.put((task_id, texts, batch_size))
+        return future
+
+    def encode_async(self, sentences, batch_size=None):
+        """
+        把文本按 chunk_size 切块放入共享队列，立即返回 Future，结果为按原顺序拼接的 float32 矩阵
+        """
+        sentences = list(sentences)
+        batch_size = batch_size or self.chunk_size
+        result = Future()
+        if not sentences:
+            result.set_result(np.empty((0, self.dimension), dtype=np.float32))
+            return result
+
+        chunks = [self._submit_chunk(sentences[start:start + self.chunk_size], batch_size)
+                  for start in range(0, len(sentences), self.chunk_size)]
+        remaining = [len(chunks)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            errors = [chunk.exception() for chunk in chunks if chunk.exception() is not None]
+            if errors:
+                result.set_exception(errors[0])
+            else:
+                result.set_result(np.vstack([chunk.result() for chunk in chunks]))
+
+        for chunk in chunks:
+            chunk.add_done_callback(on_done)
+        return result
+
+    def encode(self, sentences, batch_size=None, convert_to_numpy=True, **kwargs):
+        """与 SentenceTransformer.encode 兼容的同步接口；单个字符串返回一维向量"""
+        if isinstance(sentences, str):
+            return self.encode_async([sentences], batch_size).result()[0]
+        return self.encode_async(sentences, batch_size).result()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def stats(self):
+        """
+        各进程的吞吐：已编码条数、忙碌时间、忙碌期间的条/秒以及占启动以来时间的利用率
+        """
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            return [{'worker': worker_id, 'rows': s['rows'], 'busy_seconds': s['busy'],
+                     'rows_per_second': s['rows'] / s['busy'] if s['busy'] else 0.0,
+                     'utilization': s['busy'] / elapsed if elapsed else 0.0}
+                    for worker_id, s in self._stats.items()]
+
+    def log_stats(self):
+        for s in self.stats():
+            logger.info(f"编码进程 {s['worker']}：{s['rows']} 条，{s['rows_per_second']:.1f} 条/秒，"
+                        f"利用率 {s['utilization']:.0%}")
+
+    def close(self):
+        self._closing = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers:
+            if process is None:
+                continue
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if getattr(self, '_collector', None) is not None:
+            self._results.put(None)
+            self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
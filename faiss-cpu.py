@@ -1,69 +1,249 @@
+import argparse
+import json
+import math
+import uuid
+
 import numpy as np
 import faiss
 
+from rule_store import iter_positional_rules, write_rule_store
+
+# 支持的索引类型
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+# 支持的距离度量：l2 为欧氏距离，ip 为归一化向量上的内积（即余弦相似度）
+METRICS = ('l2', 'ip')
+
+
 # 步骤 1: 加载嵌入向量数据
 def load_embeddings(file_path):
     """加载 .npy 格式的嵌入向量文件"""
     embeddings = np.load(file_path)
     return embeddings
 
+
+def make_index_params(index_type, num_vectors, dimension, metric='l2', nlist=None, nprobe=None, pq_m=None,
+                      pq_nbits=8, hnsw_m=32, ef_construction=40, ef_search=64):
+    """
+    根据数据规模补全索引参数
+    参数:
+    index_type: str, 索引类型 ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+    num_vectors: int, 向量数量
+    dimension: int, 向量维度
+    metric: str, 距离度量 ('l2' 或 'ip')，ip 模式下向量在入库和查询前均做 L2 归一化
+    其余参数为 None 时按数据规模自动选择
+
+    返回:
+    dict: 构建和查询索引所需的全部参数
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    if metric not in METRICS:
+        raise ValueError(f"不支持的距离度量: {metric}，可选: {', '.join(METRICS)}")
+
+    params = {'index_type': index_type, 'dimension': dimension, 'metric': metric, 'normalized': metric == 'ip'}
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        if nlist is None:
+            # 经验值 4*sqrt(N)，同时保证每个聚类中心至少有 39 个训练样本
+            nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        params['nlist'] = nlist
+        params['nprobe'] = nprobe if nprobe is not None else min(nlist, max(1, nlist // 16))
+    if index_type == 'ivf_pq':
+        if pq_m is None:
+            # 每个子量化器负责 8 维
+            pq_m = max(1, dimension // 8)
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} 必须整除向量维度 {dimension}")
+        # 训练样本不足时降低每个子量化器的码本位数
+        while pq_nbits > 1 and num_vectors < 39 * (1 << pq_nbits):
+            pq_nbits -= 1
+        params['pq_m'] = pq_m
+        params['pq_nbits'] = pq_nbits
+    if index_type == 'hnsw':
+        params['M'] = hnsw_m
+        params['efConstruction'] = ef_construction
+        params['efSearch'] = ef_search
+    return params
+
+
 # 步骤 2: 创建 FAISS 索引
-def create_faiss_index(embeddings):
-    """根据嵌入向量创建 FAISS 索引"""
+def create_faiss_index(embeddings, params=None):
+    """根据嵌入向量创建 FAISS 索引（未指定参数时为精确的 L2 索引）"""
     # 获取向量的维度
     dimension = embeddings.shape[1]
+    if params is None:
+        params = make_index_params('flat', embeddings.shape[0], dimension)
 
-    # 创建一个 L2 距离的索引
-    index = faiss.IndexFlatL2(dimension)
+    index_type = params['index_type']
+    metric = faiss.METRIC_INNER_PRODUCT if params.get('metric') == 'ip' else faiss.METRIC_L2
+    if index_type == 'ivf_flat':
+        quantizer = _flat_index(dimension, metric)
+        index = faiss.IndexIVFFlat(quantizer, dimension, params['nlist'], metric)
+        index.nprobe = params['nprobe']
+    elif index_type == 'ivf_pq':
+        quantizer = _flat_index(dimension, metric)
+        index = faiss.IndexIVFPQ(quantizer, dimension, params['nlist'], params['pq_m'], params['pq_nbits'], metric)
+        index.nprobe = params['nprobe']
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['M'], metric)
+        index.hnsw.efConstruction = params['efConstruction']
+        index.hnsw.efSearch = params['efSearch']
+    else:
+        # 创建一个精确检索的索引
+        index = _flat_index(dimension, metric)
     return index
 
+
+def _flat_index(dimension, metric):
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexFlatL2(dimension)
+
+
+def prepare_embeddings(embeddings, params):
+    """转换为 FAISS 需要的连续 float32 数组，内积模式下同时做 L2 归一化"""
+    embeddings = np.array(embeddings, dtype=np.float32, order='C')
+    if params.get('normalized'):
+        faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def train_faiss_index(index, embeddings, sample_size=100000, seed=0):
+    """在嵌入向量的随机样本上训练索引（无需训练的索引直接返回）"""
+    if index.is_trained:
+        return
+    if embeddings.shape[0] > sample_size:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(embeddings.shape[0], sample_size, replace=False))]
+    else:
+        sample = embeddings
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    print(f"索引已在 {sample.shape[0]} 个样本上完成训练")
+
+
 # 步骤 3: 将向量添加到索引中
-def add_vectors_to_index(index, embeddings):
+def add_vectors_to_index(index, embeddings, verbose=True):
     """将嵌入向量添加到 FAISS 索引中"""
     index.add(embeddings)
-    print(f"成功添加 {embeddings.shape[0]} 个向量到索引中")
+    if verbose:
+        print(f"成功添加 {embeddings.shape[0]} 个向量到索引中")
+
+
+def search_parameters(params, nprobe=None, ef_search=None):
+    """
+    构造单次查询的搜索参数，在不修改共享索引的前提下按请求权衡召回率与延迟
+    """
+    index_type = params.get('index_type', 'flat')
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return faiss.SearchParametersIVF(nprobe=nprobe if nprobe is not None else params['nprobe'])
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(efSearch=ef_search if ef_search is not None else params['efSearch'])
+    return None
+
 
 # 步骤 4: 相似度查询
-def search_similar_vectors(index, query_vector, k=5):
+def search_similar_vectors(index, query_vector, k=5, search_params=None):
     """使用 FAISS 查询与给定查询向量最相似的 k 个向量"""
-    distances, indices = index.search(query_vector, k)
+    distances, indices = index.search(query_vector, k, params=search_params)
     return distances, indices
 
+
+def recall_at_k(index, embeddings, params, k=10, num_queries=200, seed=0):
+    """
+    以精确的 Flat 索引为基准，评估近似索引的 recall@k
+    查询向量从语料中随机抽取
+    """
+    rng = np.random.default_rng(seed)
+    num_queries = min(num_queries, embeddings.shape[0])
+    queries = embeddings[rng.choice(embeddings.shape[0], num_queries, replace=False)]
+    k = min(k, embeddings.shape[0])
+
+    flat_params = make_index_params('flat', embeddings.shape[0], embeddings.shape[1], params.get('metric', 'l2'))
+    flat_index = create_faiss_index(embeddings, flat_params)
+    flat_index.add(embeddings)
+    _, exact = flat_index.search(queries, k)
+    _, approx = index.search(queries, k, params=search_parameters(params))
+
+    hits = sum(len(set(e) & set(a[a >= 0])) for e, a in zip(exact, approx))
+    return hits / (num_queries * k)
+
+
 # 步骤 5: 保存和加载 FAISS 索引
 def save_faiss_index(index, file_path):
     """将 FAISS 索引保存到磁盘"""
     faiss.write_index(index, file_path)
     print(f"FAISS 索引已保存到 {file_path}")
 
+
 def load_faiss_index(file_path):
     """从磁盘加载 FAISS 索引"""
     index = faiss.read_index(file_path)
     print(f"FAISS 索引已从 {file_path} 加载")
     return index
 
+
+def save_index_params(params, index_file):
+    """
+    将索引参数保存到索引文件旁的 .json 文件中，供查询端读取；
+    每次保存都会生成新的 build_id，规则存储以此与具体某次构建的索引绑定
+    """
+    params['build_id'] = uuid.uuid4().hex
+    params_file = index_file + '.json'
+    with open(params_file, 'w', encoding='utf-8') as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+    print(f"索引参数已保存到 {params_file}")
+
+
+def load_index_params(index_file):
+    """读取索引参数，旧版本构建的索引没有参数文件，视为 Flat 索引"""
+    try:
+        with open(index_file + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'index_type': 'flat'}
+
+
 # 示例用法
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='构建 FAISS 索引')
+    parser.add_argument('--embeddings', default='sentence_embeddings.npy', help='嵌入向量文件 (.npy)')
+    parser.add_argument('--output', default='faiss_index.index', help='索引输出路径')
+    parser.add_argument('--texts', help='与嵌入向量逐行对应的规则文本文件，指定后同时生成规则存储 <output>.rules')
+    parser.add_argument('--index-type', default='flat', choices=INDEX_TYPES, help='索引类型')
+    parser.add_argument('--metric', default='l2', choices=METRICS, help='距离度量，ip 为归一化向量上的余弦相似度')
+    parser.add_argument('--nlist', type=int, help='IVF 聚类中心数量')
+    parser.add_argument('--nprobe', type=int, help='IVF 默认查询的聚类数量')
+    parser.add_argument('--pq-m', type=int, help='PQ 子量化器数量')
+    parser.add_argument('--pq-nbits', type=int, default=8, help='PQ 每个子量化器的位数')
+    parser.add_argument('--hnsw-m', type=int, default=32, help='HNSW 每个节点的邻居数 M')
+    parser.add_argument('--ef-construction', type=int, default=40, help='HNSW 构建时的 efConstruction')
+    parser.add_argument('--ef-search', type=int, default=64, help='HNSW 默认查询的 efSearch')
+    parser.add_argument('--train-size', type=int, default=100000, help='训练样本数量上限')
+    parser.add_argument('--recall-k', type=int, default=10, help='recall@k 报告中的 k')
+    args = parser.parse_args()
+
     # 1. 加载嵌入向量
-    embeddings_file = 'sentence_embeddings.npy'  # 假设嵌入向量文件为 .npy 格式
-    embeddings = load_embeddings(embeddings_file)
+    embeddings = load_embeddings(args.embeddings)
 
-    # 2. 创建 FAISS 索引
-    index = create_faiss_index(embeddings)
+    # 2. 创建 FAISS 索引并在样本上训练
+    params = make_index_params(args.index_type, embeddings.shape[0], embeddings.shape[1], args.metric, nlist=args.nlist,
+                               nprobe=args.nprobe, pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m,
+                               ef_construction=args.ef_construction, ef_search=args.ef_search)
+    embeddings = prepare_embeddings(embeddings, params)
+    index = create_faiss_index(embeddings, params)
+    train_faiss_index(index, embeddings, args.train_size)
 
     # 3. 添加嵌入向量到 FAISS 索引
     add_vectors_to_index(index, embeddings)
 
-    # 4. 查询最相似的 k 个向量
-    query_vector = np.array([embeddings[12]])  # 假设用第一个向量作为查询向量
-    k = 5  # 返回 5 个最相似的结果
-    distances, indices = search_similar_vectors(index, query_vector, k)
-    print("查询结果:")
-    print("Distances:", distances)
-    print("Indices:", indices)
-
-    # 5. 保存索引
-    faiss_index_file = 'faiss_index.index'
-    save_faiss_index(index, faiss_index_file)
+    # 4. 与精确检索对比，输出 recall@k
+    if args.index_type != 'flat':
+        recall = recall_at_k(index, embeddings, params, args.recall_k)
+        params[f'recall@{args.recall_k}'] = round(recall, 4)
+        print(f"recall@{args.recall_k} (相对 Flat 基准): {recall:.4f}")
 
-    # 6. 加载已保存的索引
-    loaded_index = load_faiss_index(faiss_index_file)
+    # 5. 保存索引及其参数
+    save_faiss_index(index, args.output)
+    save_index_params(params, args.output)
+    if args.texts:
+        count = write_rule_store(args.output + '.rules', iter_positional_rules(args.texts), params['build_id'])
+        print(f"规则存储已保存到 {args.output}.rules，共 {count} 条规则")
@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+from array import array
+
+import numpy as np
+
+from rule_store import iter_positional_rules
+
+# 字符 n-gram BM25 倒排索引，与 FAISS ID 对齐，由以下文件组成（均可内存映射）：
+#   <base>.terms.npy     uint64，升序排列的词项哈希
+#   <base>.offsets.npy   int64，CSR 偏移，词项 i 的倒排表为 postings[offsets[i]:offsets[i + 1]]
+#   <base>.postings.npy  int32，文档位置（第几条规则）
+#   <base>.tfs.npy       uint16，词项在该文档中的出现次数
+#   <base>.doclen.npy    float32，各文档的词项数
+#   <base>.ids.npy       int64，各文档对应的 FAISS ID
+#   <base>.meta.json     文档数、平均长度以及对应索引的 build_id
+LEXICAL_SUFFIXES = ('.terms.npy', '.offsets.npy', '.postings.npy', '.tfs.npy', '.doclen.npy', '.ids.npy', '.meta.json')
+
+# 英文与数字按词切分（"1xRPM"、"RMS"、"4.5"），中文按字符二元组切分（"峭度"、"相位差" -> "相位"、"位差"）
+_ASCII_TOKEN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+_CJK_RUN = re.compile(r'[一-鿿]+')
+
+
+def lexical_index_path_for(base_path):
+    return base_path + '.lex'
+
+
+def lexical_index_exists(base_path):
+    return all(os.path.exists(base_path + suffix) for suffix in LEXICAL_SUFFIXES)
+
+
+def tokenize(text):
+    """把文本切分为词项：英文与数字按词（小写），中文按字符二元组，单字的中文片段保留单字"""
+    text = text.lower()
+    tokens = _ASCII_TOKEN.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def term_hash(token):
+    """词项的 64 位哈希，索引中只保存哈希，不保存词表"""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def write_lexical_index(base_path, items, index_build_id=None):
+    """
+    构建倒排索引
+
+    参数:
+    base_path: str, 索引文件的公共前缀
+    items: 可迭代的 (FAISS ID, 规则文本)
+    index_build_id: str, 对应 FAISS 索引的 build_id，加载时用于校验两者是否匹配
+
+    返回:
+    int: 索引的文档数量
+    """
+    terms, postings, tfs = array('Q'), array('i'), array('H')
+    ids, doc_lengths = array('q'), array('f')
+    for position, (rule_id, text) in enumerate(items):
+        tokens = tokenize(text)
+        counts = {}
+        for token in tokens:
+            h = term_hash(token)
+            counts[h] = counts.get(h, 0) + 1
+        for h, count in counts.items():
+            terms.append(h)
+            postings.append(position)
+            tfs.append(min(count, 65535))
+        ids.append(rule_id)
+        doc_lengths.append(len(tokens))
+
+    terms = np.frombuffer(terms, dtype=np.uint64)
+    order = np.argsort(terms, kind='stable')
+    sorted_terms = terms[order]
+    unique_terms, starts = np.unique(sorted_terms, return_index=True)
+    offsets = np.append(starts, len(sorted_terms)).astype(np.int64)
+    doc_lengths = np.frombuffer(doc_lengths, dtype=np.float32)
+
+    np.save(base_path + '.terms.npy', unique_terms)
+    np.save(base_path + '.offsets.npy', offsets)
+    np.save(base_path + '.postings.npy', np.frombuffer(postings, dtype=np.int32)[order])
+    np.save(base_path + '.tfs.npy', np.frombuffer(tfs, dtype=np.uint16)[order])
+    np.save(base_path + '.doclen.npy', doc_lengths)
+    np.save(base_path + '.ids.npy', np.frombuffer(ids, dtype=np.int64))
+    with open(base_path + '.meta.json', 'w', encoding='utf-8') as f:
+        json.dump({'count': len(ids), 'avg_length': float(doc_lengths.mean()) if len(ids) else 0.0,
+                   'index_build_id': index_build_id}, f)
+    return len(ids)
+
+
+def replace_lexical_index(tmp_base_path, base_path):
+    """用 os.replace 将临时前缀下写好的索引文件替换到正式位置（meta 最后替换）"""
+    for suffix in LEXICAL_SUFFIXES:
+        os.replace(tmp_base_path + suffix, base_path + suffix)
+
+
+class LexicalIndex:
+    """
+    内存映射的 BM25 倒排索引：查询时只读取查询词项的倒排表，按文档累加得分
+    """
+
+    def __init__(self, base_path, expected_build_id=None, k1=1.2, b=0.75):
+        """
+        打开倒排索引
+        Args:
+            base_path: 索引文件的公共前缀
+            expected_build_id: 期望的 FAISS 索引 build_id，不一致时抛出 ValueError
+            k1: BM25 的词频饱和参数
+            b: BM25 的文档长度归一化参数
+        """
+        with open(base_path + '.meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if expected_build_id is not None and self.meta.get('index_build_id') != expected_build_id:
+            raise ValueError(f"倒排索引对应索引 {self.meta.get('index_build_id')}，与当前索引 {expected_build_id} 不一致")
+        self.k1, self.b = k1, b
+        self.terms = np.load(base_path + '.terms.npy', mmap_mode='r')
+        self.offsets = np.load(base_path + '.offsets.npy', mmap_mode='r')
+        self.postings = np.load(base_path + '.postings.npy', mmap_mode='r')
+        self.tfs = np.load(base_path + '.tfs.npy', mmap_mode='r')
+        self.doc_lengths = np.load(base_path + '.doclen.npy', mmap_mode='r')
+        self.ids = np.load(base_path + '.ids.npy', mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['count']
+
+    def search(self, query_text, k, allowed_ids=None):
+        """
+        BM25 检索
+
+        参数:
+        query_text: str, 查询文本
+        k: int, 返回的文档数量
+        allowed_ids: 可选的升序 FAISS ID 数组，只在这些规则中检索
+
+        返回:
+        tuple: (FAISS ID 数组, BM25 得分数组)，按得分降序
+        """
+        query_counts = {}
+        for token in tokenize(query_text):
+            h = term_hash(token)
+            query_counts[h] = query_counts.get(h, 0) + 1
+        if not query_counts or not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        hashes = np.fromiter(query_counts, dtype=np.uint64, count=len(query_counts))
+        weights = np.fromiter(query_counts.values(), dtype=np.float32, count=len(query_counts))
+        slots = np.searchsorted(self.terms, hashes)
+        found = slots < len(self.terms)
+        found[found] = self.terms[slots[found]] == hashes[found]
+
+        documents, contributions = [], []
+        avg_length = self.meta['avg_length'] or 1.0
+        for slot, weight in zip(slots[found], weights[found]):
+            start, end = self.offsets[slot], self.offsets[slot + 1]
+            docs = np.asarray(self.postings[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_lengths[docs]) / avg_length)
+            documents.append(docs)
+            contributions.append(weight * idf * tf * (self.k1 + 1) / (tf + norm))
+        if not documents:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # 稀疏累加：只处理至少命中一个查询词项的文档
+        documents, inverse = np.unique(np.concatenate(documents), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        rule_ids = np.asarray(self.ids[documents])
+        if allowed_ids is not None:
+            keep = np.isin(rule_ids, allowed_ids)
+            rule_ids, scores = rule_ids[keep], scores[keep]
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rule_ids, scores = rule_ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rule_ids[order], scores[order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='由规则文本文件构建 BM25 倒排索引')
+    parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parser.add_argument('--index', default='faiss_index.index', help='对应的 FAISS 索引路径（读取其 build_id）')
+    parser.add_argument('--output', help='索引前缀，默认为 <rules>.lex')
+    args = parser.parse_args()
+
+    build_id = None
+    try:
+        with open(args.index + '.json', 'r', encoding='utf-8') as f:
+            build_id = json.load(f).get('build_id')
+    except FileNotFoundError:
+        pass
+
+    output = args.output or lexical_index_path_for(args.rules)
+    count = write_lexical_index(output, iter_positional_rules(args.rules), build_id)
+    print(f"倒排索引已保存到 {output}，共 {count} 条规则")
+
+
+if __name__ == '__main__':
+    main()
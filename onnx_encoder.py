@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# 导出目录中的文件
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_INT8_MODEL_FILE = 'model.int8.onnx'
+TOKENIZER_FILE = 'tokenizer.json'
+ENCODER_CONFIG_FILE = 'encoder.json'
+
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+def _pooling_mode(model_path):
+    """从 SentenceTransformer 模型目录读取池化方式与是否归一化，兼容新旧两种配置格式"""
+    with open(os.path.join(model_path, 'modules.json'), 'r', encoding='utf-8') as f:
+        modules = json.load(f)
+    pooling, normalize = 'mean', False
+    for module in modules:
+        if module['type'].endswith('Pooling'):
+            with open(os.path.join(model_path, module['path'], 'config.json'), 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            if 'pooling_mode' in config:
+                pooling = config['pooling_mode']
+            elif config.get('pooling_mode_cls_token'):
+                pooling = 'cls'
+            elif config.get('pooling_mode_max_tokens'):
+                pooling = 'max'
+        elif module['type'].endswith('Normalize'):
+            normalize = True
+    if pooling not in ('mean', 'cls', 'max'):
+        raise ValueError(f"不支持的池化方式: {pooling}")
+    return pooling, normalize
+
+
+def export_onnx(model_path, output_dir, quantize=True, opset=17):
+    """
+    把 SentenceTransformer 模型的 Transformer 部分导出为 ONNX，池化与归一化在 OnnxEncoder 中用 numpy 完成
+
+    参数:
+    model_path: str, SentenceTransformer 模型目录
+    output_dir: str, 导出目录
+    quantize: bool, 同时生成 int8 动态量化模型
+    opset: int, ONNX opset 版本
+
+    返回:
+    dict: 写入 encoder.json 的编码器配置
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_path, device='cpu')
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    pooling, normalize = _pooling_mode(model_path)
+
+    sample = tokenizer(['离心泵出口压力频繁波动'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    class HiddenStates(torch.nn.Module):
+        """以位置参数接收输入、只输出 last_hidden_state，便于导出"""
+
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(HiddenStates().eval(), tuple(sample[name] for name in input_names),
+                          os.path.join(output_dir, ONNX_MODEL_FILE), input_names=input_names,
+                          output_names=['last_hidden_state'], dynamic_axes=dynamic_axes, opset_version=opset,
+                          dynamo=False)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(output_dir, ONNX_MODEL_FILE), os.path.join(output_dir, ONNX_INT8_MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+
+    # 只保存 tokenizers 库可以直接加载的 tokenizer.json，查询端无需 transformers
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+    config = {
+        'source': os.path.abspath(model_path),
+        'dimension': model.get_sentence_embedding_dimension(),
+        'max_seq_length': model.max_seq_length,
+        'pooling': pooling,
+        'normalize': normalize,
+        'input_names': input_names,
+        'pad_token_id': tokenizer.pad_token_id or 0,
+        'pad_token': tokenizer.pad_token or '[PAD]',
+        'quantized': quantize,
+    }
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config
+
+
+class OnnxEncoder:
+    """
+    基于 ONNX Runtime 的句子编码器：只依赖 onnxruntime、tokenizers 与 numpy，不导入 torch；
+    encode / get_sentence_embedding_dimension 与 SentenceTransformer 兼容
+    """
+
+    def __init__(self, model_dir, quantized=True, threads=None):
+        """
+        加载 export_onnx 导出的模型
+        Args:
+            model_dir: 导出目录
+            quantized: 使用 int8 量化模型
+            threads: ONNX Runtime 的 intra-op 线程数，None 表示由运行时决定
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        if quantized and not self.config['quantized']:
+            raise ValueError(f"{model_dir} 中没有量化模型，请用 export --quantize 重新导出")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config['pad_token_id'], pad_token=self.config['pad_token'])
+
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file), options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def _encode_batch(self, sentences):
+        encodings = self.tokenizer.encode_batch(sentences)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {'input_ids': ids, 'attention_mask': mask,
+                 'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64)}
+        hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+
+        pooling = self.config['pooling']
+        if pooling == 'cls':
+            vectors = hidden[:, 0]
+        elif pooling == 'max':
+            vectors = np.where(mask[:, :, None].astype(bool), hidden, -1e9).max(axis=1)
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            vectors = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.config['normalize']:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        """与 SentenceTransformer.encode 兼容；按长度排序后分批，减少填充"""
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        sentences = list(sentences)
+        if not sentences:
+            return np.empty((0, self.config['dimension']), dtype=np.float32)
+        order = np.argsort([-len(s) for s in sentences], kind='stable')
+        vectors = np.empty((len(sentences), self.config['dimension']), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            vectors[rows] = self._encode_batch([sentences[i] for i in rows])
+        return vectors
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['dimension']
+
+
+def load_encoder(backend='torch', model_path=None, threads=None):
+    """
+    按后端加载查询编码器
+    参数:
+    backend: str, 'torch'（SentenceTransformer）、'onnx' 或 'onnx-int8'
+    model_path: str, torch 后端为 SentenceTransformer 模型目录，onnx 后端为 export_onnx 的导出目录
+    threads: int, onnx 后端的线程数
+
+    返回:
+    具有 encode / get_sentence_embedding_dimension 的编码器
+    """
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_path)
+    if backend in ('onnx', 'onnx-int8'):
+        return OnnxEncoder(model_path, quantized=backend == 'onnx-int8', threads=threads)
+    raise ValueError(f"不支持的编码器后端: {backend}，可选: {', '.join(ENCODER_BACKENDS)}")
+
+
+def _single_query_latency(encoder, sentences):
+    latencies = []
+    for sentence in sentences:
+        started = time.perf_counter()
+        encoder.encode([sentence])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.percentile(latencies, [50, 99])
+
+
+def _top_k(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def parity_report(model_path, onnx_dir, rules_path, num_queries=500, corpus_size=20000, k=5, seed=0):
+    """
+    比较 ONNX（fp32 / int8）与 PyTorch 编码器：同一句子的余弦偏差，以及用 ONNX 编码查询、
+    在 PyTorch 编码的规则库上检索时与 PyTorch 查询的 top-k 一致率（与线上索引由 PyTorch 构建的情况一致）
+
+    参数:
+    model_path: str, SentenceTransformer 模型目录
+    onnx_dir: str, export_onnx 的导出目录
+    rules_path: str, 规则文本文件
+    num_queries: int, 抽样作为查询的规则数量
+    corpus_size: int, 作为检索库的规则数量上限
+    k: int, top-k
+
+    返回:
+    dict: 各后端的偏差、一致率与单条查询延迟
+    """
+    from sentence_transformers import SentenceTransformer
+
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        rules = [line.strip() for line in f if line.strip()]
+    rng = np.random.default_rng(seed)
+    corpus = [rules[i] for i in np.sort(rng.choice(len(rules), min(corpus_size, len(rules)), replace=False))]
+    queries = [corpus[i] for i in rng.choice(len(corpus), min(num_queries, len(corpus)), replace=False)]
+    k = min(k, len(corpus) - 1)
+
+    def unit(vectors):
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    reference = SentenceTransformer(model_path, device='cpu')
+    corpus_vectors = unit(np.asarray(reference.encode(corpus, batch_size=64), dtype=np.float32))
+    reference_queries = unit(np.asarray(reference.encode(queries, batch_size=64), dtype=np.float32))
+    reference_top = _top_k(corpus_vectors, reference_queries, k)
+
+    report = {'queries': len(queries), 'corpus': len(corpus), 'k': k, 'backends': {}}
+    p50, p99 = _single_query_latency(reference, queries[:100])
+    report['backends']['torch'] = {'latency_ms_p50': p50, 'latency_ms_p99': p99}
+    for backend in ('onnx', 'onnx-int8'):
+        if backend == 'onnx-int8' and not os.path.exists(os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE)):
+            continue
+        encoder = load_encoder(backend, onnx_dir)
+        query_vectors = unit(encoder.encode(queries, batch_size=64))
+        cosine = (query_vectors * reference_queries).sum(axis=1)
+        top = _top_k(corpus_vectors, query_vectors, k)
+        overlap = [len(set(a) & set(b)) / k for a, b in zip(top, reference_top)]
+        p50, p99 = _single_query_latency(encoder, queries[:100])
+        model_file = ONNX_INT8_MODEL_FILE if backend == 'onnx-int8' else ONNX_MODEL_FILE
+        report['backends'][backend] = {
+            'cosine_mean': float(cosine.mean()),
+            'cosine_min': float(cosine.min()),
+            'top1_agreement': float(np.mean(top[:, 0] == reference_top[:, 0])),
+            f'top{k}_overlap': float(np.mean(overlap)),
+            'latency_ms_p50': p50,
+            'latency_ms_p99': p99,
+            'model_mb': os.path.getsize(os.path.join(onnx_dir, model_file)) / 2 ** 20,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检索模型的 ONNX 导出与一致性检查')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出 ONNX 模型（默认同时生成 int8 量化模型）')
+    export_parser.add_argument('--model', required=True, help='SentenceTransformer 模型目录')
+    export_parser.add_argument('--output', required=True, help='导出目录')
+    export_parser.add_argument('--no-quantize', action='store_true', help='不生成 int8 量化模型')
+
+    parity_parser = subparsers.add_parser('parity', help='与 PyTorch 编码器比较余弦偏差、top-k 一致率与延迟')
+    parity_parser.add_argument('--model', required=True, help='SentenceTransformer 模型目录')
+    parity_parser.add_argument('--onnx-dir', required=True, help='导出目录')
+    parity_parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parity_parser.add_argument('--queries', type=int, default=500, help='抽样查询数')
+    parity_parser.add_argument('--corpus-size', type=int, default=20000, help='检索库规则数上限')
+    parity_parser.add_argument('--k', type=int, default=5, help='top-k')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        config = export_onnx(args.model, args.output, quantize=not args.no_quantize)
+        print(f"已导出到 {args.output}：维度 {config['dimension']}，池化 {config['pooling']}，"
+              f"{'含' if config['quantized'] else '不含'} int8 模型")
+    else:
+        report = parity_report(args.model, args.onnx_dir, args.rules, args.queries, args.corpus_size, args.k)
+        print(f"查询 {report['queries']} 条，检索库 {report['corpus']} 条，k={report['k']}")
+        for backend, metrics in report['backends'].items():
+            print(backend + '：' + '，'.join(f"{name}={value:.4f}" if isinstance(value, float) else f"{name}={value}"
+                                            for name, value in metrics.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import copy
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def _cache_tensors(past_key_values):
+    """遍历 KV 缓存中的全部张量，兼容新旧版本 transformers 的 DynamicCache"""
+    if hasattr(past_key_values, 'layers'):
+        for layer in past_key_values.layers:
+            yield from (t for t in (getattr(layer, 'keys', None), getattr(layer, 'values', None)) if t is not None)
+    elif hasattr(past_key_values, 'key_cache'):
+        yield from past_key_values.key_cache
+        yield from past_key_values.value_cache
+    else:
+        for key, value in past_key_values:
+            yield key
+            yield value
+
+
+def _crop(past_key_values, length):
+    """把 KV 缓存截断到前 length 个 token；DynamicCache.crop 的参数在 transformers 5 中改为要移除的 token 数"""
+    excess = past_key_values.get_seq_length() - length
+    if excess <= 0:
+        return past_key_values
+    if 'tokens_to_remove' in inspect.signature(past_key_values.crop).parameters:
+        past_key_values.crop(excess)
+    else:
+        past_key_values.crop(length)
+    return past_key_values
+
+
+class _PrefixEntry:
+    def __init__(self, tokens, block_keys, past_key_values):
+        self.tokens = tokens  # CPU 上的前缀 token，用于排除哈希冲突
+        self.block_keys = block_keys  # 该条目覆盖的各个块边界的前缀哈希
+        self.past_key_values = past_key_values
+        self.nbytes = sum(t.numel() * t.element_size() for t in _cache_tensors(past_key_values))
+
+
+class PrefixCache:
+    """
+    提示词前缀的 KV 缓存：按块（block_size 个 token）对前缀做链式哈希，相同前缀的请求复用已计算的 past_key_values，
+    只对剩余部分做 prefill；条目按 LRU 淘汰，总大小不超过 max_bytes
+    """
+
+    def __init__(self, max_bytes=2 << 30, block_size=16):
+        """
+        初始化前缀缓存
+        Args:
+            max_bytes: KV 张量占用的字节上限
+            block_size: 前缀哈希的块大小，只有完整的块才会被缓存
+        """
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._entries = OrderedDict()  # 前缀哈希 -> _PrefixEntry，按最近使用排序
+        self._blocks = {}  # 块边界的前缀哈希 -> 覆盖该前缀的条目哈希列表（最近加入的在末尾）
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def _block_hashes(self, tokens):
+        """返回 [(前缀长度, 前缀哈希)]，前缀长度为 block_size 的整数倍且至少留下一个 token 给 generate"""
+        hasher = hashlib.blake2b(digest_size=16)
+        data = np.ascontiguousarray(tokens, dtype=np.int64)
+        hashes = []
+        for end in range(self.block_size, len(data), self.block_size):
+            hasher.update(data[end - self.block_size:end].tobytes())
+            hashes.append((end, hasher.copy().hexdigest()))
+        return hashes
+
+    def _lookup(self, tokens, hashes):
+        """返回 (已缓存的最长前缀长度, 对应条目)"""
+        with self._lock:
+            for length, key in reversed(hashes):
+                for entry_key in reversed(self._blocks.get(key, ())):
+                    entry = self._entries[entry_key]
+                    if np.array_equal(entry.tokens[:length], tokens[:length]):
+                        self._entries.move_to_end(entry_key)
+                        self.hits += 1
+                        self.reused_tokens += length
+                        return length, entry
+            self.misses += 1
+        return 0, None
+
+    def _store(self, tokens, hashes, past_key_values):
+        entry = _PrefixEntry(tokens[:hashes[-1][0]].copy(), [key for _, key in hashes], past_key_values)
+        if entry.nbytes > self.max_bytes:
+            return
+        entry_key = hashes[-1][1]
+        with self._lock:
+            if entry_key in self._entries:
+                return
+            self._entries[entry_key] = entry
+            self._bytes += entry.nbytes
+            for key in entry.block_keys:
+                self._blocks.setdefault(key, []).append(entry_key)
+            while self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entry_key, entry = self._entries.popitem(last=False)
+        self._bytes -= entry.nbytes
+        for key in entry.block_keys:
+            owners = self._blocks[key]
+            owners.remove(entry_key)
+            if not owners:
+                del self._blocks[key]
+
+    def prefill(self, model, input_ids):
+        """
+        为一次生成准备 past_key_values：复用最长的已缓存前缀，把其后直到最后一个完整块的部分 prefill 并缓存
+        Args:
+            model: 因果语言模型
+            input_ids: 一维的提示词 token 张量
+        Returns:
+            可直接传给 model.generate 的 past_key_values（调用方独占，generate 会原地追加），前缀不足一个块时返回 None
+        """
+        tokens = input_ids.detach().cpu().numpy()
+        hashes = self._block_hashes(tokens)
+        if not hashes:
+            return None
+
+        cached_length, entry = self._lookup(tokens, hashes)
+        target_length = hashes[-1][0]
+        # 命中的条目可能覆盖更长的前缀，复制后截断到实际匹配的长度
+        past_key_values = _crop(copy.deepcopy(entry.past_key_values), cached_length) if entry is not None else None
+        if cached_length == target_length:
+            return past_key_values
+
+        # 只计算尚未缓存的块，得到的 KV 存入缓存后再复制一份交给 generate
+        with torch.no_grad():
+            outputs = model(input_ids[cached_length:target_length].unsqueeze(0).to(model.device),
+                            past_key_values=past_key_values, use_cache=True)
+        past_key_values = outputs.past_key_values
+        self._store(tokens, hashes, past_key_values)
+        return copy.deepcopy(past_key_values)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0, 'reused_tokens': self.reused_tokens}
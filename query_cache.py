@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# NFKC 不会折叠的中文标点，统一映射为半角形式
+_CJK_PUNCT_TABLE = str.maketrans({
+    '。': '.', '、': ',', '“': '"', '”': '"', '‘': "'", '’': "'",
+    '【': '[', '】': ']', '《': '<', '》': '>', '〈': '<', '〉': '>',
+    '「': '"', '」': '"', '『': '"', '』': '"', '～': '~', '—': '-',
+})
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query_text(text):
+    """
+    归一化查询文本，作为缓存键
+    全角字符折叠为半角（NFKC + 中文标点映射），连续空白折叠为单个空格，并统一为小写
+    （all-MiniLM-L6-v2 的分词器本身不区分大小写）
+    """
+    text = unicodedata.normalize('NFKC', text).translate(_CJK_PUNCT_TABLE)
+    return _WHITESPACE_RE.sub(' ', text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    查询文本 -> 向量 的缓存：内存中为有界 LRU（可选 TTL），可选 SQLite 磁盘层以便进程重启后复用；
+    磁盘层同样受 TTL 与行数上限约束，打开时以及每写入 prune_every 条后删除过期与最旧的行
+    """
+
+    def __init__(self, max_size=10000, ttl=None, persist_path=None, namespace='', max_disk_rows=100000,
+                 prune_every=1000):
+        """
+        初始化向量缓存
+        Args:
+            max_size: 内存中最多保存的向量数量
+            ttl: 缓存有效期（秒），None 表示永不过期
+            persist_path: SQLite 磁盘缓存文件路径，None 表示只使用内存
+            namespace: 缓存命名空间（通常为模型路径），避免不同模型的向量混用
+            max_disk_rows: 磁盘缓存最多保存的行数（整个文件，含其他命名空间），超出时删除最早写入的行
+            prune_every: 每写入多少条执行一次磁盘清理
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.namespace = namespace
+        self.max_disk_rows = max_disk_rows
+        self.prune_every = prune_every
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings '
+                '(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)')
+            self._db.commit()
+            with self._lock:
+                self._prune()
+
+    def _key(self, text):
+        return f'{self.namespace}\0{normalize_query_text(text)}'
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, text):
+        """
+        查找缓存的向量，未命中时返回 None
+        """
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute('SELECT vector, created FROM embeddings WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1]):
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        self._store(key, vector, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return vector
+                    self._db.execute('DELETE FROM embeddings WHERE key = ?', (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, text, vector):
+        """
+        写入缓存（同时写入磁盘层）
+        """
+        key = self._key(text)
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(-1)
+        created = time.time()
+        with self._lock:
+            self._store(key, vector, created)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)',
+                                 (key, vector.tobytes(), created))
+                self._db.commit()
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= self.prune_every:
+                    self._prune()
+
+    def _prune(self):
+        """删除磁盘层中过期的行，以及超出 max_disk_rows 的最早写入的行（调用方持有锁）"""
+        self._puts_since_prune = 0
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM embeddings WHERE created < ?', (time.time() - self.ttl,))
+        if self.max_disk_rows is not None:
+            self._db.execute('DELETE FROM embeddings WHERE key IN '
+                             '(SELECT key FROM embeddings ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                             (self.max_disk_rows,))
+        self._db.commit()
+
+    def _store(self, key, vector, created):
+        self._entries[key] = (vector, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM embeddings')
+                self._db.commit()
+
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class ResponseCache:
+    """
+    LLM 回答缓存：键为组合 prompt 与生成参数的哈希，支持容量上限、TTL、采样请求旁路，
+    并在 FAISS 索引或规则文件发生变化时整体失效
+    """
+
+    def __init__(self, max_size=1000, ttl=3600, allow_sampling=False, watch_paths=()):
+        """
+        初始化回答缓存
+        Args:
+            max_size: 最多缓存的回答数量
+            ttl: 缓存有效期（秒），None 表示永不过期
+            allow_sampling: 为 True 时 temperature > 0 的请求也写入缓存
+            watch_paths: 需要监视的文件（FAISS索引、规则文本等），任一文件变化即清空缓存
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.allow_sampling = allow_sampling
+        self.watch_paths = list(watch_paths)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = self._current_fingerprint()
+
+    @staticmethod
+    def make_key(prompt, params):
+        """
+        由 prompt（字符串或多轮 messages 列表）与生成参数计算缓存键
+        """
+        payload = json.dumps({'prompt': prompt, 'params': params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def cacheable(self, params):
+        """
+        判断给定生成参数的请求是否可以走缓存（采样生成默认不缓存）
+        """
+        return self.allow_sampling or not params.get('temperature')
+
+    def _current_fingerprint(self):
+        fingerprint = []
+        for path in self.watch_paths:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def _check_sources(self):
+        fingerprint = self._current_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def get(self, key):
+        """
+        查找缓存的回答，未命中时返回 None
+        """
+        with self._lock:
+            self._check_sources()
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, created = entry
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """写入回答"""
+        with self._lock:
+            self._check_sources()
+            self._entries[key] = (response, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """手动清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._fingerprint = self._current_fingerprint()
+
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,109 @@
+import argparse
+import ipaddress
+import logging
+import threading
+from multiprocessing.connection import Listener
+
+from encoder_pool import EncoderPool
+from onnx_encoder import ENCODER_BACKENDS
+from all import (QueryBatcher, QueryMatchingSystem, EmbeddingCache, RETRIEVAL_DAEMON_ADDRESS,
+                 RETRIEVAL_DAEMON_AUTHKEY_ENV, RETRIEVAL_DAEMON_AUTHKEY_PATH, encoder_model_path,
+                 embedding_cache_namespace, load_daemon_authkey)
+
+
+class RetrievalDaemon:
+    """
+    本机检索守护进程：常驻加载向量化模型、FAISS索引与规则文本，
+    各前端通过 all.DaemonQueryMatcher 连接后共享同一份热数据；
+    来自不同连接的查询经 QueryBatcher 合并为批量检索
+    """
+
+    def __init__(self, query_matcher, address, authkey):
+        self.query_matcher = query_matcher
+        self.batcher = QueryBatcher(query_matcher)
+        self.listener = Listener(address, authkey=authkey)
+        self.logger = logging.getLogger(__name__)
+
+    def serve_forever(self):
+        self.logger.info(f"检索守护进程已启动，监听 {self.listener.address}")
+        while True:
+            conn = self.listener.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if method == 'process_query':
+                        result = self.batcher.submit(*args, **kwargs)
+                    elif method == 'process_queries':
+                        result = self.query_matcher.process_queries(*args, **kwargs)
+                    elif method == 'describe':
+                        result = self.query_matcher.describe()
+                    else:
+                        raise ValueError(f"未知方法: {method}")
+                    conn.send(('ok', result))
+                except Exception as e:
+                    conn.send(('error', str(e)))
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def resolve_authkey(host, key_file):
+    """
+    守护进程使用的认证密钥：只监听本机地址时，密钥不存在则生成；
+    监听其他地址时必须事先配置密钥（环境变量或密钥文件），并把同一密钥分发给客户端
+    """
+    authkey = load_daemon_authkey(key_file, create=is_loopback(host))
+    if authkey is None:
+        raise SystemExit(f"监听非本机地址 {host} 时必须配置认证密钥：设置环境变量 {RETRIEVAL_DAEMON_AUTHKEY_ENV}，"
+                         f"或创建权限为 0600 的密钥文件 {key_file}")
+    return authkey
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本机检索守护进程')
+    parser.add_argument('--index', default='faiss_index.index', help='FAISS 索引路径')
+    parser.add_argument('--texts', help='规则文本或规则存储，默认为 <index>.rules（存在时）或按行对应的规则文本')
+    parser.add_argument('--host', default=RETRIEVAL_DAEMON_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=RETRIEVAL_DAEMON_ADDRESS[1])
+    parser.add_argument('--key-file', default=RETRIEVAL_DAEMON_AUTHKEY_PATH,
+                        help=f'认证密钥文件（权限须为 0600），环境变量 {RETRIEVAL_DAEMON_AUTHKEY_ENV} 优先')
+    parser.add_argument('--embedding-cache-path', default=None,
+                        help='查询向量磁盘缓存（如 embedding_cache.sqlite），默认只缓存在内存中')
+    parser.add_argument('--embedding-cache-ttl', type=float, default=None, help='查询向量缓存有效期（秒），默认永不过期')
+    parser.add_argument('--embedding-cache-disk-rows', type=int, default=100000, help='磁盘缓存的行数上限')
+    parser.add_argument('--encoder-workers', type=int, default=0, help='查询编码进程数，0 表示在本进程中编码')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='每个编码进程的推理线程数')
+    parser.add_argument('--encoder-backend', default='torch', choices=ENCODER_BACKENDS,
+                        help='查询编码后端；onnx / onnx-int8 需要先用 onnx_encoder.py export 导出模型')
+    parser.add_argument('--model', default=None, help='编码模型路径，默认为所选后端对应的路径')
+    args = parser.parse_args()
+    authkey = resolve_authkey(args.host, args.key_file)
+
+    model_path = args.model or encoder_model_path(args.encoder_backend)
+    embedding_cache = EmbeddingCache(ttl=args.embedding_cache_ttl, persist_path=args.embedding_cache_path,
+                                     max_disk_rows=args.embedding_cache_disk_rows,
+                                     namespace=embedding_cache_namespace(args.encoder_backend, model_path))
+    encoder = None
+    if args.encoder_workers > 0:
+        encoder = EncoderPool(model_path, args.encoder_workers, args.threads_per_worker,
+                              backend=args.encoder_backend)
+    query_matcher = QueryMatchingSystem(args.index, args.texts, embedding_cache, model_path=model_path,
+                                        encoder=encoder, encoder_backend=args.encoder_backend)
+    RetrievalDaemon(query_matcher, (args.host, args.port), authkey).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
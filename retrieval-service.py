@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import logging
+import threading
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from encoder_pool import EncoderPool
+from onnx_encoder import ENCODER_BACKENDS
+from all import (QueryBatcher, QueryMatchingSystem, EmbeddingCache, RETRIEVAL_SERVICE_URL, encoder_model_path,
+                 embedding_cache_namespace)
+
+# 检索服务：常驻一份向量化模型、FAISS索引与规则文本，通过 HTTP 为所有前端提供检索，
+# 可以与 deepseekapi.py 的生成服务分开部署、分别扩容；客户端为 all.HttpQueryMatcher
+app = FastAPI()
+
+query_matcher = None  # 加载完成前为 None
+batcher = None  # 合并 /search 并发请求的微批处理器
+load_error = None  # 后台加载模型或索引失败时的异常
+logger = logging.getLogger(__name__)
+
+
+class SearchOptions(BaseModel):
+    top_k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    min_score: Optional[float] = None
+    component: Optional[str] = None
+    feature: Optional[str] = None
+
+    def search_kwargs(self):
+        """未指定的检索参数使用索引的默认值"""
+        return {name: value for name, value in (('nprobe', self.nprobe), ('ef_search', self.ef_search),
+                                                ('min_score', self.min_score), ('component', self.component),
+                                                ('feature', self.feature)) if value is not None}
+
+
+class SearchRequest(SearchOptions):
+    query: str
+
+
+class SearchBatchRequest(SearchOptions):
+    queries: List[str]
+
+
+def to_result(result):
+    prompt, similar_rules, scores = result
+    return {"prompt": prompt, "rules": similar_rules, "scores": [float(score) for score in scores]}
+
+
+def not_ready():
+    """加载失败时返回失败原因（重试没有意义，不带 Retry-After），仍在加载时返回带 Retry-After 的 503"""
+    if load_error is not None:
+        return JSONResponse(status_code=503, content={"detail": f"检索模型加载失败: {load_error}"})
+    return JSONResponse(status_code=503, content={"detail": "检索模型尚未加载完成"}, headers={"Retry-After": "5"})
+
+
+# 存活检查：加载失败时返回 503，进程需要重启
+@app.get("/health")
+async def health():
+    if load_error is not None:
+        return not_ready()
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    if query_matcher is None:
+        return not_ready()
+    return {"status": "ready"}
+
+
+# 单条检索：并发请求在服务端经 QueryBatcher 合并为一次批量编码与搜索
+@app.post("/search")
+async def search(item: SearchRequest):
+    if batcher is None:
+        return not_ready()
+    result = await asyncio.wrap_future(batcher.submit_async(item.query, item.top_k, **item.search_kwargs()))
+    return to_result(result)
+
+
+# 批量检索：调用方已经攒好一批查询时直接整批处理
+@app.post("/search_batch")
+async def search_batch(item: SearchBatchRequest):
+    if query_matcher is None:
+        return not_ready()
+    results = await run_in_threadpool(query_matcher.process_queries, item.queries, item.top_k,
+                                      **item.search_kwargs())
+    return {"results": [to_result(result) for result in results]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='规则检索 HTTP 服务')
+    parser.add_argument('--index', default='faiss_index.index', help='FAISS 索引路径')
+    parser.add_argument('--texts', help='规则文本或规则存储，默认为 <index>.rules（存在时）或按行对应的规则文本')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(RETRIEVAL_SERVICE_URL.rsplit(':', 1)[1]))
+    parser.add_argument('--embedding-cache-path', default=None,
+                        help='查询向量磁盘缓存（如 embedding_cache.sqlite），默认只缓存在内存中')
+    parser.add_argument('--embedding-cache-ttl', type=float, default=None, help='查询向量缓存有效期（秒），默认永不过期')
+    parser.add_argument('--embedding-cache-disk-rows', type=int, default=100000, help='磁盘缓存的行数上限')
+    parser.add_argument('--encoder-workers', type=int, default=0, help='查询编码进程数，0 表示在本进程中编码')
+    parser.add_argument('--threads-per-worker', type=int, default=1, help='每个编码进程的推理线程数')
+    parser.add_argument('--encoder-backend', default='torch', choices=ENCODER_BACKENDS,
+                        help='查询编码后端；onnx / onnx-int8 需要先用 onnx_encoder.py export 导出模型')
+    parser.add_argument('--model', default=None, help='编码模型路径，默认为所选后端对应的路径')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='单批合并的最大查询数')
+    parser.add_argument('--max-wait-ms', type=int, default=5, help='等待更多查询加入批次的最长时间（毫秒）')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    # 在后台线程加载模型与索引，加载期间 /health 可用、其余端点返回 503；
+    # 加载失败时记录错误，/health、/ready 与检索端点都返回加载失败的原因
+    def load():
+        global query_matcher, batcher, load_error
+        encoder = None
+        try:
+            model_path = args.model or encoder_model_path(args.encoder_backend)
+            embedding_cache = EmbeddingCache(ttl=args.embedding_cache_ttl, persist_path=args.embedding_cache_path,
+                                             max_disk_rows=args.embedding_cache_disk_rows,
+                                             namespace=embedding_cache_namespace(args.encoder_backend, model_path))
+            if args.encoder_workers > 0:
+                encoder = EncoderPool(model_path, args.encoder_workers, args.threads_per_worker,
+                                      backend=args.encoder_backend)
+            matcher = QueryMatchingSystem(args.index, args.texts, embedding_cache, model_path=model_path,
+                                          encoder=encoder, encoder_backend=args.encoder_backend)
+            batcher = QueryBatcher(matcher, args.max_batch_size, args.max_wait_ms)
+            query_matcher = matcher
+        except Exception as e:
+            logger.exception(f"检索模型加载失败: {e}")
+            load_error = e
+            if encoder is not None:
+                encoder.close()
+
+    threading.Thread(target=load, daemon=True).start()
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == '__main__':
+    main()
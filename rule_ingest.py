@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+
+import numpy as np
+import faiss
+
+from dedup import copy_source_map, load_source_map
+from lexical_index import lexical_index_exists, lexical_index_path_for, replace_lexical_index, write_lexical_index
+from rule_records import rule_table_path_for, write_rule_table
+from rule_store import replace_rule_store, write_rule_store
+
+faiss_cpu = importlib.import_module('faiss-cpu')
+
+logger = logging.getLogger(__name__)
+
+# 支持删除向量的索引类型（HNSW 不支持 remove_ids）
+INCREMENTAL_INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq')
+
+
+def rule_hash(text):
+    """规则文本的内容哈希，用于判断规则是否新增、修改或删除"""
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
+
+
+def manifest_path_for(index_path):
+    return index_path + '.manifest.json'
+
+
+def rule_store_path_for(index_path):
+    return index_path + '.rules'
+
+
+def read_rules(rules_path):
+    """
+    读取规则文件，返回 {哈希: 规则文本}，内容相同的行只保留一条
+    """
+    rules = {}
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            text = line.strip()
+            if text:
+                rules.setdefault(rule_hash(text), text)
+    return rules
+
+
+def load_manifest(index_path):
+    """
+    读取规则清单：{'next_id': int, 'ntotal': int, 'rules': {哈希: FAISS ID}}
+    规则文本保存在 <index_path>.rules 规则存储中
+    """
+    try:
+        with open(manifest_path_for(index_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_index_and_manifest(index, params, manifest, rules, index_path, source_map=None):
+    """
+    先把索引、参数文件、规则存储、倒排索引、字段表与清单全部写入临时文件，再连续替换，尽量缩短它们不一致的时间窗口：
+    索引与带新 build_id 的参数文件一起最先替换，随后是按 build_id 校验的规则存储等，清单最后替换。
+    窗口内启动的查询端拿到的是新索引与新参数，规则存储等尚未替换时 build_id 校验失败并报错，不会混用新旧 ID；
+    清单中记录的 ntotal 用于下次增量更新时校验
+    """
+    manifest['ntotal'] = int(index.ntotal)
+    manifest_path = manifest_path_for(index_path)
+    store_path = rule_store_path_for(index_path)
+    index_tmp, manifest_tmp, store_tmp = index_path + '.tmp', manifest_path + '.tmp', store_path + '.tmp'
+
+    faiss.write_index(index, index_tmp)
+    # save_index_params 会生成新的 build_id，写入 <index_tmp>.json
+    build_params = dict(params)
+    faiss_cpu.save_index_params(build_params, index_tmp)
+    items = sorted((rule_id, rules[h]) for h, rule_id in manifest['rules'].items())
+    write_rule_store(store_tmp, items, build_params['build_id'])
+    # BM25 倒排索引按全部规则重建，相对于计算嵌入开销很小
+    lexical_tmp = lexical_index_path_for(store_tmp)
+    write_lexical_index(lexical_tmp, items, build_params['build_id'])
+    # 结构化字段表与规则存储按同一组 FAISS ID 对齐
+    rule_table_tmp = rule_table_path_for(store_tmp)
+    write_rule_table(rule_table_tmp, items, source_map, build_params['build_id'])
+    with open(manifest_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    os.replace(index_tmp, index_path)
+    os.replace(index_tmp + '.json', index_path + '.json')
+    replace_rule_store(store_tmp, store_path)
+    replace_lexical_index(lexical_tmp, lexical_index_path_for(store_path))
+    os.replace(rule_table_tmp, rule_table_path_for(store_path))
+    os.replace(manifest_tmp, manifest_path)
+
+
+def _new_index(params, dimension):
+    base = faiss_cpu.create_faiss_index(np.empty((0, dimension), dtype=np.float32), params)
+    return faiss.IndexIDMap2(base)
+
+
+def _encode(model, texts, params, batch_size=1024):
+    chunks = []
+    for start in range(0, len(texts), batch_size):
+        vectors = model.encode(texts[start:start + batch_size], convert_to_numpy=True)
+        chunks.append(faiss_cpu.prepare_embeddings(vectors, params))
+    return np.vstack(chunks)
+
+
+def ingest(model, rules_path, index_path='faiss_index.index', index_type='flat', metric='ip', rebuild=False):
+    """
+    增量更新索引：只对新增或修改的规则行计算嵌入，删除的规则通过 remove_ids 从索引中移除
+
+    参数:
+    model: SentenceTransformer 模型
+    rules_path: str, 规则文本文件路径
+    index_path: str, FAISS 索引路径（规则清单保存在 <index_path>.manifest.json）
+    index_type: str, 首次构建时的索引类型
+    metric: str, 首次构建时的距离度量
+    rebuild: bool, 忽略已有的索引与规则清单，全部重新构建；index_path 处已有不是由本脚本构建的索引
+        （没有规则清单，如 faiss-cpu.py 构建的位置索引）时，必须指定才会覆盖它
+
+    返回:
+    dict: 本次新增、删除与保留的规则数量
+    """
+    rules = read_rules(rules_path)
+    manifest = None if rebuild else load_manifest(index_path)
+    index = None
+
+    if manifest is None and os.path.exists(index_path) and not rebuild:
+        raise FileExistsError(f"{index_path} 已存在但没有规则清单（不是由增量更新构建的索引），"
+                              f"请换一个 --index 路径，或指定 --rebuild 覆盖它")
+
+    if manifest is not None and os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+        params = faiss_cpu.load_index_params(index_path)
+        if index.ntotal != manifest.get('ntotal'):
+            logger.warning("索引与规则清单不一致，将重新构建")
+            index = None
+
+    if index is None:
+        if index_type not in INCREMENTAL_INDEX_TYPES:
+            raise ValueError(f"增量更新不支持索引类型 {index_type}，可选: {', '.join(INCREMENTAL_INDEX_TYPES)}")
+        dimension = model.get_sentence_embedding_dimension()
+        params = faiss_cpu.make_index_params(index_type, len(rules), dimension, metric)
+        params['id_map'] = True
+        index = _new_index(params, dimension)
+        manifest = {'next_id': 0, 'rules': {}}
+
+    known = manifest['rules']
+    removed = [h for h in known if h not in rules]
+    added = [h for h in rules if h not in known]
+
+    # 1. 删除已不存在的规则
+    if removed:
+        index.remove_ids(np.array([known[h] for h in removed], dtype=np.int64))
+        for h in removed:
+            del known[h]
+
+    # 2. 只对新增（含修改后）的规则计算嵌入
+    if added:
+        vectors = _encode(model, [rules[h] for h in added], params)
+        if not index.is_trained:
+            faiss_cpu.train_faiss_index(index, vectors)
+        ids = np.arange(manifest['next_id'], manifest['next_id'] + len(added), dtype=np.int64)
+        index.add_with_ids(vectors, ids)
+        for h, rule_id in zip(added, ids):
+            known[h] = int(rule_id)
+        manifest['next_id'] += len(added)
+
+    store_path = rule_store_path_for(index_path)
+    if (added or removed or not os.path.exists(index_path) or not os.path.exists(rule_table_path_for(store_path))
+            or not lexical_index_exists(lexical_index_path_for(store_path))):
+        save_index_and_manifest(index, params, manifest, rules, index_path, load_source_map(rules_path))
+    # dedup.py 生成的变体 -> 来源规则映射随规则存储一起放置
+    copy_source_map(rules_path, store_path)
+
+    stats = {'added': len(added), 'removed': len(removed), 'unchanged': len(rules) - len(added)}
+    logger.info(f"增量更新完成：新增 {stats['added']} 条，删除 {stats['removed']} 条，未变 {stats['unchanged']} 条")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='增量更新规则索引')
+    parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parser.add_argument('--index', default='faiss_index.index', help='FAISS 索引路径')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence Transformer 模型名称或路径')
+    parser.add_argument('--index-type', default='flat', choices=INCREMENTAL_INDEX_TYPES, help='首次构建时的索引类型')
+    parser.add_argument('--metric', default='ip', choices=faiss_cpu.METRICS, help='首次构建时的距离度量')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='忽略已有的索引与规则清单全部重新构建（覆盖没有规则清单的已有索引时必须指定）')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(args.model)
+    ingest(model, args.rules, args.index, args.index_type, args.metric, args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
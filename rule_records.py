@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from dedup import load_source_map
+from rule_store import iter_positional_rules
+
+# 规则的结构化字段表（列式存储），与 FAISS ID 对齐，保存在规则文件 / 规则存储旁边的 <base>.table.npz 中：
+#   ids                       int64，每条规则的 FAISS ID
+#   component / failure_mode  int32，指向 components / failure_modes 词表的编码
+#   feature_offsets           int64，CSR 偏移，第 i 条规则的特征量为 feature_codes[offsets[i]:offsets[i + 1]]
+#   feature_codes             int32，指向 features 词表的编码
+#   threshold_offsets         int64，诊断标准中数值阈值的 CSR 偏移
+#   threshold_feature / threshold_op / threshold_value / threshold_unit  各阈值的指标（词表编码）、比较符、数值与单位
+TABLE_SUFFIX = '.table.npz'
+
+# 规则中各字段的标签；同义词增强可能改写标签（如"故障构件""特点量"），此时按字段顺序识别
+FIELD_LABELS = [('component', '故障部件'), ('failure_mode', '故障原因'), ('features', '特征量'), ('criteria', '诊断标准')]
+
+_FIELD = re.compile(r'(\S+?)：(.*?)(?=\s+\S+?：|$)')
+_LIST_SEPARATORS = re.compile(r'[、，,;；]\s*')
+_THRESHOLD = re.compile(r'([^\s；;，,、><≥≤=]+?)\s*(>=|<=|≥|≤|>|<|=)\s*(-?\d+(?:\.\d+)?)\s*([A-Za-z/%°]*)')
+
+
+def rule_table_path_for(base_path):
+    return base_path + TABLE_SUFFIX
+
+
+def parse_rule(text):
+    """
+    把 format_fault_description 生成的规则解析为结构化字段
+
+    参数:
+    text: str, 形如 "故障部件：泵轴  故障原因：轴弯曲  特征量：RMS、1xRPM幅值  诊断标准：RMS > 4.5 mm/s；..." 的规则
+
+    返回:
+    dict: component、failure_mode（字符串），features（特征量列表），criteria（诊断标准原文），
+          thresholds（(指标, 比较符, 数值, 单位) 列表）
+    """
+    fields = {}
+    matches = _FIELD.findall(text.strip())
+    labels = dict((label, name) for name, label in FIELD_LABELS)
+    for position, (label, value) in enumerate(matches):
+        name = labels.get(label)
+        if name is None and position < len(FIELD_LABELS):
+            name = FIELD_LABELS[position][0]
+        if name is not None and name not in fields:
+            fields[name] = value.strip()
+
+    criteria = fields.get('criteria', '')
+    return {
+        'component': fields.get('component', ''),
+        'failure_mode': fields.get('failure_mode', ''),
+        'features': [item for item in _LIST_SEPARATORS.split(fields.get('features', '')) if item],
+        'criteria': criteria,
+        'thresholds': [(name, op, float(value), unit) for name, op, value, unit in _THRESHOLD.findall(criteria)],
+    }
+
+
+class _Vocabulary:
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, value):
+        return self.codes.setdefault(value, len(self.codes))
+
+    def array(self):
+        return np.array(list(self.codes), dtype=str)
+
+
+def write_rule_table(path, items, source_map=None, index_build_id=None):
+    """
+    解析规则并写入列式字段表
+
+    参数:
+    path: str, 输出的 .npz 文件路径
+    items: 可迭代的 (FAISS ID, 规则文本)
+    source_map: 可选的 dedup.SourceMap；同义词增强可能改写部件名等字段，存在映射时按来源规则解析
+    index_build_id: str, 对应 FAISS 索引的 build_id，加载时用于校验两者是否匹配
+
+    返回:
+    int: 写入的规则数量
+    """
+    components, failure_modes, features, metrics, ops, units = (_Vocabulary() for _ in range(6))
+    ids, component_codes, failure_mode_codes = [], [], []
+    feature_offsets, feature_codes = [0], []
+    threshold_offsets, threshold_feature, threshold_op, threshold_value, threshold_unit = [0], [], [], [], []
+
+    for rule_id, text in items:
+        if source_map is not None:
+            text = source_map.source_of(text)[1]
+        record = parse_rule(text)
+        ids.append(rule_id)
+        component_codes.append(components(record['component']))
+        failure_mode_codes.append(failure_modes(record['failure_mode']))
+        feature_codes.extend(features(feature) for feature in record['features'])
+        feature_offsets.append(len(feature_codes))
+        for metric, op, value, unit in record['thresholds']:
+            threshold_feature.append(metrics(metric))
+            threshold_op.append(ops(op))
+            threshold_value.append(value)
+            threshold_unit.append(units(unit))
+        threshold_offsets.append(len(threshold_value))
+
+    # 先写临时文件再替换，np.savez 会自动补 .npz 后缀
+    tmp_path = path[:-len('.npz')] + '.tmp.npz' if path.endswith('.npz') else path + '.tmp.npz'
+    np.savez(tmp_path, index_build_id=np.array(index_build_id or '', dtype=str),
+             ids=np.array(ids, dtype=np.int64),
+             component=np.array(component_codes, dtype=np.int32), components=components.array(),
+             failure_mode=np.array(failure_mode_codes, dtype=np.int32), failure_modes=failure_modes.array(),
+             feature_offsets=np.array(feature_offsets, dtype=np.int64),
+             feature_codes=np.array(feature_codes, dtype=np.int32), features=features.array(),
+             threshold_offsets=np.array(threshold_offsets, dtype=np.int64),
+             threshold_feature=np.array(threshold_feature, dtype=np.int32), threshold_metrics=metrics.array(),
+             threshold_op=np.array(threshold_op, dtype=np.int32), threshold_ops=ops.array(),
+             threshold_value=np.array(threshold_value, dtype=np.float32),
+             threshold_unit=np.array(threshold_unit, dtype=np.int32), threshold_units=units.array())
+    os.replace(tmp_path, path)
+    return len(ids)
+
+
+class RuleTable:
+    """
+    规则字段表：按部件或特征量筛选出 FAISS ID，供 QueryMatchingSystem 在向量搜索前过滤；
+    部件与特征量按子串匹配词表（"轴承" 可以匹配 "轴承" 与 "滚动轴承"）
+    """
+
+    def __init__(self, path, expected_build_id=None):
+        """
+        加载字段表
+        Args:
+            path: 字段表路径
+            expected_build_id: 期望的索引 build_id，与字段表记录的不一致时抛出 ValueError
+        """
+        with np.load(path, allow_pickle=False) as data:
+            self._columns = {name: data[name] for name in data.files}
+        build_id = str(self._columns['index_build_id']) or None
+        if expected_build_id is not None and build_id is not None and build_id != expected_build_id:
+            raise ValueError(f"字段表对应索引 {build_id}，与当前索引 {expected_build_id} 不一致")
+        self.ids = self._columns['ids']
+        self._positions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def components(self):
+        return self._columns['components'].tolist()
+
+    @property
+    def features(self):
+        return self._columns['features'].tolist()
+
+    def _matching_codes(self, vocabulary, value):
+        return np.flatnonzero(np.char.find(self._columns[vocabulary], value) >= 0)
+
+    def select_ids(self, component=None, feature=None):
+        """
+        返回同时满足全部条件的 FAISS ID（升序），未指定任何条件时返回 None
+
+        参数:
+        component: str, 部件名（子串匹配）
+        feature: str, 特征量名（子串匹配），规则的任一特征量匹配即可
+        """
+        if component is None and feature is None:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        if component is not None:
+            mask &= np.isin(self._columns['component'], self._matching_codes('components', component))
+        if feature is not None:
+            offsets = self._columns['feature_offsets']
+            hits = np.isin(self._columns['feature_codes'], self._matching_codes('features', feature))
+            # 每条规则的特征量区间内是否至少有一个命中
+            counts = np.concatenate(([0], np.cumsum(hits)))
+            mask &= counts[offsets[1:]] > counts[offsets[:-1]]
+        return np.sort(self.ids[mask])
+
+    def record(self, rule_id):
+        """按 FAISS ID 返回结构化字段，不存在时抛出 KeyError"""
+        if self._positions is None:
+            self._positions = {int(rule_id): position for position, rule_id in enumerate(self.ids)}
+        position = self._positions[int(rule_id)]
+        c = self._columns
+        start, end = c['feature_offsets'][position:position + 2]
+        t_start, t_end = c['threshold_offsets'][position:position + 2]
+        return {
+            'component': str(c['components'][c['component'][position]]),
+            'failure_mode': str(c['failure_modes'][c['failure_mode'][position]]),
+            'features': [str(c['features'][code]) for code in c['feature_codes'][start:end]],
+            'thresholds': [(str(c['threshold_metrics'][c['threshold_feature'][i]]),
+                            str(c['threshold_ops'][c['threshold_op'][i]]), float(c['threshold_value'][i]),
+                            str(c['threshold_units'][c['threshold_unit'][i]])) for i in range(t_start, t_end)],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='由规则文本文件构建结构化字段表')
+    parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parser.add_argument('--index', default='faiss_index.index', help='对应的 FAISS 索引路径（读取其 build_id）')
+    parser.add_argument('--output', help='字段表路径，默认为 <rules>.table.npz')
+    args = parser.parse_args()
+
+    build_id = None
+    try:
+        with open(args.index + '.json', 'r', encoding='utf-8') as f:
+            build_id = json.load(f).get('build_id')
+    except FileNotFoundError:
+        pass
+
+    output = args.output or rule_table_path_for(args.rules)
+    count = write_rule_table(output, iter_positional_rules(args.rules), load_source_map(args.rules), build_id)
+    print(f"字段表已保存到 {output}，共 {count} 条规则")
+
+
+if __name__ == '__main__':
+    main()
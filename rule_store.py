@@ -0,0 +1,149 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+from array import array
+
+import numpy as np
+
+# 规则存储由三个文件组成：
+#   <base>.offsets.npy  int64 数组，形状 (max_id + 1, 2)，每行为 [起始字节, 字节长度]，长度为 -1 表示该ID不存在
+#   <base>.blob         所有规则文本的 UTF-8 字节顺序拼接
+#   <base>.meta.json    规则数量、blob 的 sha256 以及对应索引的 build_id
+STORE_SUFFIXES = ('.offsets.npy', '.blob', '.meta.json')
+
+
+def rule_store_exists(base_path):
+    return all(os.path.exists(base_path + suffix) for suffix in STORE_SUFFIXES)
+
+
+def write_rule_store(base_path, items, index_build_id=None):
+    """
+    写入规则存储
+    参数:
+    base_path: str, 存储文件的公共前缀
+    items: 可迭代的 (FAISS ID, 规则文本)
+    index_build_id: str, 对应 FAISS 索引的 build_id，加载时用于校验两者是否匹配
+
+    返回:
+    int: 写入的规则数量
+    """
+    ids, starts, lengths = array('q'), array('q'), array('q')
+    digest = hashlib.sha256()
+    position = 0
+    with open(base_path + '.blob', 'wb') as blob:
+        for rule_id, text in items:
+            data = text.encode('utf-8')
+            blob.write(data)
+            digest.update(data)
+            ids.append(rule_id)
+            starts.append(position)
+            lengths.append(len(data))
+            position += len(data)
+
+    table = np.full((max(ids) + 1 if ids else 0, 2), -1, dtype=np.int64)
+    table[np.frombuffer(ids, dtype=np.int64), 0] = np.frombuffer(starts, dtype=np.int64)
+    table[np.frombuffer(ids, dtype=np.int64), 1] = np.frombuffer(lengths, dtype=np.int64)
+    np.save(base_path + '.offsets.npy', table)
+
+    with open(base_path + '.meta.json', 'w', encoding='utf-8') as f:
+        json.dump({'count': len(ids), 'blob_sha256': digest.hexdigest(), 'index_build_id': index_build_id}, f)
+    return len(ids)
+
+
+def replace_rule_store(tmp_base_path, base_path):
+    """用 os.replace 将临时前缀下写好的存储文件替换到正式位置（meta 最后替换）"""
+    for suffix in STORE_SUFFIXES:
+        os.replace(tmp_base_path + suffix, base_path + suffix)
+
+
+class RuleStore:
+    """
+    内存映射的只读规则存储，按 FAISS ID O(1) 查找规则文本；
+    多个进程打开同一存储时共享操作系统页缓存
+    """
+
+    def __init__(self, base_path, expected_build_id=None, verify=False):
+        """
+        打开规则存储
+        Args:
+            base_path: 存储文件的公共前缀
+            expected_build_id: 期望的索引 build_id，不一致时抛出 ValueError
+            verify: 为 True 时重新计算 blob 的 sha256 并校验
+        """
+        with open(base_path + '.meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if expected_build_id is not None and self.meta.get('index_build_id') != expected_build_id:
+            raise ValueError(f"规则存储对应索引 {self.meta.get('index_build_id')}，与当前索引 {expected_build_id} 不一致")
+
+        self._table = np.load(base_path + '.offsets.npy', mmap_mode='r')
+        self._file = open(base_path + '.blob', 'rb')
+        # 空文件无法映射
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.meta['count'] else b''
+
+        if verify and hashlib.sha256(self._blob).hexdigest() != self.meta['blob_sha256']:
+            raise ValueError(f"规则存储 {base_path} 校验失败")
+
+    @property
+    def build_id(self):
+        return self.meta.get('index_build_id')
+
+    def __len__(self):
+        return self.meta['count']
+
+    def __contains__(self, rule_id):
+        return 0 <= rule_id < len(self._table) and self._table[rule_id, 1] >= 0
+
+    def __getitem__(self, rule_id):
+        if rule_id not in self:
+            raise KeyError(rule_id)
+        start, length = self._table[rule_id]
+        return self._blob[start:start + length].decode('utf-8')
+
+    def get(self, rule_id, default=None):
+        return self[rule_id] if rule_id in self else default
+
+    def items(self):
+        """按ID顺序遍历 (ID, 规则文本)"""
+        for rule_id in np.flatnonzero(self._table[:, 1] >= 0):
+            yield int(rule_id), self[int(rule_id)]
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+def iter_positional_rules(texts_path):
+    """按行号（跳过空行）为规则分配ID，与 embedding-new.py / faiss-cpu.py 构建的索引行号一致"""
+    with open(texts_path, 'r', encoding='utf-8') as f:
+        rule_id = 0
+        for line in f:
+            text = line.strip()
+            if text:
+                yield rule_id, text
+                rule_id += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='由规则文本文件构建二进制规则存储')
+    parser.add_argument('--rules', default='similar_words_results_20250116_142217.txt', help='规则文本文件')
+    parser.add_argument('--index', default='faiss_index.index', help='对应的 FAISS 索引路径（读取其 build_id）')
+    parser.add_argument('--output', help='存储前缀，默认为 <index>.rules')
+    args = parser.parse_args()
+
+    build_id = None
+    try:
+        with open(args.index + '.json', 'r', encoding='utf-8') as f:
+            build_id = json.load(f).get('build_id')
+    except FileNotFoundError:
+        pass
+
+    output = args.output or args.index + '.rules'
+    count = write_rule_store(output, iter_positional_rules(args.rules), build_id)
+    print(f"规则存储已保存到 {output}，共 {count} 条规则")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,40 @@
-from nlpcda import Similarword
-from datetime import datetime
+import argparse
+import logging
 
+from augment_stream import augment_stream, write_results
 
-def read_formatted_text(file_path):
+
+def iter_formatted_text(file_path):
     """
-    读取格式化的文本文件，提取故障描述句子
+    逐行读取格式化的文本文件，依次产生故障描述句子（不把整个文件读入内存）
 
     参数:
     file_path: str, 文本文件路径
 
     返回:
-    list: 故障描述句子列表
+    iterator: 故障描述句子
     """
-    sentences = []
     with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        for line in lines:
+        for line in f:
             # 只提取包含"故障部件"的行
             if '故障部件：' in line:
-                sentences.append(line.strip())
-    return sentences
+                yield line.strip()
+
+
+def read_formatted_text(file_path):
+    """
+    读取格式化的文本文件，提取故障描述句子
+
+    参数:
+    file_path: str, 文本文件路径
+
+    返回:
+    list: 故障描述句子列表
+    """
+    return list(iter_formatted_text(file_path))
 
 
-def batch_similar_replace(sentences, create_num=10, change_rate=0.2):
+def batch_similar_replace(sentences, create_num=10, change_rate=0.2, workers=None):
     """
     批量处理多个句子的同义词替换
 
@@ -30,18 +42,29 @@ def batch_similar_replace(sentences, create_num=10, change_rate=0.2):
     sentences: list, 需要进行同义词替换的句子列表
     create_num: int, 每个句子生成的替换结果数量
     change_rate: float, 词语被替换的概率
+    workers: int, 进程数，默认为可用 CPU 数
 
     返回:
     dict: 键为原始句子，值为替换后的句子列表
     """
-    smw = Similarword(create_num=create_num, change_rate=change_rate)
-    results = {}
+    return dict(augment_stream(sentences, create_num, change_rate, workers))
+
 
-    for sentence in sentences:
-        replaced = smw.replace(sentence)
-        results[sentence] = replaced
+def _format_txt(index, original, replacements):
+    # 直接写入原始句子与替换后的句子，每个原始句子与替换结果之间空一行
+    return ''.join(f'{replaced}\n' for replaced in [original] + list(replacements)) + '\n'
 
-    return results
+
+def _format_md(index, original, replacements):
+    return (f'### 原始句子\n{original}\n\n### 替换结果：\n'
+            + ''.join(f'- {replaced}\n' for replaced in replacements) + '\n')
+
+
+# 各输出格式的 (文件头, 单条结果的格式化函数)
+RESULT_FORMATTERS = {
+    'txt': ('', _format_txt),
+    'md': ('# 同义词替换结果\n\n', _format_md),
+}
 
 
 def save_results(results, output_format='txt'):
@@ -52,29 +75,8 @@ def save_results(results, output_format='txt'):
     results: dict, 替换结果字典
     output_format: str, 输出格式 ('txt' 或 'md')
     """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f'similar_words_results_{timestamp}.{output_format}'
-
-    with open(filename, 'w', encoding='utf-8') as f:
-        if output_format == 'md':
-            # Markdown 格式
-            f.write('# 同义词替换结果\n\n')
-            for original, replacements in results.items():
-                f.write(f'### 原始句子\n')
-                f.write(f'{original}\n\n')
-                f.write('### 替换结果：\n')
-                for replaced in replacements:
-                    f.write(f'- {replaced}\n')
-                f.write('\n')
-        else:
-            # TXT 格式
-            for original, replacements in results.items():
-                f.write(f'{original}\n')  # 直接写入原始句子
-                for replaced in replacements:
-                    f.write(f'{replaced}\n')  # 直接写入替换后的句子
-                f.write('\n')  # 每个原始句子与替换结果之间空一行
-
-    return filename
+    filenames, _ = write_results(results.items(), {output_format: RESULT_FORMATTERS[output_format]})
+    return filenames[output_format]
 
 
 def main():
@@ -82,35 +84,48 @@ def main():
     主函数：自动读取文本并进行同义词替换
     """
     # 配置参数
-    input_file = 'equipment_faults_20250116_135636.txt'  # 替换为实际的输入文件名
-    create_num = 10  # 每个句子生成的替换结果数量
-    change_rate = 0.2  # 词语被替换的概率
+    parser = argparse.ArgumentParser(description='对格式化的故障描述做同义词替换')
+    parser.add_argument('input_file', nargs='?', default='equipment_faults_20250116_135636.txt',
+                        help='Excel-formatting.py 生成的文本文件')
+    parser.add_argument('--create-num', type=int, default=10, help='每个句子生成的替换结果数量')
+    parser.add_argument('--change-rate', type=float, default=0.2, help='词语被替换的概率')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为可用 CPU 数')
+    parser.add_argument('--chunksize', type=int, default=32, help='每次分发给进程的句子数')
+    parser.add_argument('--formats', nargs='+', default=['txt', 'md'], choices=sorted(RESULT_FORMATTERS),
+                        help='输出格式')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
 
     try:
-        # 读取格式化文本文件
-        print(f'正在读取文件: {input_file}')
-        sentences = read_formatted_text(input_file)
-        print(f'成功读取 {len(sentences)} 条故障描述')
-
-        # 执行批量替换
+        # 逐行读取、并行替换、边处理边写出所有格式
+        print(f'正在读取文件: {args.input_file}')
         print('正在进行同义词替换...')
-        results = batch_similar_replace(sentences, create_num, change_rate)
+        preview = []
+
+        def with_preview(results):
+            for original, replacements in results:
+                if not preview:
+                    preview.append((original, replacements))
+                yield original, replacements
 
-        # 保存结果
-        txt_file = save_results(results, 'txt')
-        md_file = save_results(results, 'md')
+        results = augment_stream(iter_formatted_text(args.input_file), args.create_num, args.change_rate,
+                                 args.workers, args.chunksize)
+        filenames, count = write_results(with_preview(results),
+                                         {fmt: RESULT_FORMATTERS[fmt] for fmt in args.formats})
 
-        print(f'\n处理完成！结果已保存到以下文件：')
-        print(f'TXT 格式：{txt_file}')
-        print(f'Markdown 格式：{md_file}')
+        print(f'\n处理完成！共处理 {count} 条故障描述，结果已保存到以下文件：')
+        for fmt, filename in filenames.items():
+            print(f'{fmt.upper()} 格式：{filename}')
 
         # 打印预览
-        print('\n结果预览（第一条）：')
-        first_sentence = next(iter(results))
-        print(f'\n原始句子: {first_sentence}')
-        print('替换结果:')
-        for replaced in results[first_sentence][:3]:
-            print(f'- {replaced}')
+        if preview:
+            first_sentence, replacements = preview[0]
+            print('\n结果预览（第一条）：')
+            print(f'\n原始句子: {first_sentence}')
+            print('替换结果:')
+            for replaced in replacements[:3]:
+                print(f'- {replaced}')
 
     except Exception as e:
         print(f'处理过程中出现错误：{str(e)}')
@@ -1,8 +1,7 @@
-from nlpcda import Similarword
-from datetime import datetime
+from augment_stream import augment_stream, write_results
 
 
-def batch_similar_replace(sentences, create_num=10, change_rate=0.2):
+def batch_similar_replace(sentences, create_num=10, change_rate=0.2, workers=None):
     """
     批量处理多个句子的同义词替换
 
@@ -10,18 +9,31 @@ def batch_similar_replace(sentences, create_num=10, change_rate=0.2):
     sentences: list, 需要进行同义词替换的句子列表
     create_num: int, 每个句子生成的替换结果数量
     change_rate: float, 词语被替换的概率
+    workers: int, 进程数，默认为可用 CPU 数
 
     返回:
     dict: 键为原始句子，值为替换后的句子列表
     """
-    smw = Similarword(create_num=create_num, change_rate=change_rate)
-    results = {}
+    return dict(augment_stream(sentences, create_num, change_rate, workers))
 
-    for sentence in sentences:
-        replaced = smw.replace(sentence)
-        results[sentence] = replaced
 
-    return results
+def _format_txt(index, original, replacements):
+    return (f'{index}. 原始句子：\n{original}\n\n替换结果：\n'
+            + ''.join(f'{j}) {replaced}\n' for j, replaced in enumerate(replacements, 1))
+            + '\n' + '-' * 50 + '\n\n')
+
+
+def _format_md(index, original, replacements):
+    return (f'## {index}. 原始句子\n{original}\n\n### 替换结果：\n'
+            + ''.join(f'{j}. {replaced}\n' for j, replaced in enumerate(replacements, 1))
+            + '\n---\n\n')
+
+
+# 各输出格式的 (文件头, 单条结果的格式化函数)
+RESULT_FORMATTERS = {
+    'txt': ('同义词替换结果\n' + '=' * 50 + '\n\n', _format_txt),
+    'md': ('# 同义词替换结果\n\n', _format_md),
+}
 
 
 def save_results(results, output_format='txt'):
@@ -32,33 +44,8 @@ def save_results(results, output_format='txt'):
     results: dict, 替换结果字典
     output_format: str, 输出格式 ('txt' 或 'md')
     """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f'similar_words_results_{timestamp}.{output_format}'
-
-    with open(filename, 'w', encoding='utf-8') as f:
-        if output_format == 'md':
-            # Markdown 格式
-            f.write('# 同义词替换结果\n\n')
-            for i, (original, replacements) in enumerate(results.items(), 1):
-                f.write(f'## {i}. 原始句子\n')
-                f.write(f'{original}\n\n')
-                f.write('### 替换结果：\n')
-                for j, replaced in enumerate(replacements, 1):
-                    f.write(f'{j}. {replaced}\n')
-                f.write('\n---\n\n')
-        else:
-            # TXT 格式
-            f.write('同义词替换结果\n')
-            f.write('=' * 50 + '\n\n')
-            for i, (original, replacements) in enumerate(results.items(), 1):
-                f.write(f'{i}. 原始句子：\n')
-                f.write(f'{original}\n\n')
-                f.write('替换结果：\n')
-                for j, replaced in enumerate(replacements, 1):
-                    f.write(f'{j}) {replaced}\n')
-                f.write('\n' + '-' * 50 + '\n\n')
-
-    return filename
+    filenames, _ = write_results(results.items(), {output_format: RESULT_FORMATTERS[output_format]})
+    return filenames[output_format]
 
 
 # 使用示例
@@ -72,13 +59,12 @@ if __name__ == '__main__':
     # 执行批量替换
     results = batch_similar_replace(test_sentences)
 
-    # 保存结果到文件（可选 txt 或 md 格式）
-    txt_file = save_results(results, 'txt')
-    md_file = save_results(results, 'md')
+    # 保存结果到文件（单次遍历同时写出 txt 和 md 格式）
+    filenames, _ = write_results(results.items(), RESULT_FORMATTERS)
 
     print(f'结果已保存到以下文件：')
-    print(f'TXT 格式：{txt_file}')
-    print(f'Markdown 格式：{md_file}')
+    print(f'TXT 格式：{filenames["txt"]}')
+    print(f'Markdown 格式：{filenames["md"]}')
 
     # 打印结果预览
     print('\n结果预览 >>>>>>')
@@ -27,73 +27,19 @@
 #     prompt = '中国核动力研究设计院简介'
 #     result = get_completion(prompt)
 #     print("回答:", result)
-import requests
-import json
+import argparse
 
-
-class ChatBot:
-    def __init__(self, api_url='http://127.0.0.1:6006', timeout=100):
-        self.api_url = api_url
-        self.timeout = timeout
-        self.conversation_history = []
-
-    def add_to_history(self, role, content):
-        """Add a message to conversation history"""
-        self.conversation_history.append({
-            "role": role,
-            "content": content
-        })
-
-    def get_completion(self, user_input):
-        """Send request to the model with conversation history"""
-        self.add_to_history("user", user_input)
-
-        headers = {'Content-Type': 'application/json'}
-        # 简化请求数据结构
-        data = {
-            "prompt": user_input,  # 直接发送当前输入
-            "max_tokens": 200,
-            "temperature": 0.7
-        }
-
-        try:
-            response = requests.post(
-                url=self.api_url,
-                headers=headers,
-                data=json.dumps(data),
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-
-            # 检查响应是否为JSON格式
-            try:
-                result = response.json()
-            except json.JSONDecodeError:
-                return f"API返回了非JSON格式的响应: {response.text[:100]}"
-
-            # 检查响应中是否包含预期的字段
-            if isinstance(result, dict):
-                model_response = result.get('response')
-                if model_response:
-                    self.add_to_history("assistant", model_response)
-                    return model_response
-                else:
-                    return f"API响应缺少'response'字段。完整响应: {result}"
-            else:
-                return f"API返回了意外的响应格式: {result}"
-
-        except requests.exceptions.RequestException as e:
-            return f"API请求失败: {str(e)}"
-        except Exception as e:
-            return f"发生未预期的错误: {str(e)}"
-
-    def clear_history(self):
-        """Clear conversation history"""
-        self.conversation_history = []
+from all import ChatBot, LLM_TOKENIZER_PATH
 
 
 def main():
-    chatbot = ChatBot()
+    parser = argparse.ArgumentParser(description='DeepSeek 推理服务命令行对话')
+    parser.add_argument('--api-url', nargs='+', default=['http://127.0.0.1:6006'], help='一个或多个推理服务地址')
+    parser.add_argument('--tokenizer', default=LLM_TOKENIZER_PATH, help='推理服务所用模型的分词器路径，用于按 token 数裁剪对话历史')
+    parser.add_argument('--history-tokens', type=int, default=3072, help='每次请求发送的对话历史 token 上限')
+    args = parser.parse_args()
+
+    chatbot = ChatBot(args.api_url, tokenizer=args.tokenizer, history_token_budget=args.history_tokens)
     print("开始对话 (输入 'quit' 结束对话, 输入 'clear' 清除对话历史):")
 
     while True: